@@ -0,0 +1,132 @@
+"""
+Ngôn ngữ điều kiện thành tựu lưu trong Achievement.requirement (JSON).
+
+Một điều kiện là một trong các dạng:
+    {"stat": "total_quizzes", "gte": 10}
+        chỉ số của người chơi (UserStats hoặc "level") so với ngưỡng; chuỗi dùng
+        longest_streak / current_streak (ngày liên tiếp), longest_correct_run / correct_run
+    {"stat": "correct_answers", "gte": 20, "within_days": 7}
+        như trên nhưng chỉ đếm các câu làm trong N ngày gần nhất
+    {"site_stat": "correct_answers", "gte": 10, "sites": 3}
+        có ít nhất 3 địa điểm mà người chơi đúng >= 10 câu (UserSiteStats);
+        "site_id": "..." để chỉ xét một địa điểm
+    {"all": [điều kiện, ...]} / {"any": [điều kiện, ...]}
+Phép so sánh: gte, gt, lte, lt, eq (đúng một phép trong mỗi điều kiện).
+
+compile_rule biên dịch JSON thành cây predicate một lần; inputs của predicate
+là các chỉ số nó phụ thuộc, dùng để chỉ xét lại thành tựu khi chỉ số đó đổi.
+Predicate nhận một context có stat(name), window_stat(name, days), site_stats().
+"""
+import operator
+
+COMPARISONS = {
+    'gte': operator.ge,
+    'gt': operator.gt,
+    'lte': operator.le,
+    'lt': operator.lt,
+    'eq': operator.eq,
+}
+
+# Chỉ số đếm được trong một khoảng thời gian (tính từ QuizAttempt)
+WINDOW_STATS = {'total_quizzes', 'correct_answers', 'total_xp', 'fast_correct'}
+SITE_STATS = {'total_questions', 'correct_answers', 'total_time', 'total_xp'}
+MAX_WINDOW_DAYS = 366
+
+
+class RuleError(ValueError):
+    """requirement không đúng cú pháp"""
+
+
+class _Comparison:
+    def __init__(self, spec, known):
+        ops = [name for name in COMPARISONS if name in spec]
+        if len(ops) != 1:
+            raise RuleError('Mỗi điều kiện cần đúng một phép so sánh: gte, gt, lte, lt, eq')
+        self.op_name = ops[0]
+        self.compare = COMPARISONS[self.op_name]
+        self.threshold = spec[self.op_name]
+        if isinstance(self.threshold, bool) or not isinstance(self.threshold, (int, float)):
+            raise RuleError(f'Ngưỡng của {self.op_name} phải là số')
+        unknown = set(spec) - known - {self.op_name}
+        if unknown:
+            raise RuleError(f'Khóa không hợp lệ: {", ".join(sorted(unknown))}')
+
+
+class StatRule(_Comparison):
+    def __init__(self, spec, stat_names):
+        super().__init__(spec, {'stat'})
+        self.stat = spec['stat']
+        if self.stat not in stat_names:
+            raise RuleError(f'Chỉ số không tồn tại: {self.stat}')
+        self.inputs = frozenset([self.stat])
+
+    def __call__(self, context):
+        return self.compare(context.stat(self.stat), self.threshold)
+
+
+class WindowRule(_Comparison):
+    def __init__(self, spec):
+        super().__init__(spec, {'stat', 'within_days'})
+        self.stat = spec['stat']
+        self.days = spec['within_days']
+        if self.stat not in WINDOW_STATS:
+            raise RuleError(f'within_days chỉ dùng với: {", ".join(sorted(WINDOW_STATS))}')
+        if not isinstance(self.days, int) or not 1 <= self.days <= MAX_WINDOW_DAYS:
+            raise RuleError(f'within_days phải từ 1 đến {MAX_WINDOW_DAYS}')
+        self.inputs = frozenset([self.stat])
+
+    def __call__(self, context):
+        return self.compare(context.window_stat(self.stat, self.days), self.threshold)
+
+
+class SiteRule(_Comparison):
+    def __init__(self, spec):
+        super().__init__(spec, {'site_stat', 'sites', 'site_id'})
+        self.stat = spec['site_stat']
+        self.site_id = spec.get('site_id')
+        self.sites = spec.get('sites', 1)
+        if self.stat not in SITE_STATS:
+            raise RuleError(f'site_stat phải là: {", ".join(sorted(SITE_STATS))}')
+        if not isinstance(self.sites, int) or self.sites < 1:
+            raise RuleError('sites phải là số nguyên >= 1')
+        # Mọi câu trả lời đều làm thay đổi số liệu theo địa điểm
+        self.inputs = frozenset(['total_quizzes'])
+
+    def __call__(self, context):
+        matched = sum(
+            1 for site_id, values in context.site_stats().items()
+            if (self.site_id is None or site_id == self.site_id) and self.compare(values[self.stat], self.threshold)
+        )
+        return matched >= self.sites
+
+
+class AllRule:
+    def __init__(self, rules):
+        self.rules = rules
+        self.inputs = frozenset().union(*(rule.inputs for rule in rules))
+
+    def __call__(self, context):
+        return all(rule(context) for rule in self.rules)
+
+
+class AnyRule(AllRule):
+    def __call__(self, context):
+        return any(rule(context) for rule in self.rules)
+
+
+def compile_rule(spec, stat_names):
+    """Biên dịch requirement thành predicate; stat_names: các chỉ số hợp lệ cho "stat". Raise RuleError"""
+    if not isinstance(spec, dict) or not spec:
+        raise RuleError('Điều kiện phải là object JSON')
+    for key, combinator in (('all', AllRule), ('any', AnyRule)):
+        if key in spec:
+            if len(spec) != 1 or not isinstance(spec[key], list) or not spec[key]:
+                raise RuleError(f'"{key}" phải là danh sách điều kiện không rỗng')
+            return combinator([compile_rule(item, stat_names) for item in spec[key]])
+    if 'site_stat' in spec:
+        return SiteRule(spec)
+    if 'within_days' in spec:
+        return WindowRule(spec)
+    if 'stat' in spec:
+        return StatRule(spec, stat_names)
+    raise RuleError('Điều kiện cần một trong các khóa: stat, site_stat, all, any')
@@ -0,0 +1,238 @@
+"""
+Mở khóa thành tựu theo tập hợp.
+
+Điều kiện của mỗi thành tựu là JSON trong Achievement.requirement
+(achievement_rules), được biên dịch một lần cho mỗi phiên bản requirement và
+đánh chỉ mục theo chỉ số phụ thuộc. Danh sách thành tựu giữ trong bộ nhớ mỗi
+process, nạp lại khi version trong cache tăng (signal khi sửa / xóa Achievement).
+
+Mỗi lần kiểm tra:
+- một truy vấn lấy tập thành tựu user đã mở; chỉ xét các thành tựu còn lại có
+  điều kiện phụ thuộc vào chỉ số vừa thay đổi;
+- một truy vấn đọc dòng UserStats của user (bỏ qua nếu không còn gì để xét;
+  điều kiện theo thời gian / địa điểm đọc thêm khi cần);
+- một bulk_create cho các thành tựu mới và một UPDATE cộng tổng XP thưởng.
+Thành tựu theo level được xét lại trong bộ nhớ sau khi cộng thưởng (thưởng có thể làm lên level).
+"""
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import user_stats
+from .achievement_rules import RuleError, compile_rule
+from .models import Achievement, QuizAttempt, UserAchievement, UserProfile, UserSiteStats
+
+logger = logging.getLogger(__name__)
+
+# Chỉ số thay đổi sau từng loại sự kiện (tham số changed của unlock_achievements)
+QUIZ_ANSWERED = frozenset([
+    'total_quizzes', 'correct_answers', 'total_xp', 'unique_sites', 'fast_correct', 'early_attempts', 'level',
+    'current_streak', 'longest_streak', 'correct_run', 'longest_correct_run',
+])
+BATTLE_FINISHED = frozenset(['battle_wins', 'perfect_battles', 'battles_played', 'level'])
+XP_CHANGED = frozenset(['level'])
+
+STAT_NAMES = frozenset(user_stats.STAT_FIELDS) | {'level'}
+
+REGISTRY_VERSION_KEY = 'heritage:achievements:version'
+
+
+# --- Danh sách thành tựu đã biên dịch ---
+
+class _Registry:
+    def __init__(self, version, achievements, rules):
+        self.version = version
+        self.achievements = achievements  # {id: Achievement}
+        self.rules = rules  # {id: predicate}
+        self.by_input = {}  # {tên chỉ số: [id thành tựu]}
+        for achievement_id, rule in rules.items():
+            for name in rule.inputs:
+                self.by_input.setdefault(name, []).append(achievement_id)
+
+    def candidates(self, changed):
+        """id các thành tựu phụ thuộc vào ít nhất một chỉ số trong changed (None: tất cả)"""
+        if changed is None:
+            return set(self.rules)
+        return {achievement_id for name in changed for achievement_id in self.by_input.get(name, ())}
+
+
+_registry = None
+_compiled = {}  # {id: (requirement đã chuẩn hóa, predicate)}
+_lock = threading.Lock()
+
+
+def _requirement_key(requirement):
+    return json.dumps(requirement, sort_keys=True, ensure_ascii=False)
+
+
+def compile_achievement(achievement):
+    """Predicate của thành tựu; chỉ biên dịch lại khi requirement đổi. Raise RuleError"""
+    key = _requirement_key(achievement.requirement)
+    cached = _compiled.get(achievement.pk)
+    if cached is None or cached[0] != key:
+        cached = (key, compile_rule(achievement.requirement, STAT_NAMES))
+        _compiled[achievement.pk] = cached
+    return cached[1]
+
+
+def get_registry_version():
+    version = cache.get(REGISTRY_VERSION_KEY)
+    if version is None:
+        cache.add(REGISTRY_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(REGISTRY_VERSION_KEY)
+    return version
+
+
+def bump_registry_version():
+    try:
+        cache.incr(REGISTRY_VERSION_KEY)
+    except ValueError:
+        get_registry_version()
+        cache.incr(REGISTRY_VERSION_KEY)
+
+
+def get_registry():
+    global _registry
+    version = get_registry_version()
+    registry = _registry
+    if registry is not None and registry.version == version:
+        return registry
+    with _lock:
+        if _registry is not None and _registry.version == version:
+            return _registry
+        achievements, rules = {}, {}
+        for achievement in Achievement.objects.all():
+            try:
+                rules[achievement.pk] = compile_achievement(achievement)
+            except RuleError as e:
+                logger.warning(f'Bỏ qua thành tựu {achievement.pk} ({achievement.name}): {e}')
+                continue
+            achievements[achievement.pk] = achievement
+        for stale in set(_compiled) - set(achievements):
+            _compiled.pop(stale, None)
+        _registry = _Registry(version, achievements, rules)
+        return _registry
+
+
+@receiver(post_save, sender=Achievement)
+@receiver(post_delete, sender=Achievement)
+def _achievement_changed(sender, instance, **kwargs):
+    bump_registry_version()
+
+
+# --- Số liệu của một người chơi, đọc khi điều kiện cần ---
+
+class RuleContext:
+    def __init__(self, profile):
+        self.profile = profile
+        self.level = profile.level
+        self._stats = None
+        self._windows = {}
+        self._sites = None
+
+    def stat(self, name):
+        if name == 'level':
+            return self.level
+        if self._stats is None:
+            self._stats = user_stats.get_stats(self.profile.user_name)
+        return self._stats[name]
+
+    def window_stat(self, name, days):
+        if days not in self._windows:
+            self._windows[days] = QuizAttempt.objects.filter(
+                user_name=self.profile.user_name, created__gte=timezone.now() - timedelta(days=days)
+            ).aggregate(
+                total_quizzes=Count('id'),
+                correct_answers=Count('id', filter=Q(is_correct=True)),
+                total_xp=Sum('xp_earned'),
+                fast_correct=Count('id', filter=Q(is_correct=True, time_taken__lte=user_stats.FAST_ANSWER_SECONDS)),
+            )
+        return self._windows[days][name] or 0
+
+    def site_stats(self):
+        """{Site.site_id: {total_questions, correct_answers, total_time, total_xp}}"""
+        if self._sites is None:
+            rows = UserSiteStats.objects.filter(user_name=self.profile.user_name).values(
+                'site__site_id', 'total_questions', 'correct_answers', 'total_time', 'total_xp'
+            )
+            self._sites = {row.pop('site__site_id'): row for row in rows}
+        return self._sites
+
+
+def _unlocked_payload(achievement):
+    return {
+        'id': achievement.id,
+        'name': achievement.name,
+        'description': achievement.description,
+        'icon': achievement.icon,
+        'rarity': achievement.rarity,
+        'xp_reward': achievement.xp_reward,
+    }
+
+
+def unlock_achievements(profile, changed=None):
+    """
+    Mở các thành tựu user vừa đạt, cộng XP thưởng và trả về danh sách thành tựu mới mở.
+    changed: tập chỉ số vừa thay đổi (QUIZ_ANSWERED, BATTLE_FINISHED, XP_CHANGED);
+    None = xét mọi thành tựu chưa mở. profile được cập nhật total_xp / level tại chỗ.
+    """
+    registry = get_registry()
+    candidate_ids = registry.candidates(changed)
+    if not candidate_ids:
+        return []
+
+    with transaction.atomic():
+        # Khóa profile để hai request song song không mở (và cộng thưởng) trùng
+        locked = UserProfile.objects.select_for_update().get(pk=profile.pk)
+        candidate_ids -= set(UserAchievement.objects.filter(user=locked).values_list('achievement_id', flat=True))
+        if not candidate_ids:
+            return []
+
+        context = RuleContext(locked)
+        candidates = sorted(candidate_ids)
+        unlocked, reward = [], 0
+        while candidates:
+            newly = [achievement_id for achievement_id in candidates if registry.rules[achievement_id](context)]
+            if not newly:
+                break
+            unlocked.extend(registry.achievements[achievement_id] for achievement_id in newly)
+            reward += sum(registry.achievements[achievement_id].xp_reward for achievement_id in newly)
+            # XP thưởng có thể làm lên level: xét lại các thành tựu theo level còn lại
+            level = UserProfile.level_for_xp(locked.total_xp + reward)
+            if level == context.level:
+                break
+            context.level = level
+            candidates = [
+                achievement_id for achievement_id in candidates
+                if achievement_id not in newly and 'level' in registry.rules[achievement_id].inputs
+            ]
+
+        if not unlocked:
+            return []
+
+        UserAchievement.objects.bulk_create([
+            UserAchievement(user=locked, achievement=achievement) for achievement in unlocked
+        ])
+        if reward:
+            locked.total_xp += reward
+            locked.save(update_fields=['total_xp', 'level'])
+
+    profile.total_xp = locked.total_xp
+    profile.level = locked.level
+    profile._saved_total_xp = locked.total_xp
+    return [_unlocked_payload(achievement) for achievement in unlocked]
+
+
+def on_battle_completed(battle):
+    """Gọi từ battle_lifecycle.complete_battle sau khi chốt hạng: xét thành tựu battle cho người chơi"""
+    for profile in UserProfile.objects.filter(user_name__in=battle.participants or []):
+        unlock_achievements(profile, BATTLE_FINISHED)
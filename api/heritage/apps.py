@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class HeritageConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'heritage'
+
+    def ready(self):
+        # Đăng ký signal làm mới cache bản đồ, cập nhật chỉ mục tìm kiếm, bảng xếp hạng và danh sách thành tựu
+        from . import site_cache, search, leaderboard, achievements  # noqa: F401
+        # Kiểm tra cấu hình khi deploy (cache dùng chung)
+        from . import checks  # noqa: F401
@@ -0,0 +1,172 @@
+"""
+Kênh sự kiện realtime của Quiz Battle (Server-Sent Events).
+
+Sự kiện được ghi vào bảng BattleEvent (để client kết nối lại có thể đọc tiếp
+từ Last-Event-ID) và id sự kiện mới nhất được ghi vào cache dùng chung
+sau khi commit. Con trỏ của mỗi kết nối (log_cursor.IdCursor) đọc lại cửa sổ
+an toàn phía sau nên sự kiện commit muộn hơn sự kiện có id lớn hơn không bị mất.
+Mỗi kết nối SSE chỉ đọc key cache đó theo chu kỳ, chỉ truy vấn database
+khi thật sự có sự kiện mới.
+
+Chạy dưới ASGI (uvicorn worker) thì mỗi kết nối chờ là một coroutine, không
+chiếm một sync worker của gunicorn; dưới WSGI (runserver) dùng generator đồng bộ.
+"""
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+
+from .log_cursor import IdCursor
+from .models import BattleEvent, BattleSolveState, BattleAnswer
+
+POLL_INTERVAL = 0.5         # giây giữa hai lần kiểm tra sự kiện mới
+HEARTBEAT_INTERVAL = 15     # giây - comment giữ kết nối qua proxy
+STREAM_MAX_SECONDS = 300    # đóng stream định kỳ, EventSource tự kết nối lại
+RETRY_MS = 2000
+LAST_EVENT_KEY = 'heritage:battle:{battle_id}:last_event'
+
+FINISHED_STATUSES = ('completed', 'cancelled')
+
+
+# --- Snapshot trạng thái battle (dùng chung cho API polling và sự kiện) ---
+
+def leaderboard_payload(battle):
+    """Bảng xếp hạng realtime của battle"""
+    participants = battle.battle_participants.all().order_by('-score', 'time_completed')
+    return {
+        'battle_id': battle.id,
+        'status': battle.status,
+        'leaderboard': [{
+            'rank': idx,
+            'user_name': p.user_name,
+            'score': p.score,
+            'correct_answers': p.correct_answers,
+            'time_completed': p.time_completed,
+            'finished': p.finished_at is not None,
+        } for idx, p in enumerate(participants, 1)],
+    }
+
+
+def question_status_payload(battle):
+    """Trạng thái câu hỏi hiện tại của battle (đọc một dòng BattleSolveState)"""
+    if battle.status != 'in_progress':
+        return {
+            'battle_id': battle.id,
+            'status': battle.status,
+            'current_question_index': 0,
+            'question_solved': False,
+            'solved_by': None,
+            'correct_answer': None
+        }
+
+    state = BattleSolveState.objects.filter(battle=battle).first()
+    if state is None:
+        state = solve_state_from_answers(battle)
+    return {
+        'battle_id': battle.id,
+        'status': battle.status,
+        'current_question_index': state.current_question_index,
+        'question_solved': state.solved_by is not None,
+        'solved_by': state.solved_by,
+        'correct_answer': state.correct_answer,
+        'total_questions': len(battle.questions)
+    }
+
+
+def solve_state_from_answers(battle):
+    """Dựng BattleSolveState (chưa lưu) từ bảng BattleAnswer, dùng khi battle chưa có dòng trạng thái"""
+    state = BattleSolveState(battle=battle)
+    first_solves = BattleAnswer.objects.filter(battle=battle, is_correct=True).order_by(
+        'quiz_id', 'answered_at', 'id'
+    ).values_list('quiz_id', 'participant__user_name', 'quiz__correct_answer')
+    for quiz_id, user_name, correct_answer in first_solves:
+        state.record_solve(battle.questions, quiz_id, user_name, correct_answer)
+    return state
+
+
+def solve_state_for_update(battle):
+    """Dòng BattleSolveState của battle, đã khoá; gọi trong transaction"""
+    state = BattleSolveState.objects.select_for_update().filter(battle=battle).first()
+    if state is None:
+        state = solve_state_from_answers(battle)
+        state.save()
+    return state
+
+
+# --- Phát sự kiện ---
+
+def publish(battle, event_type, data):
+    """Ghi sự kiện và báo cho các kết nối SSE đang chờ"""
+    event = BattleEvent.objects.create(battle=battle, event_type=event_type, data=data)
+    transaction.on_commit(lambda: cache.set(LAST_EVENT_KEY.format(battle_id=battle.id), event.id, 60 * 60 * 24))
+    return event
+
+
+def publish_status_changed(battle):
+    publish(battle, 'status-changed', {'battle_id': battle.id, 'status': battle.status})
+
+
+def publish_ranks_changed(battle):
+    publish(battle, 'rank-changed', leaderboard_payload(battle))
+
+
+# --- Stream SSE ---
+
+def format_event(event, last_id=None):
+    """last_id: con trỏ của kết nối (Last-Event-ID khi kết nối lại), mặc định id của sự kiện"""
+    data = json.dumps(event.data, ensure_ascii=False, default=str)
+    return f'id: {last_id or event.id}\nevent: {event.event_type}\ndata: {data}\n\n'
+
+
+def _events_after(battle_id, cursor):
+    return list(cursor.filter(BattleEvent.objects.filter(battle_id=battle_id)))
+
+
+def _is_final(event):
+    return event.event_type == 'status-changed' and event.data.get('status') in FINISHED_STATUSES
+
+
+def stream_events(battle_id, last_id):
+    """Generator đồng bộ (WSGI)"""
+    key = LAST_EVENT_KEY.format(battle_id=battle_id)
+    cursor = IdCursor(last_id)
+    started = last_beat = time.monotonic()
+    yield f'retry: {RETRY_MS}\n\n'
+
+    while time.monotonic() - started < STREAM_MAX_SECONDS:
+        if cursor.pending(cache.get(key)):
+            for event in _events_after(battle_id, cursor):
+                if not cursor.advance(event.id):
+                    continue
+                yield format_event(event, cursor.last_id)
+                if _is_final(event):
+                    return
+        elif time.monotonic() - last_beat >= HEARTBEAT_INTERVAL:
+            last_beat = time.monotonic()
+            yield ': heartbeat\n\n'
+        time.sleep(POLL_INTERVAL)
+
+
+async def astream_events(battle_id, last_id):
+    """Generator bất đồng bộ (ASGI) - kết nối chờ không giữ thread"""
+    key = LAST_EVENT_KEY.format(battle_id=battle_id)
+    events_after = sync_to_async(_events_after)
+    cursor = IdCursor(last_id)
+    started = last_beat = time.monotonic()
+    yield f'retry: {RETRY_MS}\n\n'
+
+    while time.monotonic() - started < STREAM_MAX_SECONDS:
+        if cursor.pending(await cache.aget(key)):
+            for event in await events_after(battle_id, cursor):
+                if not cursor.advance(event.id):
+                    continue
+                yield format_event(event, cursor.last_id)
+                if _is_final(event):
+                    return
+        elif time.monotonic() - last_beat >= HEARTBEAT_INTERVAL:
+            last_beat = time.monotonic()
+            yield ': heartbeat\n\n'
+        await asyncio.sleep(POLL_INTERVAL)
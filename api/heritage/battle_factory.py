@@ -0,0 +1,165 @@
+"""
+Tạo battle hàng loạt (giải đấu cả trường / cả lớp).
+
+- Người chơi lấy từ snapshot bảng xếp hạng XP trong cache, không tính lại
+  tổng XP (UserStats) mỗi lần tạo battle.
+- Câu hỏi được chọn ngẫu nhiên theo khoảng id (rejection sampling), không
+  nạp toàn bộ id của bảng Quiz vào bộ nhớ.
+- Mọi battle và người chơi được tạo bằng bulk_create trong một transaction.
+"""
+import random
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min
+
+from .models import Quiz, QuizBattle, QuizBattleParticipant, UserStats
+
+XP_LEADERBOARD_KEY = 'heritage:battles:xp_leaderboard'
+XP_LEADERBOARD_TIMEOUT = 5 * 60  # snapshot được phép cũ tối đa 5 phút
+XP_LEADERBOARD_SIZE = 2000
+
+MIN_GROUP_SIZE = 2
+MAX_GROUP_SIZE = 8
+MAX_GROUP_COUNT = XP_LEADERBOARD_SIZE // MIN_GROUP_SIZE
+
+SAMPLE_ROUNDS = 4
+MAX_SAMPLE_DRAWS = 5000  # giới hạn số tham số của id__in mỗi truy vấn
+QUESTION_POOL_LIMIT = 2000
+
+
+def xp_leaderboard_snapshot():
+    """[(user_name, total_xp), ...] theo XP giảm dần, chỉ gồm người có XP > 0"""
+    snapshot = cache.get(XP_LEADERBOARD_KEY)
+    if snapshot is None:
+        snapshot = list(
+            UserStats.objects.filter(total_xp__gt=0).order_by('-total_xp', 'user_name').values_list(
+                'user_name', 'total_xp'
+            )[:XP_LEADERBOARD_SIZE]
+        )
+        cache.set(XP_LEADERBOARD_KEY, snapshot, XP_LEADERBOARD_TIMEOUT)
+    return snapshot
+
+
+def _quiz_id_range():
+    stats = Quiz.objects.aggregate(low=Min('id'), high=Max('id'), total=Count('id'))
+    return stats['low'], stats['high'], stats['total']
+
+
+def _draw_quiz_ids(count, low, high, total, rng):
+    """count id khác nhau có thật trong bảng Quiz, chọn đều trong [low, high]"""
+    chosen = set()
+    span = high - low + 1
+    density = total / span
+
+    for _ in range(SAMPLE_ROUNDS):
+        missing = count - len(chosen)
+        if missing <= 0:
+            break
+        # Bù cho các id đã bị xóa (khoảng trống) theo mật độ id
+        draws = min(span, MAX_SAMPLE_DRAWS, int(missing / density * 1.5) + 8)
+        candidates = {rng.randint(low, high) for _ in range(draws)} - chosen
+        found = list(Quiz.objects.filter(id__in=candidates).values_list('id', flat=True))
+        chosen.update(rng.sample(found, min(missing, len(found))))
+
+    missing = count - len(chosen)
+    if missing > 0:
+        # id quá thưa: để database chọn phần còn thiếu
+        chosen.update(
+            Quiz.objects.exclude(id__in=chosen).order_by('?').values_list('id', flat=True)[:missing]
+        )
+
+    ids = list(chosen)
+    rng.shuffle(ids)
+    return ids
+
+
+def sample_question_sets(count, set_count=1, rng=None):
+    """
+    set_count bộ câu hỏi, mỗi bộ count id khác nhau.
+    Raise ValueError nếu không đủ câu hỏi.
+    """
+    rng = rng or random
+    low, high, total = _quiz_id_range()
+    if total < count:
+        raise ValueError(f'Không đủ câu hỏi. Cần {count} câu, hiện có {total} câu.')
+    if set_count == 1:
+        return [_draw_quiz_ids(count, low, high, total, rng)]
+
+    # Rút một pool chung rồi chia cho từng bộ (các bộ có thể trùng câu khi pool nhỏ)
+    pool_size = min(total, max(count, min(count * set_count, QUESTION_POOL_LIMIT)))
+    pool = _draw_quiz_ids(pool_size, low, high, total, rng)
+    return [rng.sample(pool, count) for _ in range(set_count)]
+
+
+def seed_groups(players, group_count):
+    """
+    Chia người chơi (đã xếp theo XP giảm dần) thành group_count bảng theo
+    kiểu rắn (1..N, N..1, ...) để sức mạnh các bảng cân bằng.
+    """
+    groups = [[] for _ in range(group_count)]
+    for index, user_name in enumerate(players):
+        row, col = divmod(index, group_count)
+        groups[col if row % 2 == 0 else group_count - 1 - col].append(user_name)
+    return groups
+
+
+def plan_groups(participants, group_count, group_size):
+    """
+    Chia bảng cho giải đấu. participants: danh sách user_name (tùy chọn),
+    mặc định lấy group_count * group_size người top XP trong snapshot.
+    Trả về danh sách bảng; raise ValueError nếu không hợp lệ.
+    """
+    if not 1 <= group_count <= MAX_GROUP_COUNT:
+        raise ValueError(f'group_count phải từ 1 đến {MAX_GROUP_COUNT}')
+
+    xp_by_user = dict(xp_leaderboard_snapshot())
+
+    if participants:
+        participants = list(dict.fromkeys(participants))
+        existing_users = set(User.objects.filter(username__in=participants).values_list('username', flat=True))
+        invalid_users = [user for user in participants if user not in existing_users]
+        if invalid_users:
+            raise ValueError(f'Các user sau không tồn tại trong hệ thống: {", ".join(invalid_users)}')
+        # Xếp hạt giống theo XP trong snapshot (người chưa có XP xếp cuối)
+        players = sorted(participants, key=lambda user: -xp_by_user.get(user, 0))
+    else:
+        if not MIN_GROUP_SIZE <= group_size <= MAX_GROUP_SIZE:
+            raise ValueError('group_size phải từ 2 đến 8')
+        players = list(xp_by_user)[:group_count * group_size]
+        if len(players) < group_count * group_size:
+            raise ValueError(f'Cần {group_count * group_size} người chơi có điểm. Hiện có {len(players)} người.')
+
+    groups = seed_groups(players, group_count)
+    if any(len(group) < MIN_GROUP_SIZE for group in groups):
+        raise ValueError('Mỗi bảng cần ít nhất 2 người chơi')
+    if any(len(group) > MAX_GROUP_SIZE for group in groups):
+        raise ValueError('Mỗi bảng tối đa 8 người chơi')
+    return groups
+
+
+def create_battles(groups, question_sets, scheduled_start_time, duration_minutes, **fields):
+    """
+    Tạo một battle cho mỗi bảng (groups[i] dùng question_sets[i]) cùng toàn bộ
+    QuizBattleParticipant bằng bulk_create trong một transaction.
+    fields: trường bổ sung cho mọi battle (tournament, tournament_round).
+    """
+    with transaction.atomic():
+        battles = QuizBattle.objects.bulk_create([
+            QuizBattle(
+                scheduled_start_time=scheduled_start_time,
+                duration_minutes=duration_minutes,
+                status='pending',
+                questions=questions,
+                participants=list(group),
+                **fields,
+            )
+            for group, questions in zip(groups, question_sets)
+        ])
+        QuizBattleParticipant.objects.bulk_create([
+            QuizBattleParticipant(battle=battle, user_name=user_name)
+            for battle in battles
+            for user_name in battle.participants
+        ])
+    return battles
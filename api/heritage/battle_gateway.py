@@ -0,0 +1,491 @@
+"""
+Cổng WebSocket cho Quiz Battle: ws://<host>/ws/battles/<id>/?user_name=<tên>
+
+Mỗi battle đang diễn ra là một "phòng" giữ toàn bộ trạng thái trong bộ nhớ
+(danh sách câu hỏi, đáp án đúng, điểm và hạng của người chơi). Câu trả lời
+gửi qua socket chỉ cập nhật dict rồi broadcast cho cả phòng; việc ghi xuống
+database chạy nền (write-behind): gom theo lô mỗi FLUSH_INTERVAL giây hoặc
+khi đủ FLUSH_BATCH_SIZE câu trả lời, và ghi lần cuối khi phòng không còn ai
+kết nối. Lô ghi lỗi được trả lại phòng để lượt sau ghi lại.
+
+Khi phòng đang mở, battle chỉ được chốt qua phòng: end_battle / scheduler gọi
+request_end, phòng ngừng nhận câu trả lời, ghi lô cuối rồi mới gọi
+battle_lifecycle.complete_battle (chốt hạng, thống kê, thành tựu, giải đấu).
+
+Trạng thái phòng nằm trong một process, vì vậy service ASGI phục vụ
+WebSocket phải chạy đúng một worker (một event loop vẫn giữ được rất nhiều
+kết nối). Khi phòng đang mở, API HTTP submit_answer từ chối ghi để hai
+đường ghi không đè lên nhau.
+
+Giao thức (JSON):
+    client -> {"type": "answer", "quiz_id": 12, "answer": "A", "time_taken": 5}
+    server -> {"type": "state", ...}          ngay sau khi kết nối
+              {"type": "answer-result", ...}  chỉ gửi cho người trả lời
+              {"type": "error", "error": "..."}
+              {"type": "answer-submitted" | "question-solved" | "rank-changed" | "status-changed", ...}
+"""
+import asyncio
+import json
+import logging
+import re
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import battle_events
+from .battle_ranks import RankedList, rank_key
+from .models import QuizBattle, QuizBattleParticipant, Quiz, BattleSolveState, BattleAnswer
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0        # giây giữa hai lần ghi lô
+FLUSH_BATCH_SIZE = 50       # ghi ngay khi đủ số câu trả lời chưa lưu
+ROOM_OWNER_KEY = 'heritage:battle:{battle_id}:gateway'
+ROOM_OWNER_TIMEOUT = 30     # giây - key tự hết hạn nếu process gateway chết
+ROOM_END_KEY = 'heritage:battle:{battle_id}:end-requested'
+
+PATH_RE = re.compile(r'^/ws/battles/(?P<battle_id>\d+)/?$')
+
+# Mã đóng kết nối (4000-4999 dành cho ứng dụng)
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_RUNNING = 4409
+CLOSE_BATTLE_ENDED = 4000
+
+
+def room_is_open(battle_id):
+    """Battle đang được một phòng WebSocket nắm giữ (dùng cho API HTTP)"""
+    return cache.get(ROOM_OWNER_KEY.format(battle_id=battle_id)) is not None
+
+
+def request_end(battle_id):
+    """Yêu cầu phòng đang mở ghi lô cuối rồi chốt battle (phòng kiểm tra mỗi FLUSH_INTERVAL)"""
+    cache.set(ROOM_END_KEY.format(battle_id=battle_id), 1, ROOM_OWNER_TIMEOUT * 2)
+
+
+class BattleClosed(Exception):
+    """Không mở được phòng: battle không tồn tại hoặc không diễn ra"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class BattleRoom:
+    """Trạng thái trong bộ nhớ của một battle đang diễn ra"""
+
+    def __init__(self, battle, quizzes, participants, answers, solve_state):
+        self.battle_id = battle.id
+        self.status = battle.status
+        self.ends_at = battle.scheduled_start_time + timedelta(minutes=battle.duration_minutes)
+        self.questions = list(battle.questions)
+        self.quizzes = quizzes                  # quiz_id -> (correct_answer, xp_reward)
+        self.players = {p.user_name: p for p in participants}
+        # user_name -> {quiz_id (str): {answer, is_correct, time_taken}}
+        self.answers = {p.user_name: {} for p in participants}
+        for row in answers:
+            self.answers[row.participant.user_name][str(row.quiz_id)] = {
+                'answer': row.answer, 'is_correct': row.is_correct, 'time_taken': row.time_taken,
+            }
+        self.new_answers = []                   # BattleAnswer chưa ghi
+        # quiz_id -> user_name trả lời đúng đầu tiên
+        self.solved_by = {int(quiz_id): name for quiz_id, name in solve_state.first_solvers.items()}
+        self.new_solves = []                    # (quiz_id, user_name, correct_answer) chưa ghi
+        self.connections = {}                   # send -> user_name
+        self.dirty = set()
+        self.pending_answers = 0
+        self.ranks_changed = False      # bảng xếp hạng đổi từ lần ghi trước
+        self.flush_task = None
+        self.closed = False
+        self.ranking = RankedList(participants)
+        self.dirty.update(p.user_name for p in self.ranking.assign_ranks())
+
+    # --- Trạng thái ---
+
+    def leaderboard(self):
+        return {
+            'battle_id': self.battle_id,
+            'status': self.status,
+            'leaderboard': [{
+                'rank': p.rank,
+                'user_name': p.user_name,
+                'score': p.score,
+                'correct_answers': p.correct_answers,
+                'time_completed': p.time_completed,
+                'finished': p.finished_at is not None,
+            } for p in self.ranking.participants],
+        }
+
+    def state_for(self, user_name):
+        player = self.players[user_name]
+        return {
+            'type': 'state',
+            'battle_id': self.battle_id,
+            'status': self.status,
+            'ends_at': self.ends_at.isoformat(),
+            'questions': self.questions,
+            'solved': {str(quiz_id): solver for quiz_id, solver in self.solved_by.items()},
+            'answers': self.answers[user_name],
+            'score': player.score,
+            **self.leaderboard(),
+        }
+
+    def submit(self, user_name, quiz_id, answer, time_taken):
+        """
+        Chấm một câu trả lời (cùng quy tắc với API submit_answer).
+        Trả về (kết quả cho người gửi, [sự kiện broadcast]); raise ValueError nếu không hợp lệ.
+        """
+        if self.status != 'in_progress' or timezone.now() >= self.ends_at:
+            raise ValueError('Battle chưa bắt đầu hoặc đã kết thúc')
+        if not quiz_id or not answer:
+            raise ValueError('quiz_id, answer là bắt buộc')
+        if quiz_id not in self.quizzes:
+            raise ValueError('Câu hỏi này không thuộc battle')
+
+        answer = str(answer).upper()
+        if answer not in ('A', 'B', 'C', 'D'):
+            raise ValueError('Vui lòng chọn câu trả lời (A, B, C hoặc D)')
+
+        player = self.players[user_name]
+        answers = self.answers[user_name]
+        if str(quiz_id) in answers:
+            raise ValueError('Bạn đã trả lời câu này rồi')
+
+        correct_answer, xp_reward = self.quizzes[quiz_id]
+        old_key = rank_key(player)
+        is_correct = answer == correct_answer.upper()
+
+        answers[str(quiz_id)] = {
+            'answer': answer,
+            'is_correct': is_correct,
+            'time_taken': time_taken,
+        }
+        self.new_answers.append(BattleAnswer(
+            battle_id=self.battle_id,
+            participant=player,
+            quiz_id=quiz_id,
+            answer=answer,
+            is_correct=is_correct,
+            time_taken=time_taken,
+        ))
+        player.total_answered += 1
+        if is_correct:
+            player.score += xp_reward
+            player.correct_answers += 1
+        player.time_completed = (player.time_completed or 0) + time_taken
+        if player.total_answered == len(self.questions):
+            player.finished_at = timezone.now()
+
+        self.dirty.add(user_name)
+        self.pending_answers += 1
+
+        events = [{
+            'type': 'answer-submitted',
+            'user_name': user_name,
+            'quiz_id': quiz_id,
+            'is_correct': is_correct,
+            'answers_completed': player.total_answered,
+        }]
+        if is_correct and quiz_id not in self.solved_by:
+            self.solved_by[quiz_id] = user_name
+            self.new_solves.append((quiz_id, user_name, correct_answer))
+            events.append({
+                'type': 'question-solved',
+                'battle_id': self.battle_id,
+                'status': self.status,
+                'current_question_index': self.questions.index(quiz_id),
+                'question_solved': True,
+                'solved_by': user_name,
+                'correct_answer': correct_answer,
+                'total_questions': len(self.questions),
+            })
+        self.dirty.update(p.user_name for p in self.ranking.reposition(player, old_key))
+        self.ranks_changed = True
+        events.append({'type': 'rank-changed', **self.leaderboard()})
+
+        result = {
+            'type': 'answer-result',
+            'quiz_id': quiz_id,
+            'is_correct': is_correct,
+            'correct_answer': correct_answer,
+            'score': player.score,
+            'answers_completed': player.total_answered,
+            'total_questions': len(self.questions),
+        }
+        return result, events
+
+    # --- Kết nối ---
+
+    async def send(self, send, message):
+        try:
+            await send({'type': 'websocket.send', 'text': json.dumps(message, ensure_ascii=False, default=str)})
+        except Exception:
+            self.connections.pop(send, None)
+
+    async def broadcast(self, messages):
+        targets = list(self.connections)
+        for message in messages:
+            await asyncio.gather(*(self.send(target, message) for target in targets))
+
+    # --- Write-behind ---
+
+    def take_dirty(self):
+        """Lấy (và xoá) các participant, câu trả lời và lượt giải câu hỏi cần ghi"""
+        players = [self.players[name] for name in self.dirty]
+        answers, self.new_answers = self.new_answers, []
+        solves, self.new_solves = self.new_solves, []
+        self.dirty = set()
+        self.pending_answers = 0
+        return players, answers, solves
+
+    def restore(self, players, answers, solves, ranks_changed):
+        """Trả lại lô chưa ghi được (lỗi database) để lần ghi sau thử lại"""
+        self.dirty.update(p.user_name for p in players)
+        self.new_answers[:0] = answers
+        self.new_solves[:0] = solves
+        self.pending_answers += len(answers)
+        self.ranks_changed = self.ranks_changed or ranks_changed
+
+
+# --- Truy cập database (chạy trong thread qua sync_to_async) ---
+
+def _load_room(battle_id):
+    close_old_connections()
+    try:
+        battle = QuizBattle.objects.get(pk=battle_id)
+    except QuizBattle.DoesNotExist:
+        raise BattleClosed(CLOSE_NOT_FOUND, 'Không tìm thấy battle')
+    if battle.status != 'in_progress':
+        raise BattleClosed(CLOSE_NOT_RUNNING, 'Battle chưa bắt đầu hoặc đã kết thúc')
+
+    quizzes = {
+        quiz_id: (correct_answer, xp_reward)
+        for quiz_id, correct_answer, xp_reward in Quiz.objects.filter(
+            id__in=battle.questions
+        ).values_list('id', 'correct_answer', 'xp_reward')
+    }
+    participants = list(battle.battle_participants.all())
+    answers = BattleAnswer.objects.filter(battle=battle).select_related('participant')
+    solve_state = BattleSolveState.objects.filter(battle=battle).first() or battle_events.solve_state_from_answers(battle)
+    return BattleRoom(battle, quizzes, participants, answers, solve_state)
+
+
+def _flush(battle_id, questions, players, answers, solves, publish_ranks):
+    """
+    Ghi một lô câu trả lời (bulk_create) và participant (bulk_update); trả về status hiện tại của battle.
+    Không ghi vào battle đã rời in_progress (kết quả đã được chốt).
+    """
+    close_old_connections()
+    with transaction.atomic():
+        battle = QuizBattle.objects.select_for_update().filter(pk=battle_id).only('id', 'status').first()
+        if battle is None:
+            return None
+        if battle.status != 'in_progress':
+            if answers or players or solves:
+                logger.warning(f'Battle {battle_id} đã {battle.status}: bỏ {len(answers)} câu trả lời chưa ghi')
+            return battle.status
+        if answers:
+            BattleAnswer.objects.bulk_create(answers)
+        if players:
+            QuizBattleParticipant.objects.bulk_update(
+                players,
+                ['score', 'correct_answers', 'total_answered', 'time_completed', 'finished_at', 'rank'],
+            )
+        if solves:
+            solve_state = battle_events.solve_state_for_update(battle)
+            for quiz_id, user_name, correct_answer in solves:
+                solve_state.record_solve(questions, quiz_id, user_name, correct_answer)
+            solve_state.save()
+    if publish_ranks:
+        # Người xem qua SSE nhận bảng xếp hạng theo lô, không theo từng câu trả lời
+        try:
+            battle_events.publish_ranks_changed(battle)
+        except Exception:
+            # Lô đã ghi xong: không để lỗi phát sự kiện làm phòng ghi lại lô này
+            logger.exception(f'Battle {battle_id}: không phát được rank-changed')
+    return battle.status
+
+
+def _complete(battle_id):
+    """Chốt battle sau lô ghi cuối; trả về status sau khi chốt"""
+    from .battle_lifecycle import complete_battle
+
+    close_old_connections()
+    battle = QuizBattle.objects.filter(pk=battle_id).first()
+    if battle is None:
+        return None
+    complete_battle(battle, via_room=True)
+    return battle.status
+
+
+# --- Quản lý phòng ---
+
+_rooms = {}
+_rooms_lock = asyncio.Lock()
+
+
+async def get_room(battle_id):
+    """Phòng của battle, nạp từ database ở kết nối đầu tiên"""
+    async with _rooms_lock:
+        room = _rooms.get(battle_id)
+        if room is None or room.closed:
+            room = await sync_to_async(_load_room)(battle_id)
+            _rooms[battle_id] = room
+            await _keep_owner(room)
+            room.flush_task = asyncio.create_task(_flush_loop(room))
+        return room
+
+
+async def _keep_owner(room):
+    """Gia hạn key chủ phòng, độc lập với việc ghi lô có thành công hay không"""
+    await cache.aset(ROOM_OWNER_KEY.format(battle_id=room.battle_id), 1, ROOM_OWNER_TIMEOUT)
+
+
+async def flush_room(room):
+    """Ghi các thay đổi chưa lưu; nếu lỗi thì trả lô lại phòng rồi raise"""
+    players, answers, solves = room.take_dirty()
+    publish_ranks, room.ranks_changed = room.ranks_changed, False
+    try:
+        return await sync_to_async(_flush)(room.battle_id, room.questions, players, answers, solves, publish_ranks)
+    except Exception:
+        room.restore(players, answers, solves, publish_ranks)
+        raise
+
+
+async def close_room(room, code=CLOSE_BATTLE_ENDED):
+    """Ghi lần cuối rồi đóng phòng và mọi kết nối (ghi lỗi thì phòng vẫn mở để thử lại)"""
+    if room.closed:
+        return
+    await flush_room(room)
+    room.closed = True
+    if _rooms.get(room.battle_id) is room:
+        del _rooms[room.battle_id]
+    await cache.adelete_many([
+        ROOM_OWNER_KEY.format(battle_id=room.battle_id),
+        ROOM_END_KEY.format(battle_id=room.battle_id),
+    ])
+    for send in list(room.connections):
+        try:
+            await send({'type': 'websocket.close', 'code': code})
+        except Exception:
+            pass
+    room.connections.clear()
+
+
+async def end_room(room):
+    """Ngừng nhận câu trả lời, ghi lô cuối, chốt battle rồi đóng phòng"""
+    room.status = 'ending'  # submit() từ chối mọi câu trả lời từ đây
+    await flush_room(room)
+    status = await sync_to_async(_complete)(room.battle_id)
+    room.status = status or 'completed'
+    await room.broadcast([{'type': 'status-changed', 'battle_id': room.battle_id, 'status': room.status}])
+    await close_room(room)
+
+
+async def _tick(room):
+    end_requested = (
+        room.status != 'in_progress'
+        or timezone.now() >= room.ends_at
+        or await cache.aget(ROOM_END_KEY.format(battle_id=room.battle_id)) is not None
+    )
+    if end_requested:
+        # Hết giờ hoặc end_battle / scheduler yêu cầu: chốt qua phòng để không mất lô cuối
+        await end_room(room)
+        return
+
+    status = await flush_room(room)
+    if status != 'in_progress':
+        # Battle bị chốt ngoài phòng (vd. key chủ phòng đã hết hạn): báo cho người chơi rồi đóng
+        room.status = status or 'completed'
+        await room.broadcast([{'type': 'status-changed', 'battle_id': room.battle_id, 'status': room.status}])
+        await close_room(room)
+    elif not room.connections:
+        await close_room(room)
+
+
+async def _flush_loop(room):
+    elapsed = 0.0
+    step = FLUSH_INTERVAL / 10
+    while not room.closed:
+        await asyncio.sleep(step)
+        elapsed += step
+        if room.pending_answers < FLUSH_BATCH_SIZE and elapsed < FLUSH_INTERVAL:
+            continue
+        elapsed = 0.0
+
+        try:
+            await _keep_owner(room)
+        except Exception:
+            logger.exception(f'Battle {room.battle_id}: không gia hạn được key chủ phòng')
+        try:
+            await _tick(room)
+        except Exception:
+            # Lô chưa ghi đã được trả lại phòng; lượt sau thử lại
+            logger.exception(f'Battle {room.battle_id}: lỗi khi ghi / chốt phòng, sẽ thử lại')
+
+
+# --- Ứng dụng ASGI ---
+
+async def battle_websocket(scope, receive, send):
+    """ASGI app cho scope['type'] == 'websocket'"""
+    match = PATH_RE.match(scope.get('path', ''))
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if not match:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    battle_id = int(match.group('battle_id'))
+    query = parse_qs(scope.get('query_string', b'').decode())
+    user_name = (query.get('user_name') or [''])[0]
+
+    try:
+        room = await get_room(battle_id)
+    except BattleClosed as exc:
+        await send({'type': 'websocket.close', 'code': exc.code})
+        return
+    if user_name not in room.players:
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    await send({'type': 'websocket.accept'})
+    room.connections[send] = user_name
+    await room.send(send, room.state_for(user_name))
+
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message['type'] != 'websocket.receive':
+                continue
+            try:
+                data = json.loads(message.get('text') or '')
+            except ValueError:
+                await room.send(send, {'type': 'error', 'error': 'Dữ liệu không hợp lệ'})
+                continue
+            if not isinstance(data, dict) or data.get('type') != 'answer':
+                await room.send(send, {'type': 'error', 'error': 'Loại tin nhắn không hỗ trợ'})
+                continue
+
+            try:
+                quiz_id = int(data.get('quiz_id') or 0)
+                time_taken = int(data.get('time_taken') or 0)
+            except (TypeError, ValueError):
+                await room.send(send, {'type': 'error', 'error': 'quiz_id, time_taken phải là số'})
+                continue
+            try:
+                result, events = room.submit(user_name, quiz_id, data.get('answer'), time_taken)
+            except ValueError as exc:
+                await room.send(send, {'type': 'error', 'error': str(exc)})
+                continue
+
+            await room.send(send, result)
+            await room.broadcast(events)
+    finally:
+        room.connections.pop(send, None)
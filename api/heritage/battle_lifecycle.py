@@ -0,0 +1,107 @@
+"""
+Chuyển trạng thái battle theo thời gian: pending -> in_progress khi tới
+scheduled_start_time, in_progress -> completed khi hết duration_minutes.
+
+Mỗi lần chuyển là một UPDATE có điều kiện trên status cũ, nên dù nhiều
+process (scheduler, API start/end) cùng chạy thì mỗi battle chỉ chuyển
+đúng một lần và chỉ process thắng mới chốt hạng và phát sự kiện.
+Khi battle kết thúc, người chơi được xét thành tựu battle; battle thuộc giải
+đấu báo cho tournaments để chuyển vòng khi cả vòng kết thúc.
+Battle đang có phòng WebSocket mở (battle_gateway) thì không chốt trực tiếp:
+complete_battle nhờ phòng ghi lô câu trả lời cuối rồi phòng tự gọi lại.
+Scheduler chạy bằng: python manage.py run_battle_scheduler
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import achievements, battle_events, battle_gateway, tournaments, user_stats
+from .battle_ranks import recompute_ranks
+from .models import QuizBattle
+
+logger = logging.getLogger(__name__)
+
+
+def battle_end_time(battle):
+    return battle.scheduled_start_time + timedelta(minutes=battle.duration_minutes)
+
+
+def _transition(battle, from_statuses, to_status, **fields):
+    """UPDATE ... WHERE status IN from_statuses; trả về True nếu lần gọi này thực hiện chuyển trạng thái"""
+    updated = QuizBattle.objects.filter(pk=battle.pk, status__in=from_statuses).update(status=to_status, **fields)
+    if not updated:
+        return False
+    battle.status = to_status
+    for name, value in fields.items():
+        setattr(battle, name, value)
+    return True
+
+
+def start_battle(battle, started_at=None):
+    """pending -> in_progress. started_at: ghi đè thời gian bắt đầu (khi bắt đầu thủ công)"""
+    fields = {'scheduled_start_time': started_at} if started_at else {}
+    if not _transition(battle, ['pending'], 'in_progress', **fields):
+        return False
+    battle_events.publish_status_changed(battle)
+    if battle.tournament_id:
+        tournaments.invalidate_bracket(battle.tournament_id)
+    return True
+
+
+def complete_battle(battle, via_room=False):
+    """
+    pending / in_progress -> completed, chốt hạng cuối cùng.
+    Nếu phòng gateway đang mở (via_room=False): chỉ yêu cầu phòng kết thúc và trả về False;
+    phòng ghi lô cuối rồi gọi lại với via_room=True.
+    """
+    if not via_room and battle_gateway.room_is_open(battle.id):
+        battle_gateway.request_end(battle.id)
+        return False
+    with transaction.atomic():
+        if not _transition(battle, ['pending', 'in_progress'], 'completed'):
+            return False
+        recompute_ranks(battle)
+        user_stats.apply_battle(battle)
+    battle_events.publish_ranks_changed(battle)
+    battle_events.publish_status_changed(battle)
+    # Battle đã chốt: lỗi của các bước sau chỉ ghi log (giải đấu được advance_ready_tournaments chuyển vòng lại)
+    for hook in (achievements.on_battle_completed, tournaments.on_battle_completed):
+        try:
+            hook(battle)
+        except Exception:
+            logger.exception(f'Battle {battle.id}: {hook.__module__}.{hook.__name__} lỗi')
+    return True
+
+
+def run_due_transitions(now=None):
+    """Chuyển mọi battle đã tới hạn; trả về (số battle bắt đầu, số battle kết thúc)"""
+    now = now or timezone.now()
+    started = completed = 0
+
+    for battle in QuizBattle.objects.filter(status='pending', scheduled_start_time__lte=now):
+        if battle_end_time(battle) <= now:
+            # Quá hạn cả thời gian làm bài (scheduler dừng lâu): kết thúc luôn
+            started += start_battle(battle)
+            completed += complete_battle(battle)
+        else:
+            started += start_battle(battle)
+
+    for battle in QuizBattle.objects.filter(status='in_progress', scheduled_start_time__lte=now):
+        if battle_end_time(battle) <= now:
+            completed += complete_battle(battle)
+
+    return started, completed
+
+
+def next_due_time():
+    """Thời điểm gần nhất có battle cần chuyển trạng thái (None nếu không có)"""
+    next_start = QuizBattle.objects.filter(status='pending').order_by('scheduled_start_time').values_list(
+        'scheduled_start_time', flat=True
+    ).first()
+    running = QuizBattle.objects.filter(status='in_progress').only('scheduled_start_time', 'duration_minutes')
+    candidates = [battle_end_time(b) for b in running]
+    if next_start:
+        candidates.append(next_start)
+    return min(candidates) if candidates else None
@@ -0,0 +1,69 @@
+"""
+Xếp hạng participant trong một battle.
+
+Thứ tự: điểm giảm dần, tổng thời gian tăng dần (chưa có thời gian xếp sau),
+cuối cùng theo id để hạng ổn định. Khi một người trả lời, chỉ người đó đổi
+điểm nên chỉ cần dời họ trong danh sách đã sắp xếp (bisect); hạng chỉ thay
+đổi với những người nằm giữa vị trí cũ và vị trí mới.
+"""
+from bisect import bisect_left
+
+from django.db import transaction
+
+from .models import QuizBattleParticipant
+
+
+def rank_key(participant):
+    time_completed = participant.time_completed
+    return (-participant.score, time_completed is None, time_completed or 0, participant.pk or 0, participant.user_name)
+
+
+class RankedList:
+    """Danh sách participant đã sắp theo rank_key, hỗ trợ dời một phần tử"""
+
+    def __init__(self, participants):
+        self.participants = sorted(participants, key=rank_key)
+        self.keys = [rank_key(p) for p in self.participants]
+
+    def assign_ranks(self, start=0, stop=None):
+        """Gán rank theo vị trí trong [start, stop); trả về participant có rank thay đổi"""
+        stop = len(self.participants) if stop is None else stop
+        changed = []
+        for index in range(start, stop):
+            participant = self.participants[index]
+            if participant.rank != index + 1:
+                participant.rank = index + 1
+                changed.append(participant)
+        return changed
+
+    def reposition(self, participant, old_key):
+        """
+        Dời participant (đã đổi điểm / thời gian) từ vị trí ứng với old_key sang
+        vị trí mới. Trả về các participant có rank thay đổi.
+        """
+        old_index = bisect_left(self.keys, old_key)
+        del self.participants[old_index]
+        del self.keys[old_index]
+
+        new_key = rank_key(participant)
+        new_index = bisect_left(self.keys, new_key)
+        self.participants.insert(new_index, participant)
+        self.keys.insert(new_index, new_key)
+
+        low, high = min(old_index, new_index), max(old_index, new_index)
+        return self.assign_ranks(low, high + 1)
+
+
+def locked_participants(battle):
+    """Khoá các dòng participant của battle (theo id để tránh deadlock); gọi trong transaction"""
+    return list(QuizBattleParticipant.objects.select_for_update().filter(battle=battle).order_by('pk'))
+
+
+def recompute_ranks(battle):
+    """Tính lại toàn bộ hạng của battle, chỉ ghi những dòng có rank thay đổi"""
+    with transaction.atomic():
+        ranking = RankedList(locked_participants(battle))
+        changed = ranking.assign_ranks()
+        if changed:
+            QuizBattleParticipant.objects.bulk_update(changed, ['rank'])
+    return ranking.participants
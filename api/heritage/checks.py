@@ -0,0 +1,27 @@
+"""
+Kiểm tra cấu hình khi deploy (python manage.py check --deploy).
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backend có incr / add nguyên tử giữa các process và không tự xóa key khi đầy
+SHARED_CACHE_BACKENDS = {
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+}
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in SHARED_CACHE_BACKENDS:
+        return []
+    return [Error(
+        f'Cache mặc định ({backend}) không dùng được cho production',
+        hint=(
+            'Version bản đồ / bảng xếp hạng / thành tựu, chủ phòng battle và con trỏ sự kiện '
+            'cần incr / add nguyên tử giữa các process: đặt REDIS_URL.'
+        ),
+        id='heritage.E001',
+    )]
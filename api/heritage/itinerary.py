@@ -0,0 +1,137 @@
+"""
+Lập lộ trình tham quan nhiều di tích (bài toán người du lịch dạng đường đi mở).
+
+Ma trận khoảng cách giữa mọi cặp di tích được tính một lần cho mỗi version
+của bảng Site. Lộ trình dựng bằng láng giềng gần nhất rồi cải thiện bằng
+2-opt, dừng khi hết ngân sách thời gian.
+"""
+import time
+
+import numpy as np
+
+from .site_cache import versioned_snapshot
+from .spatial import get_site_index, haversine_km
+
+DEFAULT_TIME_BUDGET_MS = 50
+MAX_TIME_BUDGET_MS = 200
+MAX_ITINERARY_SITES = 300
+
+
+class DistanceMatrix:
+    """Ma trận khoảng cách haversine (km) giữa các di tích có toạ độ"""
+
+    def __init__(self, entries):
+        self.entries = [e for e in entries if e.point is not None]
+        self.position = {e.site_id: i for i, e in enumerate(self.entries)}
+        self.lat_rad = np.radians([e.point[1] for e in self.entries])
+        self.lng_rad = np.radians([e.point[0] for e in self.entries])
+        self.matrix = haversine_km(
+            self.lat_rad[:, None], self.lng_rad[:, None], self.lat_rad[None, :], self.lng_rad[None, :]
+        )
+
+    def from_point(self, lat, lng, indices):
+        """Khoảng cách từ một toạ độ bất kỳ tới các di tích indices"""
+        return haversine_km(np.radians(lat), np.radians(lng), self.lat_rad[indices], self.lng_rad[indices])
+
+
+def get_distance_matrix():
+    """Ma trận khoảng cách, dựng lại khi bảng Site thay đổi"""
+    return versioned_snapshot('site_distance_matrix', lambda: DistanceMatrix(get_site_index().entries))
+
+
+def _route_length(route, dist, closed):
+    total = sum(dist[route[i]][route[i + 1]] for i in range(len(route) - 1))
+    if closed:
+        total += dist[route[-1]][route[0]]
+    return total
+
+
+def _nearest_neighbour(dist):
+    """Lộ trình ban đầu: luôn đi tới điểm gần nhất chưa thăm (node 0 là điểm xuất phát)"""
+    unvisited = set(range(1, len(dist)))
+    route = [0]
+    while unvisited:
+        last = dist[route[-1]]
+        nearest = min(unvisited, key=last.__getitem__)
+        route.append(nearest)
+        unvisited.remove(nearest)
+    return route
+
+
+def _two_opt(route, dist, closed, deadline):
+    """Đảo đoạn route[i..j] khi làm ngắn lộ trình, cho tới khi không cải thiện được hoặc hết giờ"""
+    n = len(route)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            if time.perf_counter() > deadline:
+                return route
+            a, b = route[i - 1], route[i]
+            for j in range(i + 1, n):
+                c = route[j]
+                if j + 1 < n:
+                    d = route[j + 1]
+                elif closed:
+                    d = route[0]
+                else:
+                    d = None
+
+                if d is None:
+                    delta = dist[a][c] - dist[a][b]
+                else:
+                    delta = dist[a][c] + dist[b][d] - dist[a][b] - dist[c][d]
+                if delta < -1e-9:
+                    route[i:j + 1] = reversed(route[i:j + 1])
+                    a, b = route[i - 1], route[i]
+                    improved = True
+    return route
+
+
+def plan_itinerary(start, site_ids, return_to_start=False, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    """
+    Thứ tự tham quan site_ids xuất phát từ start=(lat, lng) với tổng quãng đường ngắn.
+    Trả về dict: order, legs, total_km, optimized (False nếu dừng vì hết thời gian).
+    Raise KeyError nếu có site_id không tồn tại hoặc không có toạ độ.
+    """
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    matrix = get_distance_matrix()
+
+    site_ids = list(dict.fromkeys(site_ids))  # bỏ trùng, giữ thứ tự
+    missing = [sid for sid in site_ids if sid not in matrix.position]
+    if missing:
+        raise KeyError(missing)
+
+    indices = [matrix.position[sid] for sid in site_ids]
+    lat, lng = start
+
+    # Ma trận con: node 0 = điểm xuất phát, node k = site_ids[k - 1]
+    n = len(indices) + 1
+    sub = np.zeros((n, n))
+    sub[1:, 1:] = matrix.matrix[np.ix_(indices, indices)]
+    from_start = matrix.from_point(lat, lng, indices)
+    sub[0, 1:] = from_start
+    sub[1:, 0] = from_start
+    dist = sub.tolist()  # list lồng nhau truy cập nhanh hơn trong vòng lặp Python
+
+    route = _nearest_neighbour(dist)
+    route = _two_opt(route, dist, return_to_start, deadline)
+    optimized = time.perf_counter() <= deadline
+
+    stops = route + [0] if return_to_start else route
+    legs = []
+    for prev, node in zip(stops, stops[1:]):
+        entry = matrix.entries[indices[node - 1]] if node else None
+        legs.append({
+            'site_id': entry.site_id if entry else None,
+            'name': entry.name if entry else None,
+            'coordinates': list(entry.point) if entry else [lng, lat],
+            'distance_km': round(dist[prev][node], 3),
+        })
+
+    return {
+        'order': [site_ids[node - 1] for node in route[1:]],
+        'legs': legs,
+        'total_km': round(_route_length(route, dist, return_to_start), 3),
+        'optimized': optimized,
+    }
@@ -0,0 +1,506 @@
+"""
+Bảng xếp hạng toàn cục giữ sẵn trong bộ nhớ mỗi process, đã sắp xếp (bisect):
+tra hạng O(log n); phân trang và "hạng của tôi ± k" chỉ là cắt list.
+
+- Bảng 'xp': tổng XP của UserProfile (level tăng theo XP nên cùng thứ tự).
+- Bảng 'quiz': số câu đã làm / số câu đúng / tổng thời gian từ bảng tổng hợp UserStats.
+
+Mỗi lần điểm của một người thay đổi thì ghi một LeaderboardChange (giá trị
+tuyệt đối; values rỗng = xóa khỏi bảng, ghi qua signal khi xóa dữ liệu nguồn).
+Trước khi đọc, process áp dụng các thay đổi mới hơn con trỏ của
+mình (log_cursor.IdCursor: đọc lại cửa sổ an toàn cho các id commit muộn)
+nên không phải tổng hợp lại toàn bộ bảng. run_battle_scheduler gọi
+compact_changes định kỳ: bỏ các dòng đã có dòng mới hơn của cùng người và các
+dòng quá CHANGE_RETENTION (process có con trỏ cũ hơn mốc đã dọn tự dựng lại).
+Khôi phục: python manage.py rebuild_leaderboard (dựng lại từ nguồn, mọi process tự nạp lại).
+
+Bảng xếp hạng theo phạm vi (địa điểm / trường / lớp) đọc bảng tổng hợp
+UserSiteStats, cập nhật qua signal mỗi khi thêm / xóa QuizAttempt. Mỗi phạm vi
+có version trong cache; ETag chỉ phụ thuộc version nên máy chiếu trong lớp
+tải lại liên tục chỉ nhận 304 mà không chạm database.
+"""
+import hashlib
+import json
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import user_stats
+from .log_cursor import GAP_SECONDS, IdCursor
+from .models import LeaderboardChange, Quiz, QuizAttempt, UserProfile, UserRole, UserSiteStats, UserStats
+from .site_cache import encode_json, make_etag
+
+VERSION_KEY = 'heritage:leaderboard:{board}:version'
+LAST_CHANGE_KEY = 'heritage:leaderboard:{board}:last_change'
+COMPACTED_KEY = 'heritage:leaderboard:{board}:compacted'
+CHANGE_POLL_SECONDS = 2  # đọc change log ít nhất mỗi 2s kể cả khi cache không báo
+CHANGE_RETENTION = timedelta(days=1)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_NEIGHBOURS = 50
+
+
+class SortedBoard:
+    """Danh sách khóa (sort_key..., user_name) tăng dần: phần tử đầu là hạng 1"""
+
+    def __init__(self, sort_key):
+        self.sort_key = sort_key
+        self.keys = []
+        self.values = {}  # user_name -> dict điểm
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _key(self, user_name, values):
+        return self.sort_key(values) + (user_name,)
+
+    def load(self, rows):
+        """Nạp toàn bộ (user_name, values) rồi sắp xếp một lần"""
+        self.values = dict(rows)
+        self.keys = sorted(self._key(user_name, values) for user_name, values in self.values.items())
+
+    def update(self, user_name, values):
+        """Đặt điểm mới cho một người (values rỗng: xóa khỏi bảng): O(log n) tìm vị trí cũ / mới"""
+        old = self.values.pop(user_name, None)
+        if old is not None:
+            del self.keys[bisect_left(self.keys, self._key(user_name, old))]
+        if values:
+            self.values[user_name] = values
+            insort(self.keys, self._key(user_name, values))
+
+    def rank(self, user_name):
+        """Hạng (bắt đầu từ 1) hoặc None nếu chưa có trên bảng"""
+        values = self.values.get(user_name)
+        if values is None:
+            return None
+        return bisect_left(self.keys, self._key(user_name, values)) + 1
+
+    def page(self, offset, limit):
+        """[(rank, user_name, values), ...] từ vị trí offset"""
+        return [
+            (offset + index + 1, key[-1], self.values[key[-1]])
+            for index, key in enumerate(self.keys[offset:offset + limit])
+        ]
+
+    def around(self, user_name, k):
+        """Người chơi cùng tối đa k người xếp trên và k người xếp dưới"""
+        rank = self.rank(user_name)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - k)
+        return self.page(start, rank - start + k)
+
+
+# --- Nguồn dữ liệu của từng bảng ---
+
+def _xp_rows():
+    rows = UserProfile.objects.values_list('user_name', 'total_xp').iterator(chunk_size=5000)
+    return ((user_name, {'total_xp': total_xp}) for user_name, total_xp in rows)
+
+
+def _quiz_values(row):
+    return {
+        'total_questions': row['total_questions'],
+        'correct_answers': row['correct_answers'],
+        'total_time': row['total_time'] or 0,
+        'total_xp': row['total_xp'] or 0,
+    }
+
+
+def _user_stats_rows(stats):
+    """Các dòng UserStats dạng _quiz_values (người chưa làm câu nào không có trên bảng)"""
+    return stats.filter(total_quizzes__gt=0).values(
+        'user_name', 'correct_answers', 'total_time', 'total_xp', total_questions=F('total_quizzes')
+    )
+
+
+def _quiz_rows():
+    rows = _user_stats_rows(UserStats.objects.all()).iterator(chunk_size=5000)
+    return ((row['user_name'], _quiz_values(row)) for row in rows)
+
+
+BOARDS = {
+    'xp': (lambda v: (-v['total_xp'],), _xp_rows),
+    'quiz': (lambda v: (-v['total_questions'], -v['correct_answers'], v['total_time']), _quiz_rows),
+}
+
+
+# --- Đồng bộ giữa các process ---
+
+class _BoardState:
+    def __init__(self, version, board, last_change_id):
+        self.version = version
+        self.board = board
+        self.cursor = IdCursor(last_change_id)
+        self.recent = {}  # user_name -> id change đã áp dụng, trong cửa sổ của cursor
+        self.checked_at = time.monotonic()
+
+
+_states = {}
+_lock = threading.Lock()
+
+
+def get_version(name):
+    key = VERSION_KEY.format(board=name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Buộc mọi process nạp lại bảng từ nguồn"""
+    key = VERSION_KEY.format(board=name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_version(name)
+        return cache.incr(key)
+
+
+def build_board(name):
+    """Dựng bảng từ nguồn; trả về (board, id change cuối đã phản ánh trong nguồn)"""
+    sort_key, rows = BOARDS[name]
+    # Đọc con trỏ trước khi đọc nguồn, lùi GAP_SECONDS: change của transaction chưa commit lúc
+    # đọc nguồn (id có thể nhỏ hơn id đã commit) được áp dụng lại; giá trị tuyệt đối nên áp lại vẫn đúng
+    last_change_id = LeaderboardChange.objects.filter(
+        board=name, created_at__lt=timezone.now() - timedelta(seconds=GAP_SECONDS)
+    ).aggregate(last=Max('id'))['last'] or 0
+    board = SortedBoard(sort_key)
+    board.load(rows())
+    return board, last_change_id
+
+
+def _apply_changes(name, state):
+    changes = state.cursor.filter(LeaderboardChange.objects.filter(board=name)).values_list(
+        'id', 'user_name', 'values'
+    )
+    for change_id, user_name, values in changes:
+        if not state.cursor.advance(change_id):
+            continue
+        # Change cũ commit muộn: đã áp dụng giá trị mới hơn của người này
+        if state.recent.get(user_name, 0) > change_id:
+            continue
+        state.recent[user_name] = change_id
+        state.board.update(user_name, values)
+    state.recent = {user_name: change_id for user_name, change_id in state.recent.items() if change_id > state.cursor.floor}
+    state.checked_at = time.monotonic()
+
+
+def get_board(name):
+    """SortedBoard của process này, đã áp dụng các thay đổi mới nhất"""
+    version = get_version(name)
+    last_change_key, compacted_key = LAST_CHANGE_KEY.format(board=name), COMPACTED_KEY.format(board=name)
+    markers = cache.get_many([last_change_key, compacted_key])
+    latest, compacted = markers.get(last_change_key), markers.get(compacted_key, 0)
+    with _lock:
+        state = _states.get(name)
+        # Change log đã bị dọn qua con trỏ của process này: không áp dụng tiếp được, dựng lại từ nguồn
+        if state is None or state.version != version or state.cursor.last_id < compacted:
+            board, last_change_id = build_board(name)
+            state = _BoardState(version, board, max(last_change_id, compacted))
+            _states[name] = state
+
+        if latest is None or state.cursor.pending(latest) or time.monotonic() - state.checked_at > CHANGE_POLL_SECONDS:
+            _apply_changes(name, state)
+        return state.board
+
+
+def record_change(name, user_name, values):
+    """Ghi điểm mới của user_name trên bảng name"""
+    change = LeaderboardChange.objects.create(board=name, user_name=user_name, values=values)
+    # Báo sau commit (record_change có thể chạy trong transaction, vd. unlock_achievements)
+    transaction.on_commit(lambda: cache.set(LAST_CHANGE_KEY.format(board=name), change.id, timeout=None))
+    return change
+
+
+def compact_changes(name, retention=CHANGE_RETENTION):
+    """
+    Dọn change log của bảng name; trả về số dòng đã xóa.
+    Dòng đã có dòng mới hơn của cùng người luôn xóa được (giá trị tuyệt đối);
+    dòng cũ hơn retention bị xóa sau khi ghi mốc COMPACTED_KEY.
+    """
+    changes = LeaderboardChange.objects.filter(board=name)
+    last_id = changes.aggregate(last=Max('id'))['last']
+    if last_id is None:
+        return 0
+    changes = changes.filter(id__lte=last_id)  # không chạm các dòng ghi trong lúc dọn
+    latest = changes.values('user_name').annotate(last=Max('id')).values('last').order_by()
+    deleted, _ = changes.exclude(id__in=latest).delete()
+
+    expired_id = changes.filter(created_at__lt=timezone.now() - retention).aggregate(last=Max('id'))['last']
+    if expired_id is not None:
+        # Ghi mốc trước khi xóa: process chưa đọc tới mốc sẽ dựng lại thay vì bỏ sót thay đổi
+        cache.set(COMPACTED_KEY.format(board=name), expired_id, timeout=None)
+        expired, _ = changes.filter(id__lte=expired_id).delete()
+        deleted += expired
+    return deleted
+
+
+def record_quiz_attempt(user_name):
+    """Gọi sau khi thêm / xóa QuizAttempt (UserStats đã cập nhật): ghi tổng mới của người chơi lên bảng 'quiz'"""
+    row = _user_stats_rows(UserStats.objects.filter(user_name=user_name)).first()
+    record_change('quiz', user_name, _quiz_values(row) if row else {})
+
+
+@receiver(post_delete, sender=UserProfile)
+def _profile_deleted(sender, instance, **kwargs):
+    record_change('xp', instance.user_name, {})
+
+
+# --- Bảng xếp hạng theo phạm vi: địa điểm / trường / lớp ---
+
+SCOPES = ('site', 'school', 'class')
+SCOPE_VERSION_KEY = 'heritage:leaderboard:scope:{scope_id}:version'
+SCOPE_EPOCH_KEY = 'heritage:leaderboard:scope:epoch'  # tăng khi đổi lớp / trường của user hoặc dựng lại
+SCOPE_PAGE_KEY = 'heritage:leaderboard:scope:page:{etag}'
+SCOPE_PAGE_TIMEOUT = 60 * 60
+
+
+def _encode_scope(*parts):
+    """Mã hoá phạm vi (và key dạng tuple) không nhập nhằng, tên chứa ký tự bất kỳ"""
+    return json.dumps(parts, ensure_ascii=False)
+
+
+def _scope_id(scope, key):
+    return hashlib.sha1(_encode_scope(scope, key).encode('utf-8')).hexdigest()[:20]
+
+
+def class_key(school_name, class_name):
+    """Tên lớp chỉ duy nhất trong một trường: key là (school_name, class_name), không ghép chuỗi"""
+    return (school_name, class_name)
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        cache.incr(key)
+
+
+def bump_scope(scope, key):
+    _bump(SCOPE_VERSION_KEY.format(scope_id=_scope_id(scope, key)))
+
+
+def bump_scope_epoch():
+    """Làm mới mọi bảng xếp hạng theo phạm vi"""
+    _bump(SCOPE_EPOCH_KEY)
+
+
+def _user_scopes(user_name):
+    """Các phạm vi trường / lớp của user_name (theo UserRole)"""
+    role = UserRole.objects.filter(user__username=user_name).values('school_name', 'class_name').first()
+    scopes = []
+    if role and role['school_name']:
+        scopes.append(('school', role['school_name']))
+        if role['class_name']:
+            scopes.append(('class', class_key(role['school_name'], role['class_name'])))
+    return scopes
+
+
+def _apply_attempt(attempt, sign):
+    """
+    Cộng (sign=1) / trừ (sign=-1) một QuizAttempt vào UserSiteStats.
+    Trả về (site_id của Site, +1 / -1 nếu dòng (user, địa điểm) vừa được tạo / xóa, ngược lại 0).
+    """
+    site = Quiz.objects.filter(pk=attempt.quiz_id).values('site_id', 'site__site_id').first()
+    if site is None:
+        return None, 0
+    deltas = {
+        'total_questions': F('total_questions') + sign,
+        'correct_answers': F('correct_answers') + sign * int(attempt.is_correct),
+        'total_time': F('total_time') + sign * attempt.time_taken,
+        'total_xp': F('total_xp') + sign * attempt.xp_earned,
+    }
+    site_delta = 0
+    stats = UserSiteStats.objects.filter(user_name=attempt.user_name, site_id=site['site_id'])
+    if not stats.update(**deltas) and sign > 0:
+        try:
+            with transaction.atomic():
+                UserSiteStats.objects.create(
+                    user_name=attempt.user_name, site_id=site['site_id'], total_questions=1,
+                    correct_answers=int(attempt.is_correct), total_time=attempt.time_taken, total_xp=attempt.xp_earned,
+                )
+            site_delta = 1
+        except IntegrityError:
+            # Request khác vừa tạo dòng này
+            stats.update(**deltas)
+    elif sign < 0:
+        deleted, _ = stats.filter(total_questions__lte=0).delete()
+        site_delta = -int(bool(deleted))
+    return site['site__site_id'], site_delta
+
+
+def _attempt_changed(attempt, sign):
+    """Cập nhật UserSiteStats + UserStats trong một transaction rồi làm mới các bảng xếp hạng liên quan"""
+    with transaction.atomic():
+        site_key, site_delta = _apply_attempt(attempt, sign)
+        user_stats.apply_attempt(attempt, sign, site_delta)
+    record_quiz_attempt(attempt.user_name)
+
+    if site_key is not None:
+        bump_scope('site', site_key)
+    for scope, key in _user_scopes(attempt.user_name):
+        bump_scope(scope, key)
+
+
+def _scope_stats(scope, key):
+    """Tổng theo user_name trong phạm vi, đã sắp theo thứ tự bảng xếp hạng"""
+    if scope == 'site':
+        rows = UserSiteStats.objects.filter(site__site_id=key)
+    else:
+        if scope == 'class':
+            school_name, class_name = key
+            roles = UserRole.objects.filter(school_name=school_name, class_name=class_name)
+        else:
+            roles = UserRole.objects.filter(school_name=key)
+        rows = UserSiteStats.objects.filter(user_name__in=roles.values('user__username'))
+    return rows.values('user_name').annotate(
+        total_questions=Sum('total_questions'),
+        correct_answers=Sum('correct_answers'),
+        total_time=Sum('total_time'),
+        total_xp=Sum('total_xp'),
+    ).order_by('-total_questions', '-correct_answers', 'total_time', 'user_name')
+
+
+def scope_page(scope, key, offset, limit):
+    """{'count', 'results'} của một trang bảng xếp hạng theo phạm vi (đọc database)"""
+    rows = _scope_stats(scope, key)
+    page = [
+        (offset + index + 1, row['user_name'], _quiz_values(row))
+        for index, row in enumerate(rows[offset:offset + limit])
+    ]
+    return {'count': rows.count(), 'results': quiz_entries(page)}
+
+
+def scope_page_etag(scope, key, offset, limit):
+    """ETag của một trang, chỉ tính từ version trong cache (không truy vấn database)"""
+    version_key = SCOPE_VERSION_KEY.format(scope_id=_scope_id(scope, key))
+    versions = cache.get_many([version_key, SCOPE_EPOCH_KEY])
+    if version_key not in versions:
+        _bump(version_key)
+        versions[version_key] = cache.get(version_key)
+    tag = _encode_scope(scope, key, versions[version_key], versions.get(SCOPE_EPOCH_KEY), offset, limit)
+    return make_etag(tag.encode('utf-8'))
+
+
+def get_scope_page(scope, key, offset, limit):
+    """(etag, hàm trả body); body được cache theo ETag nên mỗi version chỉ truy vấn một lần"""
+    etag = scope_page_etag(scope, key, offset, limit)
+
+    def body():
+        cache_key = SCOPE_PAGE_KEY.format(etag=etag.strip('"'))
+        cached = cache.get(cache_key)
+        if cached is None:
+            payload = {'scope': scope, 'key': key, 'offset': offset, 'limit': limit}
+            payload.update(scope_page(scope, key, offset, limit))
+            cached = encode_json(payload)
+            cache.set(cache_key, cached, SCOPE_PAGE_TIMEOUT)
+        return cached
+
+    return etag, body
+
+
+def rebuild_site_stats():
+    """Dựng lại UserSiteStats từ QuizAttempt; trả về số dòng"""
+    rows = QuizAttempt.objects.values('user_name', 'quiz__site_id').annotate(
+        total_questions=Count('id'),
+        correct_answers=Count('id', filter=Q(is_correct=True)),
+        total_time=Sum('time_taken'),
+        total_xp=Sum('xp_earned'),
+    ).order_by()
+    stats = [
+        UserSiteStats(user_name=row['user_name'], site_id=row['quiz__site_id'], **_quiz_values(row))
+        for row in rows
+    ]
+    with transaction.atomic():
+        UserSiteStats.objects.all().delete()
+        UserSiteStats.objects.bulk_create(stats, batch_size=1000)
+    bump_scope_epoch()
+    return len(stats)
+
+
+@receiver(post_save, sender=QuizAttempt)
+def _attempt_saved(sender, instance, created, **kwargs):
+    if created:
+        _attempt_changed(instance, 1)
+
+
+@receiver(post_delete, sender=QuizAttempt)
+def _attempt_deleted(sender, instance, **kwargs):
+    _attempt_changed(instance, -1)
+
+
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def _role_changed(sender, instance, **kwargs):
+    # Không biết lớp / trường cũ của user: làm mới mọi phạm vi (hiếm khi xảy ra)
+    bump_scope_epoch()
+
+
+# --- Định dạng response ---
+
+def xp_entries(rows):
+    """Dòng bảng 'xp' kèm thông tin hiển thị từ UserProfile (một truy vấn cho cả trang)"""
+    profiles = UserProfile.objects.in_bulk([user_name for _, user_name, _ in rows], field_name='user_name')
+    entries = []
+    for rank, user_name, values in rows:
+        profile = profiles.get(user_name)
+        if profile is None:
+            continue
+        entries.append({
+            'rank': rank,
+            'user_name': user_name,
+            'display_name': profile.display_name,
+            'avatar': profile.avatar.url if profile.avatar else None,
+            'total_xp': profile.total_xp,
+            'level': profile.level,
+            'joined_at': profile.joined_at,
+        })
+    return entries
+
+
+def quiz_entries(rows):
+    """Dòng bảng 'quiz' theo định dạng của quiz-attempts/leaderboard"""
+    entries = []
+    for rank, user_name, values in rows:
+        total = values['total_questions']
+        correct = values['correct_answers']
+        entries.append({
+            'rank': rank,
+            'user_name': user_name,
+            'total_questions': total,
+            'correct_answers': correct,
+            'wrong_answers': total - correct,
+            'score_percentage': round(correct / total * 100, 1) if total > 0 else 0,
+            'total_xp': values['total_xp'],
+            'total_time': values['total_time'],
+            'average_time': round(values['total_time'] / total, 1) if total > 0 else 0,
+        })
+    return entries
+
+
+ENTRY_FORMATTERS = {'xp': xp_entries, 'quiz': quiz_entries}
+
+
+def parse_page(params):
+    """(offset, limit) từ query params; raise ValueError nếu không hợp lệ"""
+    try:
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        offset = limit = None
+    if offset is None or offset < 0 or not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'offset phải >= 0, limit từ 1 đến {MAX_PAGE_SIZE}')
+    return offset, limit
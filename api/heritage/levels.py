@@ -0,0 +1,81 @@
+"""
+Đường cong level: tổng XP cần để đạt mỗi level và level ứng với một lượng XP.
+
+Mặc định là đường tam giác: lên level L + 1 cần thêm L * 100 XP, nên tổng XP
+để đạt level L là 50 * L * (L - 1) (0, 100, 300, 600, ...). level_for_xp dùng
+công thức nghiệm (căn bậc hai nguyên) thay vì vòng lặp.
+
+Đổi đường cong trong settings:
+    HERITAGE_LEVEL_CURVE = 'heritage.levels.TableCurve'
+    HERITAGE_LEVEL_CURVE_OPTIONS = {'thresholds': [0, 100, 250, 500, ...]}
+Sau khi đổi: python manage.py recompute_levels
+"""
+import math
+from bisect import bisect_right
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_CURVE = 'heritage.levels.TriangularCurve'
+
+
+class LevelCurve:
+    """Giao diện đường cong level (level bắt đầu từ 1, XP đạt level 1 là 0)"""
+
+    def xp_for_level(self, level):
+        """Tổng XP cần để đạt level"""
+        raise NotImplementedError
+
+    def level_for_xp(self, total_xp):
+        """Level lớn nhất có xp_for_level(level) <= total_xp"""
+        raise NotImplementedError
+
+    def xp_to_next_level(self, level):
+        """XP cần thêm từ đầu level này tới level kế tiếp"""
+        return self.xp_for_level(level + 1) - self.xp_for_level(level)
+
+
+class TriangularCurve(LevelCurve):
+    """xp_for_level(L) = step / 2 * L * (L - 1)"""
+
+    def __init__(self, step=100):
+        if step <= 0:
+            raise ValueError('step phải dương')
+        self.step = step
+
+    def xp_for_level(self, level):
+        return self.step * level * (level - 1) // 2
+
+    def level_for_xp(self, total_xp):
+        if total_xp < self.step:
+            return 1
+        # L(L - 1) <= m với m = 2 * xp // step  <=>  2L - 1 <= isqrt(1 + 4m)
+        return (1 + math.isqrt(1 + 4 * (2 * total_xp // self.step))) // 2
+
+
+class TableCurve(LevelCurve):
+    """Ngưỡng cho sẵn: thresholds[i] là tổng XP để đạt level i + 1; sau ngưỡng cuối giữ bước cuối"""
+
+    def __init__(self, thresholds):
+        if len(thresholds) < 2 or thresholds[0] != 0 or any(b <= a for a, b in zip(thresholds, thresholds[1:])):
+            raise ValueError('thresholds phải bắt đầu từ 0 và tăng dần (ít nhất 2 mức)')
+        self.thresholds = list(thresholds)
+        self.last_step = self.thresholds[-1] - self.thresholds[-2]
+
+    def xp_for_level(self, level):
+        if level <= len(self.thresholds):
+            return self.thresholds[max(level, 1) - 1]
+        return self.thresholds[-1] + (level - len(self.thresholds)) * self.last_step
+
+    def level_for_xp(self, total_xp):
+        if total_xp < self.thresholds[-1]:
+            return max(bisect_right(self.thresholds, total_xp), 1)
+        return len(self.thresholds) + (total_xp - self.thresholds[-1]) // self.last_step
+
+
+@lru_cache(maxsize=None)
+def get_level_curve():
+    """Đường cong đang dùng (HERITAGE_LEVEL_CURVE), khởi tạo một lần mỗi process"""
+    curve_class = import_string(getattr(settings, 'HERITAGE_LEVEL_CURVE', DEFAULT_CURVE))
+    return curve_class(**getattr(settings, 'HERITAGE_LEVEL_CURVE_OPTIONS', {}))
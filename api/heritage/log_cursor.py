@@ -0,0 +1,54 @@
+"""
+Con trỏ đọc bảng log theo id tăng dần (LeaderboardChange, BattleEvent).
+
+id được cấp khi INSERT nhưng transaction có thể commit lệch thứ tự (PostgreSQL):
+người đọc đã thấy id 12 thì id 11 commit sau sẽ bị "id > 12" bỏ qua mãi mãi.
+IdCursor đọc lại một cửa sổ an toàn phía sau con trỏ: mọi dòng INSERT trong
+GAP_SECONDS gần nhất đều có id lớn hơn con trỏ của GAP_SECONDS trước (floor),
+nên đọc "id > floor" rồi bỏ các id đã đọc. Dòng commit muộn hơn GAP_SECONDS
+sau khi INSERT thì không được bảo đảm.
+"""
+import time
+from collections import deque
+
+GAP_SECONDS = 10    # lâu hơn mọi transaction ghi log
+
+
+class IdCursor:
+    def __init__(self, last_id=0):
+        self.last_id = last_id
+        self.floor = last_id        # mọi dòng chưa đọc có id > floor
+        self.seen = set()           # id > floor đã đọc
+        self.marker = None          # giá trị "id mới nhất" trong cache ở lần kiểm tra trước
+        self._checkpoints = deque([(time.monotonic(), last_id)])
+
+    def _slide(self):
+        deadline = time.monotonic() - GAP_SECONDS
+        while len(self._checkpoints) > 1 and self._checkpoints[1][0] <= deadline:
+            self._checkpoints.popleft()
+        checked_at, last_id = self._checkpoints[0]
+        if checked_at <= deadline and last_id > self.floor:
+            self.floor = last_id
+            self.seen = {row_id for row_id in self.seen if row_id > last_id}
+
+    def pending(self, latest):
+        """
+        Có gì cần đọc theo id mới nhất trong cache (ghi sau commit): mới hơn con trỏ,
+        hoặc đổi giá trị (một transaction id nhỏ hơn vừa commit muộn)
+        """
+        changed, self.marker = latest != self.marker, latest
+        return changed or (latest is not None and latest > self.last_id)
+
+    def filter(self, queryset):
+        """Các dòng trong cửa sổ an toàn và sau con trỏ, theo thứ tự id (lọc id đã đọc bằng advance)"""
+        self._slide()
+        self._checkpoints.append((time.monotonic(), self.last_id))
+        return queryset.filter(id__gt=self.floor).order_by('id')
+
+    def advance(self, row_id):
+        """Ghi nhận dòng row_id; False nếu đã đọc rồi"""
+        if row_id <= self.floor or row_id in self.seen:
+            return False
+        self.seen.add(row_id)
+        self.last_id = max(self.last_id, row_id)
+        return True
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from heritage.leaderboard import build_board
+from heritage.models import UserProfile
+import itertools
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'So sánh bảng xếp hạng XP: truy vấn UserProfile mỗi lần gọi vs bảng xếp hạng trong bộ nhớ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Số người chơi giả lập (mặc định: 100000)')
+        parser.add_argument('--iterations', type=int, default=1000, help='Số lần gọi mỗi thao tác nhanh (mặc định: 1000)')
+
+    def handle(self, *args, **options):
+        user_count = options['users']
+        iterations = options['iterations']
+        rng = random.Random(19)
+
+        # Dữ liệu giả lập nằm trong transaction và bị rollback khi kết thúc
+        with transaction.atomic():
+            started = time.perf_counter()
+            UserProfile.objects.bulk_create(
+                [UserProfile(user_name=f'bench_lb_{i}', total_xp=rng.randint(0, 50000)) for i in range(user_count)],
+                batch_size=5000,
+            )
+            self.stdout.write(f'Tạo {user_count} profile trong {time.perf_counter() - started:.1f} s')
+            names = [f'bench_lb_{rng.randrange(user_count)}' for _ in range(iterations)]
+
+            self.stdout.write('Truy vấn UserProfile mỗi lần gọi:')
+            self._measure('Toàn bộ bảng (cũ)', lambda: [
+                p for p in UserProfile.objects.all().order_by('-level', '-total_xp')
+            ], 3)
+            self._measure('Trang 100 người', lambda: list(
+                UserProfile.objects.order_by('-total_xp', 'user_name')[5000:5100]
+            ), 20)
+            self._measure('Hạng của một người (COUNT)', lambda: self._count_rank(names[0]), 20)
+
+            started = time.perf_counter()
+            board, _ = build_board('xp')
+            self.stdout.write(f'Bảng trong bộ nhớ (dựng {len(board)} người trong {(time.perf_counter() - started) * 1000:.0f} ms):')
+            self._measure('Trang 100 người', lambda: board.page(5000, 100), iterations)
+            name_iter = itertools.cycle(names)
+            self._measure('Hạng của một người', lambda: board.rank(next(name_iter)), iterations)
+            self._measure('Hạng ± 5 người', lambda: board.around(next(name_iter), 5), iterations)
+            self._measure('Cập nhật XP một người', lambda: board.update(
+                next(name_iter), {'total_xp': rng.randint(0, 50000)}
+            ), iterations)
+
+            transaction.set_rollback(True)
+
+    def _count_rank(self, user_name):
+        xp = UserProfile.objects.filter(user_name=user_name).values_list('total_xp', flat=True).first()
+        return UserProfile.objects.filter(total_xp__gt=xp).count() + 1
+
+    def _measure(self, label, func, iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            func()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed_ms = (time.perf_counter() - started) * 1000 / iterations
+        self.stdout.write(f'  {label:<28} {len(ctx.captured_queries):>3} truy vấn   {elapsed_ms:>9.3f} ms/lần')
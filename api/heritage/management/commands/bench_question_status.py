@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from heritage.battle_events import question_status_payload
+from heritage.models import Quiz, QuizBattle, QuizBattleParticipant, BattleSolveState, BattleAnswer
+import random
+import time
+
+
+def first_solver_status(battle):
+    """Không dùng trạng thái materialized: tìm người giải câu đầu tiên qua index của BattleAnswer"""
+    quiz_id = battle.questions[0]
+    first = BattleAnswer.objects.filter(battle=battle, quiz_id=quiz_id, is_correct=True).order_by(
+        'answered_at', 'id'
+    ).values_list('participant__user_name', 'quiz__correct_answer').first()
+    if first:
+        return 0, True, first[0], first[1]
+    return 0, False, None, None
+
+
+class Command(BaseCommand):
+    help = 'So sánh current_question_status: truy vấn BattleAnswer vs đọc BattleSolveState'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--participants', type=int, default=8, help='Số người chơi (mặc định: 8)')
+        parser.add_argument('--questions', type=int, default=20, help='Số câu hỏi (mặc định: 20)')
+        parser.add_argument('--iterations', type=int, default=200, help='Số lần gọi mỗi cách (mặc định: 200)')
+
+    def handle(self, *args, **options):
+        question_count = options['questions']
+        iterations = options['iterations']
+
+        quizzes = list(Quiz.objects.all()[:question_count])
+        if len(quizzes) < question_count:
+            self.stderr.write(self.style.ERROR(f'Cần {question_count} câu hỏi, hiện có {len(quizzes)}. Chạy seed_quizzes trước.'))
+            return
+
+        user_names = [f'bench_{i}' for i in range(options['participants'])]
+        battle = QuizBattle.objects.create(
+            scheduled_start_time=timezone.now(),
+            status='in_progress',
+            questions=[q.id for q in quizzes],
+            participants=user_names,
+        )
+
+        # Mọi người đã trả lời hết, khoảng 60% đúng
+        rng = random.Random(7)
+        solve_state = BattleSolveState(battle=battle)
+        participants = QuizBattleParticipant.objects.bulk_create([
+            QuizBattleParticipant(battle=battle, user_name=name, total_answered=len(quizzes)) for name in user_names
+        ])
+        answers = []
+        for participant in participants:
+            for quiz in quizzes:
+                is_correct = rng.random() < 0.6
+                wrong = next(a for a in 'ABCD' if a != quiz.correct_answer)
+                answers.append(BattleAnswer(
+                    battle=battle, participant=participant, quiz=quiz,
+                    answer=quiz.correct_answer if is_correct else wrong, is_correct=is_correct, time_taken=5,
+                ))
+                if is_correct:
+                    solve_state.record_solve(battle.questions, quiz.id, participant.user_name, quiz.correct_answer)
+        BattleAnswer.objects.bulk_create(answers)
+        solve_state.save()
+
+        self.stdout.write(f'Battle {len(user_names)} người x {question_count} câu, {iterations} lần gọi')
+        try:
+            self._measure('Truy vấn BattleAnswer', lambda: first_solver_status(battle), iterations)
+            self._measure('BattleSolveState', lambda: question_status_payload(battle), iterations)
+        finally:
+            battle.delete()
+
+    def _measure(self, label, func, iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            func()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed_ms = (time.perf_counter() - started) * 1000 / iterations
+        self.stdout.write(f'  {label:<28} {len(ctx.captured_queries):>3} truy vấn   {elapsed_ms:>8.3f} ms/lần')
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from heritage.models import Site
+from heritage.site_cache import encode_json, site_feature
+from heritage.spatial import SiteEntry
+import gzip
+import json
+import os
+
+
+class Command(BaseCommand):
+    help = 'So sánh kích thước payload bản đồ: FeatureCollection đầy đủ vs danh sách tóm tắt + chi tiết'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fixture',
+            default=os.path.join('fixtures', 'initial_sites.geojson'),
+            help='File GeoJSON dùng để đo (mặc định: fixtures/initial_sites.geojson)'
+        )
+
+    def handle(self, *args, **options):
+        fixture_path = options['fixture']
+        if not os.path.exists(fixture_path):
+            self.stdout.write(self.style.ERROR(f'File not found: {fixture_path}'))
+            return
+
+        with open(fixture_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        # Dựng Site (không lưu DB) giống load_sites
+        sites = []
+        for feature in data['features']:
+            props = feature['properties']
+            sites.append(Site(
+                site_id=props['id'],
+                name=props['name'],
+                geojson=feature,
+                image_urls=props.get('images', []),
+                conservation_status=props.get('conservation_status', 'good'),
+                status_description='',
+                conduct={
+                    'dos': props.get('dos', []),
+                    'donts': props.get('donts', []),
+                    'lawExcerpt': props.get('legal_excerpt', ''),
+                    'lawLink': ''
+                }
+            ))
+
+        entries = [SiteEntry(site) for site in sites]
+        full = encode_json({'type': 'FeatureCollection', 'features': [site_feature(s) for s in sites]})
+        summary = encode_json({'type': 'FeatureCollection', 'features': [e.summary_feature() for e in entries]})
+        details = [encode_json(e.feature) for e in entries]
+        average_detail = sum(len(d) for d in details) / len(details) if details else 0
+
+        def row(label, body):
+            self.stdout.write(f'  {label:<32} {len(body):>9,} B   gzip {len(gzip.compress(body)):>8,} B')
+
+        self.stdout.write(f'{len(sites)} sites từ {fixture_path}')
+        row('FeatureCollection đầy đủ', full)
+        row('Danh sách tóm tắt (summary)', summary)
+        self.stdout.write(f'  {"Chi tiết 1 địa điểm (trung bình)":<32} {average_detail:>9,.0f} B')
+
+        if full:
+            saved = 100 - len(summary) / len(full) * 100
+            self.stdout.write(self.style.SUCCESS(
+                f'Tải bản đồ + mở 2 chi tiết: {len(summary) + 2 * average_detail:,.0f} B '
+                f'thay vì {len(full):,} B (giảm {saved:.1f}% cho lần tải đầu)'
+            ))
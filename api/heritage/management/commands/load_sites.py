@@ -19,8 +19,8 @@ class Command(BaseCommand):
         with open(fixture_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
-        # Delete all existing sites
-        deleted_count = Site.objects.all().count()
+        # Delete all existing sites (signal ghi tombstone và làm mới cache bản đồ)
+        deleted_count = Site.objects.count()
         Site.objects.all().delete()
         self.stdout.write(self.style.WARNING(f'Deleted {deleted_count} existing sites'))
         
@@ -1,27 +1,19 @@
 from django.core.management.base import BaseCommand
-from django.db.models import Sum
-from heritage.models import QuizAttempt, UserProfile
+from heritage.models import UserProfile, UserStats
 
 class Command(BaseCommand):
-    help = 'Migrate XP data from QuizAttempt to UserProfile'
+    help = 'Migrate XP data from QuizAttempt (via UserStats) to UserProfile'
 
     def handle(self, *args, **options):
         self.stdout.write('Starting XP migration...')
 
-        # Get all users who have quiz attempts
-        users_with_attempts = QuizAttempt.objects.values('user_name').distinct()
+        # Total XP per user is already aggregated in UserStats (rebuild_user_stats)
+        users_with_attempts = UserStats.objects.filter(total_quizzes__gt=0).values_list('user_name', 'total_xp')
 
         migrated_count = 0
         total_xp_migrated = 0
 
-        for user_data in users_with_attempts:
-            user_name = user_data['user_name']
-
-            # Calculate total XP from attempts
-            user_xp = QuizAttempt.objects.filter(user_name=user_name).aggregate(
-                total=Sum('xp_earned')
-            )['total'] or 0
-
+        for user_name, user_xp in users_with_attempts:
             if user_xp > 0:
                 # Get or create user profile
                 profile, created = UserProfile.objects.get_or_create(
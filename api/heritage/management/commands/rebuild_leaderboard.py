@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from heritage import leaderboard
+from heritage.models import LeaderboardChange
+import time
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại bảng xếp hạng từ nguồn (UserProfile / UserStats / QuizAttempt): bảng trong bộ nhớ, change log và UserSiteStats'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--board', choices=sorted(leaderboard.BOARDS) + ['site'], action='append',
+            help='Chỉ dựng lại bảng này; site = bảng tổng hợp theo địa điểm (mặc định: tất cả)'
+        )
+
+    def handle(self, *args, **options):
+        boards = options['board'] or sorted(leaderboard.BOARDS) + ['site']
+
+        if 'site' in boards:
+            started = time.perf_counter()
+            count = leaderboard.rebuild_site_stats()
+            self.stdout.write(self.style.SUCCESS(
+                f'UserSiteStats: {count} dòng, dựng trong {(time.perf_counter() - started) * 1000:.0f} ms'
+            ))
+
+        for name in boards:
+            if name == 'site':
+                continue
+            started = time.perf_counter()
+            board, _ = leaderboard.build_board(name)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            # Nguồn đã phản ánh mọi thay đổi: xóa change log rồi tăng version để
+            # mọi process nạp lại từ nguồn thay vì áp dụng tiếp change log
+            deleted, _ = LeaderboardChange.objects.filter(board=name).delete()
+            leaderboard.bump_version(name)
+
+            self.stdout.write(self.style.SUCCESS(
+                f'Bảng {name}: {len(board)} người, dựng trong {elapsed_ms:.0f} ms, xóa {deleted} thay đổi cũ'
+            ))
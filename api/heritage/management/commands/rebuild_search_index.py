@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from heritage.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại chỉ mục tìm kiếm toàn văn (địa điểm, câu hỏi, bình luận)'
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'✓ Indexed {count} documents'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from heritage import leaderboard
+from heritage.models import LeaderboardChange
+from heritage.user_stats import rebuild_user_stats
+import time
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại bảng tổng hợp UserStats từ QuizAttempt và các battle đã kết thúc'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_user_stats()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        # Bảng xếp hạng 'quiz' đọc từ UserStats: bỏ change log cũ để mọi process nạp lại
+        LeaderboardChange.objects.filter(board='quiz').delete()
+        leaderboard.bump_version('quiz')
+
+        self.stdout.write(self.style.SUCCESS(f'UserStats: {count} người, dựng trong {elapsed_ms:.0f} ms'))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from heritage.levels import get_level_curve
+from heritage.models import UserProfile
+import time
+
+BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = 'Tính lại level của mọi UserProfile theo đường cong level hiện tại'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ đếm số profile cần sửa, không ghi')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Số profile mỗi lượt (mặc định: {BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        curve = get_level_curve()
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        # Một lượt đọc (id, total_xp, level) theo khoá chính, từng khối batch_size dòng;
+        # level tính bằng level_for_xp (mọi đường cong), chỉ ghi dòng bị lệch bằng một bulk_update.
+        # Khối được khoá trong transaction của nó: total_xp đổi giữa lúc đọc và ghi không bị level cũ đè.
+        # (UPDATE không qua save(): total_xp không đổi nên bảng xếp hạng không cần báo)
+        checked = fixed = last_id = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    UserProfile.objects.select_for_update().filter(id__gt=last_id).order_by('id')
+                    .values_list('id', 'total_xp', 'level')[:batch_size]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                checked += len(rows)
+                changed = []
+                for profile_id, total_xp, current in rows:
+                    level = curve.level_for_xp(total_xp)
+                    if level != current:
+                        changed.append(UserProfile(id=profile_id, level=level))
+                fixed += len(changed)
+                if changed and not options['dry_run']:
+                    UserProfile.objects.bulk_update(changed, ['level'])
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        action = 'cần sửa' if options['dry_run'] else 'đã sửa'
+        self.stdout.write(self.style.SUCCESS(
+            f'{checked} profile: {action} {fixed} trong {elapsed_ms:.0f} ms ({type(curve).__name__})'
+        ))
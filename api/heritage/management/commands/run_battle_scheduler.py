@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from heritage import leaderboard
+from heritage.battle_lifecycle import run_due_transitions, next_due_time
+from heritage.tournaments import advance_ready_tournaments
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ERROR_RETRY_SECONDS = 5
+COMPACT_INTERVAL = 60 * 60  # giây giữa hai lần dọn change log bảng xếp hạng
+
+
+class Command(BaseCommand):
+    help = 'Tiến trình nền chuyển trạng thái battle (bắt đầu / kết thúc) đúng thời điểm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Chạy một lượt rồi thoát (dùng với cron)')
+        parser.add_argument(
+            '--max-sleep', type=float, default=30,
+            help='Số giây ngủ tối đa giữa hai lượt, để nhận battle mới tạo (mặc định: 30)'
+        )
+
+    compacted_at = None
+
+    def compact_leaderboards(self):
+        """Dọn change log của bảng xếp hạng (tối đa mỗi COMPACT_INTERVAL giây)"""
+        if self.compacted_at is not None and time.monotonic() - self.compacted_at < COMPACT_INTERVAL:
+            return
+        deleted = sum(leaderboard.compact_changes(name) for name in leaderboard.BOARDS)
+        self.compacted_at = time.monotonic()
+        if deleted:
+            self.stdout.write(f'{timezone.now():%Y-%m-%d %H:%M:%S} dọn {deleted} thay đổi bảng xếp hạng')
+
+    def run_once(self):
+        close_old_connections()
+        started, completed = run_due_transitions()
+        if started or completed:
+            self.stdout.write(f'{timezone.now():%Y-%m-%d %H:%M:%S} bắt đầu {started}, kết thúc {completed} battle')
+
+        # Vòng đấu thường được chuyển ngay khi battle cuối kết thúc; lượt này chỉ để tự phục hồi
+        advanced = advance_ready_tournaments()
+        if advanced:
+            self.stdout.write(f'{timezone.now():%Y-%m-%d %H:%M:%S} chuyển vòng {advanced} giải đấu')
+
+        self.compact_leaderboards()
+
+    def handle(self, *args, **options):
+        max_sleep = options['max_sleep']
+
+        if options['once']:
+            self.run_once()
+            return
+
+        while True:
+            # Lỗi của một lượt (database tạm mất kết nối, một battle / giải đấu lỗi...) không dừng scheduler
+            try:
+                self.run_once()
+                due = next_due_time()
+                # Ngủ tới battle kế tiếp cần chuyển trạng thái
+                delay = max_sleep if due is None else (due - timezone.now()).total_seconds()
+            except Exception:
+                logger.exception('Lượt scheduler lỗi, thử lại sau vài giây')
+                close_old_connections()
+                delay = ERROR_RETRY_SECONDS
+
+            time.sleep(min(max(delay, 0.5), max_sleep))
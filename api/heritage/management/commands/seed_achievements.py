@@ -3,7 +3,7 @@ from heritage.models import Achievement
 
 
 class Command(BaseCommand):
-    help = 'Seed default achievements'
+    help = 'Seed default achievements (requirement theo cú pháp trong heritage/achievement_rules.py)'
 
     def handle(self, *args, **options):
         achievements = [
@@ -13,7 +13,7 @@ class Command(BaseCommand):
                 'icon': 'Play',
                 'achievement_type': 'first_quiz',
                 'xp_reward': 10,
-                'requirement': {'total_quizzes': 1},
+                'requirement': {'stat': 'total_quizzes', 'gte': 1},
                 'rarity': 'common'
             },
             {
@@ -22,7 +22,7 @@ class Command(BaseCommand):
                 'icon': 'BookOpen',
                 'achievement_type': 'quiz_master',
                 'xp_reward': 50,
-                'requirement': {'total_quizzes': 10},
+                'requirement': {'stat': 'total_quizzes', 'gte': 10},
                 'rarity': 'common'
             },
             {
@@ -31,7 +31,7 @@ class Command(BaseCommand):
                 'icon': 'Brain',
                 'achievement_type': 'quiz_master',
                 'xp_reward': 150,
-                'requirement': {'total_quizzes': 50},
+                'requirement': {'stat': 'total_quizzes', 'gte': 50},
                 'rarity': 'rare'
             },
             {
@@ -40,7 +40,7 @@ class Command(BaseCommand):
                 'icon': 'Trophy',
                 'achievement_type': 'quiz_master',
                 'xp_reward': 300,
-                'requirement': {'total_quizzes': 100},
+                'requirement': {'stat': 'total_quizzes', 'gte': 100},
                 'rarity': 'epic'
             },
             {
@@ -49,7 +49,7 @@ class Command(BaseCommand):
                 'icon': 'Zap',
                 'achievement_type': 'speed_demon',
                 'xp_reward': 25,
-                'requirement': {'fastest_time': 5},
+                'requirement': {'stat': 'fast_correct', 'gte': 1},
                 'rarity': 'rare'
             },
             {
@@ -58,7 +58,7 @@ class Command(BaseCommand):
                 'icon': 'Star',
                 'achievement_type': 'perfect_score',
                 'xp_reward': 100,
-                'requirement': {'perfect_battle': True},
+                'requirement': {'stat': 'perfect_battles', 'gte': 1},
                 'rarity': 'epic'
             },
             {
@@ -67,7 +67,7 @@ class Command(BaseCommand):
                 'icon': 'Crown',
                 'achievement_type': 'battle_winner',
                 'xp_reward': 75,
-                'requirement': {'battle_wins': 1},
+                'requirement': {'stat': 'battle_wins', 'gte': 1},
                 'rarity': 'rare'
             },
             {
@@ -76,7 +76,7 @@ class Command(BaseCommand):
                 'icon': 'MapPin',
                 'achievement_type': 'explorer',
                 'xp_reward': 40,
-                'requirement': {'unique_sites': 5},
+                'requirement': {'stat': 'unique_sites', 'gte': 5},
                 'rarity': 'common'
             },
             {
@@ -85,7 +85,34 @@ class Command(BaseCommand):
                 'icon': 'Sun',
                 'achievement_type': 'early_bird',
                 'xp_reward': 30,
-                'requirement': {'early_morning_quiz': True},
+                'requirement': {'stat': 'early_attempts', 'gte': 1},
+                'rarity': 'rare'
+            },
+            {
+                'name': 'Streak Starter',
+                'description': 'Làm quiz 3 ngày liên tiếp',
+                'icon': 'Flame',
+                'achievement_type': 'streak_master',
+                'xp_reward': 30,
+                'requirement': {'stat': 'longest_streak', 'gte': 3},
+                'rarity': 'common'
+            },
+            {
+                'name': 'Streak Master',
+                'description': 'Làm quiz 7 ngày liên tiếp',
+                'icon': 'Flame',
+                'achievement_type': 'streak_master',
+                'xp_reward': 100,
+                'requirement': {'stat': 'longest_streak', 'gte': 7},
+                'rarity': 'epic'
+            },
+            {
+                'name': 'On Fire',
+                'description': 'Trả lời đúng 10 câu liên tiếp',
+                'icon': 'Target',
+                'achievement_type': 'streak_master',
+                'xp_reward': 50,
+                'requirement': {'stat': 'longest_correct_run', 'gte': 10},
                 'rarity': 'rare'
             },
             {
@@ -94,7 +121,7 @@ class Command(BaseCommand):
                 'icon': 'TrendingUp',
                 'achievement_type': 'quiz_master',
                 'xp_reward': 100,
-                'requirement': {'level': 5},
+                'requirement': {'stat': 'level', 'gte': 5},
                 'rarity': 'rare'
             },
             {
@@ -103,7 +130,7 @@ class Command(BaseCommand):
                 'icon': 'Award',
                 'achievement_type': 'quiz_master',
                 'xp_reward': 200,
-                'requirement': {'level': 10},
+                'requirement': {'stat': 'level', 'gte': 10},
                 'rarity': 'epic'
             },
             {
@@ -112,7 +139,7 @@ class Command(BaseCommand):
                 'icon': 'Gem',
                 'achievement_type': 'quiz_master',
                 'xp_reward': 500,
-                'requirement': {'level': 25},
+                'requirement': {'stat': 'level', 'gte': 25},
                 'rarity': 'legendary'
             }
         ]
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from heritage.models import QuizBattle
+from heritage.battle_lifecycle import start_battle
 
 
 class Command(BaseCommand):
@@ -21,8 +22,9 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING(f'Battle #{battle_id} is already {battle.status}'))
             return
         
-        battle.status = 'in_progress'
-        battle.save()
+        if not start_battle(battle):
+            self.stdout.write(self.style.WARNING(f'Battle #{battle_id} was started by another process'))
+            return
         
         self.stdout.write(self.style.SUCCESS(f'✓ Battle #{battle_id} started!'))
         self.stdout.write(f'  Participants: {battle.participants}')
@@ -0,0 +1,165 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:37
+
+import unicodedata
+
+from django.db import migrations, models
+
+FTS_TABLE = 'heritage_searchdocument_fts'
+
+POSTGRES_SQL = [
+    """
+    ALTER TABLE heritage_searchdocument ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(search_title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(search_content, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX heritage_searchdocument_vector_idx ON heritage_searchdocument USING GIN (search_vector)',
+]
+
+SQLITE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        search_title, search_content,
+        content='heritage_searchdocument', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER heritage_searchdocument_ai AFTER INSERT ON heritage_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, search_title, search_content)
+        VALUES (new.id, new.search_title, new.search_content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER heritage_searchdocument_ad AFTER DELETE ON heritage_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_title, search_content)
+        VALUES ('delete', old.id, old.search_title, old.search_content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER heritage_searchdocument_au AFTER UPDATE ON heritage_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_title, search_content)
+        VALUES ('delete', old.id, old.search_title, old.search_content);
+        INSERT INTO {FTS_TABLE}(rowid, search_title, search_content)
+        VALUES (new.id, new.search_title, new.search_content);
+    END
+    """,
+]
+
+SQLITE_REVERSE_SQL = [
+    'DROP TRIGGER IF EXISTS heritage_searchdocument_ai',
+    'DROP TRIGGER IF EXISTS heritage_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS heritage_searchdocument_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = POSTGRES_SQL if vendor == 'postgresql' else SQLITE_SQL if vendor == 'sqlite' else []
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in SQLITE_REVERSE_SQL:
+            schema_editor.execute(sql)
+
+
+# Bản sao cố định của heritage.search tại thời điểm tạo migration: migration không
+# import code của app (code sau này có thể đổi hoặc bị xóa)
+
+def normalize_text(text):
+    if not text:
+        return ''
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+def site_document_fields(name, geojson):
+    properties = (geojson.get('properties') if isinstance(geojson, dict) else None) or {}
+    content = '\n'.join(filter(None, [properties.get('summary'), properties.get('history')]))
+    return {
+        'title': name,
+        'content': content,
+        'search_title': normalize_text(name),
+        'search_content': normalize_text(content),
+    }
+
+
+def quiz_document_fields(question, options):
+    content = '\n'.join(filter(None, options))
+    return {
+        'title': question[:255],
+        'content': content,
+        'search_title': normalize_text(question),
+        'search_content': normalize_text(content),
+    }
+
+
+def comment_document_fields(user_name, content):
+    return {
+        'title': user_name[:255],
+        'content': content,
+        'search_title': '',
+        'search_content': normalize_text(content),
+    }
+
+
+def populate_search_documents(apps, schema_editor):
+    Site = apps.get_model('heritage', 'Site')
+    Quiz = apps.get_model('heritage', 'Quiz')
+    Comment = apps.get_model('heritage', 'Comment')
+    SearchDocument = apps.get_model('heritage', 'SearchDocument')
+
+    documents = []
+    for site in Site.objects.all():
+        documents.append(SearchDocument(
+            kind='site', object_id=site.pk, site_id=site.site_id,
+            **site_document_fields(site.name, site.geojson)
+        ))
+    for quiz in Quiz.objects.select_related('site'):
+        options = [quiz.option_a, quiz.option_b, quiz.option_c, quiz.option_d]
+        documents.append(SearchDocument(
+            kind='quiz', object_id=quiz.pk, site_id=quiz.site.site_id,
+            **quiz_document_fields(quiz.question, options)
+        ))
+    for comment in Comment.objects.select_related('site'):
+        documents.append(SearchDocument(
+            kind='comment', object_id=comment.pk, site_id=comment.site.site_id,
+            **comment_document_fields(comment.user_name, comment.content)
+        ))
+    SearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0003_site_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('site', 'Địa điểm'), ('quiz', 'Câu hỏi'), ('comment', 'Bình luận')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('site_id', models.CharField(blank=True, help_text='site_id liên quan', max_length=100)),
+                ('title', models.CharField(blank=True, help_text='Tiêu đề hiển thị', max_length=255)),
+                ('content', models.TextField(blank=True, help_text='Nội dung gốc (để trích đoạn)')),
+                ('search_title', models.TextField(blank=True)),
+                ('search_content', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0004_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BattleEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('question-solved', 'Câu hỏi đã có người trả lời đúng'), ('answer-submitted', 'Có người nộp câu trả lời'), ('rank-changed', 'Bảng xếp hạng thay đổi'), ('status-changed', 'Trạng thái battle thay đổi')], max_length=30)),
+                ('data', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('battle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='heritage.quizbattle')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['battle', 'id'], name='heritage_ba_battle__5a0d3f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_solve_states(apps, schema_editor):
+    """Dựng trạng thái giải câu hỏi cho các battle đã có từ JSON answers của participant"""
+    QuizBattle = apps.get_model('heritage', 'QuizBattle')
+    QuizBattleParticipant = apps.get_model('heritage', 'QuizBattleParticipant')
+    Quiz = apps.get_model('heritage', 'Quiz')
+    BattleSolveState = apps.get_model('heritage', 'BattleSolveState')
+
+    states = []
+    for battle in QuizBattle.objects.all():
+        questions = battle.questions or []
+        first_solvers = {}
+        # Cùng thứ tự với truy vấn cũ (Meta.ordering của participant)
+        participants = QuizBattleParticipant.objects.filter(battle=battle).order_by(
+            '-total_answered', '-correct_answers', 'time_completed'
+        )
+        for participant in participants:
+            for quiz_id, answer in (participant.answers or {}).items():
+                if answer.get('is_correct'):
+                    first_solvers.setdefault(str(quiz_id), participant.user_name)
+
+        solved_by = first_solvers.get(str(questions[0])) if questions else None
+        correct_answer = None
+        if solved_by:
+            correct_answer = Quiz.objects.filter(id=questions[0]).values_list('correct_answer', flat=True).first()
+        states.append(BattleSolveState(
+            battle=battle,
+            current_question_index=0,
+            solved_by=solved_by,
+            correct_answer=correct_answer,
+            first_solvers=first_solvers,
+        ))
+    BattleSolveState.objects.bulk_create(states, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0005_battle_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BattleSolveState',
+            fields=[
+                ('battle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='solve_state', serialize=False, to='heritage.quizbattle')),
+                ('current_question_index', models.IntegerField(default=0)),
+                ('solved_by', models.CharField(blank=True, help_text='Người trả lời đúng câu hiện tại đầu tiên', max_length=200, null=True)),
+                ('correct_answer', models.CharField(blank=True, help_text='Đáp án câu hiện tại (khi đã có người giải)', max_length=1, null=True)),
+                ('first_solvers', models.JSONField(default=dict, help_text='Quiz ID -> user_name trả lời đúng đầu tiên')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_solve_states, migrations.RunPython.noop),
+    ]
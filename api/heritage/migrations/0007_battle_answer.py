@@ -0,0 +1,98 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:48
+
+from datetime import timedelta
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def answers_to_rows(apps, schema_editor):
+    """
+    Chuyển JSON answers của participant thành các dòng BattleAnswer.
+
+    JSON không lưu thời điểm trả lời: answered_at ước lượng bằng lúc bắt đầu (vào trận
+    hoặc battle bắt đầu, lấy mốc sau) cộng dồn time_taken theo thứ tự battle.questions
+    (thứ tự khoá JSON không đáng tin, jsonb sắp xếp lại), để dựng lại "ai giải trước"
+    từ BattleAnswer không phụ thuộc vào một mốc chung cho mọi câu.
+    """
+    QuizBattleParticipant = apps.get_model('heritage', 'QuizBattleParticipant')
+    Quiz = apps.get_model('heritage', 'Quiz')
+    BattleAnswer = apps.get_model('heritage', 'BattleAnswer')
+
+    quiz_ids = set(Quiz.objects.values_list('id', flat=True))
+    rows = []
+    # Cùng thứ tự participant với backfill BattleSolveState (0006): hoà thời điểm thì id quyết định
+    participants = QuizBattleParticipant.objects.select_related('battle').order_by(
+        'battle_id', '-total_answered', '-correct_answers', 'time_completed'
+    )
+    for participant in participants.iterator():
+        answers = participant.answers or {}
+        position = {str(quiz_id): index for index, quiz_id in enumerate(participant.battle.questions or [])}
+        answered_at = max(participant.joined_at, participant.battle.scheduled_start_time)
+        for quiz_id in sorted(answers, key=lambda quiz_id: position.get(quiz_id, len(position))):
+            data = answers[quiz_id]
+            answer = str(data.get('answer') or '').upper()[:1]
+            time_taken = data.get('time_taken') or 0
+            answered_at += timedelta(seconds=max(time_taken, 0))
+            if int(quiz_id) not in quiz_ids or answer not in ('A', 'B', 'C', 'D'):
+                continue
+            rows.append(BattleAnswer(
+                battle_id=participant.battle_id,
+                participant=participant,
+                quiz_id=int(quiz_id),
+                answer=answer,
+                is_correct=bool(data.get('is_correct')),
+                time_taken=time_taken,
+                answered_at=answered_at,
+            ))
+    BattleAnswer.objects.bulk_create(rows, batch_size=1000)
+
+
+def rows_to_answers(apps, schema_editor):
+    QuizBattleParticipant = apps.get_model('heritage', 'QuizBattleParticipant')
+    BattleAnswer = apps.get_model('heritage', 'BattleAnswer')
+
+    answers = {}
+    for row in BattleAnswer.objects.order_by('id').iterator():
+        answers.setdefault(row.participant_id, {})[str(row.quiz_id)] = {
+            'answer': row.answer,
+            'is_correct': row.is_correct,
+            'time_taken': row.time_taken,
+        }
+    for participant in QuizBattleParticipant.objects.filter(id__in=answers.keys()):
+        participant.answers = answers[participant.id]
+        participant.save(update_fields=['answers'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0006_battle_solve_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BattleAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer', models.CharField(choices=[('A', 'A'), ('B', 'B'), ('C', 'C'), ('D', 'D')], max_length=1)),
+                ('is_correct', models.BooleanField(default=False)),
+                ('time_taken', models.IntegerField(default=0, help_text='Thời gian trả lời (giây)')),
+                ('answered_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('battle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='battle_answers', to='heritage.quizbattle')),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='battle_answers', to='heritage.quizbattleparticipant')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='battle_answers', to='heritage.quiz')),
+            ],
+            options={
+                'ordering': ['answered_at', 'id'],
+                'indexes': [models.Index(fields=['battle', 'quiz', 'is_correct', 'answered_at'], name='heritage_ba_battle__b8ccde_idx')],
+                'constraints': [models.UniqueConstraint(fields=('participant', 'quiz'), name='unique_battle_answer')],
+            },
+        ),
+        migrations.RunPython(answers_to_rows, rows_to_answers),
+        migrations.RemoveField(
+            model_name='quizbattleparticipant',
+            name='answers',
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0007_battle_answer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tournament',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('format', models.CharField(choices=[('elimination', 'Loại trực tiếp'), ('swiss', 'Hệ Thụy Sĩ')], default='elimination', max_length=20)),
+                ('status', models.CharField(choices=[('in_progress', 'Đang diễn ra'), ('completed', 'Đã kết thúc'), ('cancelled', 'Đã hủy')], default='in_progress', max_length=20)),
+                ('group_size', models.IntegerField(default=4, help_text='Số người mỗi battle (2-8)')),
+                ('advance_count', models.IntegerField(default=1, help_text='Số người mỗi battle được đi tiếp (loại trực tiếp)')),
+                ('total_rounds', models.IntegerField(blank=True, help_text='Số vòng (Swiss); loại trực tiếp đấu tới khi còn một battle', null=True)),
+                ('current_round', models.IntegerField(default=1)),
+                ('question_count', models.IntegerField(default=6)),
+                ('duration_minutes', models.IntegerField(default=10, help_text='Thời gian làm bài mỗi vòng (phút)')),
+                ('round_gap_minutes', models.IntegerField(default=5, help_text='Thời gian nghỉ trước vòng kế tiếp (phút)')),
+                ('winner', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TournamentEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_name', models.CharField(max_length=200)),
+                ('seed', models.IntegerField(help_text='Hạt giống (1 = mạnh nhất theo XP)')),
+                ('points', models.IntegerField(default=0, help_text='Điểm Swiss: số người xếp sau trong mỗi battle')),
+                ('total_score', models.IntegerField(default=0, help_text='Tổng điểm battle qua các vòng')),
+                ('eliminated_round', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-points', '-total_score', 'seed'],
+            },
+        ),
+        migrations.AddField(
+            model_name='quizbattle',
+            name='tournament_round',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='quizbattle',
+            name='tournament',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='battles', to='heritage.tournament'),
+        ),
+        migrations.AddIndex(
+            model_name='quizbattle',
+            index=models.Index(fields=['tournament', 'tournament_round', 'status'], name='heritage_qu_tournam_8fb054_idx'),
+        ),
+        migrations.AddField(
+            model_name='tournamententry',
+            name='tournament',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='heritage.tournament'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tournamententry',
+            unique_together={('tournament', 'user_name')},
+        ),
+    ]
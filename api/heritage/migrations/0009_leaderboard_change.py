@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0008_tournament'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('xp', 'Tổng XP (UserProfile)'), ('quiz', 'Số câu đã làm (QuizAttempt)')], max_length=20)),
+                ('user_name', models.CharField(max_length=200)),
+                ('values', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['board', 'id'], name='heritage_le_board_9986ce_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def build_user_site_stats(apps, schema_editor):
+    """Tổng hợp QuizAttempt sẵn có theo (user_name, site)"""
+    QuizAttempt = apps.get_model('heritage', 'QuizAttempt')
+    UserSiteStats = apps.get_model('heritage', 'UserSiteStats')
+
+    rows = QuizAttempt.objects.values('user_name', 'quiz__site_id').annotate(
+        total_questions=Count('id'),
+        correct_answers=Count('id', filter=Q(is_correct=True)),
+        total_time=Sum('time_taken'),
+        total_xp=Sum('xp_earned'),
+    ).order_by()
+    UserSiteStats.objects.bulk_create([
+        UserSiteStats(
+            user_name=row['user_name'],
+            site_id=row['quiz__site_id'],
+            total_questions=row['total_questions'],
+            correct_answers=row['correct_answers'],
+            total_time=row['total_time'] or 0,
+            total_xp=row['total_xp'] or 0,
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0009_leaderboard_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSiteStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_name', models.CharField(max_length=200)),
+                ('total_questions', models.IntegerField(default=0)),
+                ('correct_answers', models.IntegerField(default=0)),
+                ('total_time', models.IntegerField(default=0, help_text='Tổng thời gian (giây)')),
+                ('total_xp', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_stats', to='heritage.site')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['site', '-total_questions', '-correct_answers', 'total_time'], name='user_site_stats_rank_idx')],
+                'unique_together': {('user_name', 'site')},
+            },
+        ),
+        migrations.RunPython(build_user_site_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:05
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def build_user_stats(apps, schema_editor):
+    """Tổng hợp QuizAttempt và kết quả battle sẵn có theo user_name"""
+    QuizAttempt = apps.get_model('heritage', 'QuizAttempt')
+    QuizBattleParticipant = apps.get_model('heritage', 'QuizBattleParticipant')
+    UserStats = apps.get_model('heritage', 'UserStats')
+
+    stats = {}
+    attempts = QuizAttempt.objects.exclude(user_name='').values('user_name').annotate(
+        total_quizzes=Count('id'),
+        correct_answers=Count('id', filter=Q(is_correct=True)),
+        total_time=Sum('time_taken'),
+        total_xp=Sum('xp_earned'),
+        unique_sites=Count('quiz__site', distinct=True),
+        fast_correct=Count('id', filter=Q(is_correct=True, time_taken__lte=5)),
+        early_attempts=Count('id', filter=Q(created__hour__lt=8)),
+    ).order_by()
+    for row in attempts:
+        stats[row.pop('user_name')] = {field: value or 0 for field, value in row.items()}
+
+    battles = QuizBattleParticipant.objects.filter(battle__status='completed').values('user_name').annotate(
+        battles_played=Count('id'),
+        battle_wins=Count('id', filter=Q(rank=1)),
+        perfect_battles=Count('id', filter=Q(correct_answers__gte=5)),
+    ).order_by()
+    for row in battles:
+        stats.setdefault(row.pop('user_name'), {}).update(row)
+
+    UserStats.objects.bulk_create(
+        [UserStats(user_name=user_name, **values) for user_name, values in stats.items()], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0010_user_site_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_name', models.CharField(max_length=200, unique=True)),
+                ('total_quizzes', models.IntegerField(default=0, help_text='Số câu đã làm')),
+                ('correct_answers', models.IntegerField(default=0)),
+                ('total_time', models.IntegerField(default=0, help_text='Tổng thời gian (giây)')),
+                ('total_xp', models.IntegerField(default=0, help_text='Tổng XP từ quiz')),
+                ('unique_sites', models.IntegerField(default=0, help_text='Số địa điểm đã làm quiz')),
+                ('fast_correct', models.IntegerField(default=0, help_text='Số câu đúng trong <= 5 giây')),
+                ('early_attempts', models.IntegerField(default=0, help_text='Số câu làm trước 8 giờ sáng')),
+                ('battles_played', models.IntegerField(default=0, help_text='Số battle đã kết thúc')),
+                ('battle_wins', models.IntegerField(default=0)),
+                ('perfect_battles', models.IntegerField(default=0, help_text='Số battle đúng >= 5 câu')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_user_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:08
+
+from django.db import migrations, models
+
+RULE_KEYS = {'stat', 'site_stat', 'all', 'any'}
+
+
+def legacy_rule(achievement_type, requirement):
+    """Điều kiện cũ (diễn giải theo achievement_type) sang cú pháp mới; None nếu không chuyển được"""
+    if achievement_type == 'first_quiz':
+        return {'stat': 'total_quizzes', 'gte': requirement.get('total_quizzes', 1)}
+    if achievement_type == 'quiz_master':
+        if 'total_quizzes' in requirement:
+            return {'stat': 'total_quizzes', 'gte': requirement['total_quizzes']}
+        if 'level' in requirement:
+            return {'stat': 'level', 'gte': requirement['level']}
+        return None
+    return {
+        'speed_demon': {'stat': 'fast_correct', 'gte': 1},
+        'perfect_score': {'stat': 'perfect_battles', 'gte': 1},
+        'battle_winner': {'stat': 'battle_wins', 'gte': requirement.get('battle_wins', 1)},
+        'explorer': {'stat': 'unique_sites', 'gte': requirement.get('unique_sites', 5)},
+        'early_bird': {'stat': 'early_attempts', 'gte': 1},
+    }.get(achievement_type)
+
+
+def convert_requirements(apps, schema_editor):
+    Achievement = apps.get_model('heritage', 'Achievement')
+    for achievement in Achievement.objects.all():
+        requirement = achievement.requirement if isinstance(achievement.requirement, dict) else {}
+        if RULE_KEYS & set(requirement):
+            continue
+        rule = legacy_rule(achievement.achievement_type, requirement)
+        if rule is not None:
+            achievement.requirement = rule
+            achievement.save(update_fields=['requirement'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0011_user_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='achievement',
+            name='requirement',
+            field=models.JSONField(help_text='Điều kiện đạt được (JSON, cú pháp trong heritage/achievement_rules.py)'),
+        ),
+        migrations.RunPython(convert_requirements, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:09
+
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+from zoneinfo import ZoneInfo
+
+from django.db import migrations, models
+from django.utils import timezone
+
+STREAK_TIMEZONE = ZoneInfo('Asia/Ho_Chi_Minh')
+
+
+def build_streaks(apps, schema_editor):
+    """Tính chuỗi ngày / chuỗi câu đúng từ QuizAttempt sẵn có"""
+    QuizAttempt = apps.get_model('heritage', 'QuizAttempt')
+    UserStats = apps.get_model('heritage', 'UserStats')
+
+    attempts = QuizAttempt.objects.exclude(user_name='').order_by('user_name', 'created', 'id').values_list(
+        'user_name', 'created', 'is_correct'
+    ).iterator(chunk_size=5000)
+    changed = []
+    stats_by_user = UserStats.objects.in_bulk(field_name='user_name')
+    for user_name, rows in groupby(attempts, key=itemgetter(0)):
+        stats = stats_by_user.get(user_name)
+        if stats is None:
+            continue
+        for _, created, is_correct in rows:
+            day = timezone.localtime(created, STREAK_TIMEZONE).date()
+            last = stats.last_active_date
+            if last is None or day > last:
+                stats.current_streak = stats.current_streak + 1 if last == day - timedelta(days=1) else 1
+                stats.last_active_date = day
+            stats.correct_run = stats.correct_run + 1 if is_correct else 0
+            stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+            stats.longest_correct_run = max(stats.longest_correct_run, stats.correct_run)
+        changed.append(stats)
+    UserStats.objects.bulk_update(
+        changed,
+        ['current_streak', 'longest_streak', 'last_active_date', 'correct_run', 'longest_correct_run'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0012_achievement_rule_requirements'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='correct_run',
+            field=models.IntegerField(default=0, help_text='Số câu đúng liên tiếp hiện tại'),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='current_streak',
+            field=models.IntegerField(default=0, help_text='Số ngày liên tiếp tính đến last_active_date'),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='last_active_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='longest_correct_run',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='longest_streak',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(build_streaks, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,9 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .levels import get_level_curve
 
 
 class UserRole(models.Model):
@@ -53,12 +57,24 @@ class Site(models.Model):
     )
     
     created = models.DateTimeField(auto_now_add=True)
-    updated = models.DateTimeField(auto_now=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
 
+class SiteTombstone(models.Model):
+    """Dấu vết địa điểm đã bị xóa, dùng cho đồng bộ tăng dần (sites/changes)"""
+    site_id = models.CharField(max_length=100, db_index=True)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        ordering = ['deleted_at']
+    
+    def __str__(self):
+        return f"{self.site_id} (deleted {self.deleted_at})"
+
+
 class Feedback(models.Model):
     site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name='feedbacks')
     name = models.CharField(max_length=200, blank=True)
@@ -107,6 +123,39 @@ class QuizAttempt(models.Model):
         return f"{self.user_name or 'Anonymous'} - {self.quiz.question[:30]} - {'Correct' if self.is_correct else 'Wrong'}"
 
 
+class Tournament(models.Model):
+    """Giải đấu nhiều vòng gồm các QuizBattle; vòng sau được tạo khi mọi battle của vòng trước kết thúc"""
+    FORMAT_CHOICES = [
+        ('elimination', 'Loại trực tiếp'),
+        ('swiss', 'Hệ Thụy Sĩ'),
+    ]
+    STATUS_CHOICES = [
+        ('in_progress', 'Đang diễn ra'),
+        ('completed', 'Đã kết thúc'),
+        ('cancelled', 'Đã hủy'),
+    ]
+    
+    name = models.CharField(max_length=200)
+    format = models.CharField(max_length=20, choices=FORMAT_CHOICES, default='elimination')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    group_size = models.IntegerField(default=4, help_text="Số người mỗi battle (2-8)")
+    advance_count = models.IntegerField(default=1, help_text="Số người mỗi battle được đi tiếp (loại trực tiếp)")
+    total_rounds = models.IntegerField(null=True, blank=True, help_text="Số vòng (Swiss); loại trực tiếp đấu tới khi còn một battle")
+    current_round = models.IntegerField(default=1)
+    question_count = models.IntegerField(default=6)
+    duration_minutes = models.IntegerField(default=10, help_text="Thời gian làm bài mỗi vòng (phút)")
+    round_gap_minutes = models.IntegerField(default=5, help_text="Thời gian nghỉ trước vòng kế tiếp (phút)")
+    winner = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.name} - vòng {self.current_round}"
+
+
 class QuizBattle(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Chờ bắt đầu'),
@@ -121,9 +170,15 @@ class QuizBattle(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     questions = models.JSONField(help_text="List of quiz IDs [quiz_id1, quiz_id2, ...]")
     participants = models.JSONField(help_text="List of usernames [username1, username2, ...]")
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, null=True, blank=True, related_name='battles')
+    tournament_round = models.IntegerField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # "Vòng hiện tại của giải đã xong chưa"
+            models.Index(fields=['tournament', 'tournament_round', 'status']),
+        ]
     
     def __str__(self):
         return f"Battle {self.id} - {self.scheduled_start_time.strftime('%Y-%m-%d %H:%M')}"
@@ -136,7 +191,6 @@ class QuizBattleParticipant(models.Model):
     correct_answers = models.IntegerField(default=0, help_text="Số câu đúng")
     total_answered = models.IntegerField(default=0, help_text="Tổng số câu đã trả lời")
     time_completed = models.IntegerField(null=True, blank=True, help_text="Tổng thời gian (giây)")
-    answers = models.JSONField(default=dict, help_text="Quiz ID -> {answer, is_correct, time_taken}")
     rank = models.IntegerField(null=True, blank=True, help_text="Hạng (1-4)")
     joined_at = models.DateTimeField(auto_now_add=True)
     finished_at = models.DateTimeField(null=True, blank=True)
@@ -145,14 +199,108 @@ class QuizBattleParticipant(models.Model):
         unique_together = ('battle', 'user_name')
         ordering = ['-total_answered', '-correct_answers', 'time_completed']
     
-    def save(self, *args, **kwargs):
-        self.total_answered = len(self.answers) if self.answers else 0
-        super().save(*args, **kwargs)
+    def answers_dict(self):
+        """Câu trả lời dạng Quiz ID -> {answer, is_correct, time_taken} (định dạng API cũ)"""
+        return {
+            str(a.quiz_id): {'answer': a.answer, 'is_correct': a.is_correct, 'time_taken': a.time_taken}
+            for a in self.battle_answers.all()
+        }
     
     def __str__(self):
         return f"{self.user_name} - Battle {self.battle.id} (Rank {self.rank})"
 
 
+class BattleAnswer(models.Model):
+    """Một câu trả lời của participant trong battle"""
+    battle = models.ForeignKey(QuizBattle, on_delete=models.CASCADE, related_name='battle_answers')
+    participant = models.ForeignKey(QuizBattleParticipant, on_delete=models.CASCADE, related_name='battle_answers')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='battle_answers')
+    answer = models.CharField(max_length=1, choices=[('A', 'A'), ('B', 'B'), ('C', 'C'), ('D', 'D')])
+    is_correct = models.BooleanField(default=False)
+    time_taken = models.IntegerField(default=0, help_text="Thời gian trả lời (giây)")
+    answered_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['answered_at', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['participant', 'quiz'], name='unique_battle_answer'),
+        ]
+        indexes = [
+            # "Ai giải câu X đầu tiên": battle + quiz + is_correct, sắp theo thời gian
+            models.Index(fields=['battle', 'quiz', 'is_correct', 'answered_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.participant.user_name} - Quiz {self.quiz_id} ({self.answer})"
+
+
+class BattleEvent(models.Model):
+    """Sự kiện realtime của battle, đẩy tới client qua Server-Sent Events"""
+    EVENT_TYPES = [
+        ('question-solved', 'Câu hỏi đã có người trả lời đúng'),
+        ('answer-submitted', 'Có người nộp câu trả lời'),
+        ('rank-changed', 'Bảng xếp hạng thay đổi'),
+        ('status-changed', 'Trạng thái battle thay đổi'),
+    ]
+    
+    battle = models.ForeignKey(QuizBattle, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=30, choices=EVENT_TYPES)
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['battle', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"Battle {self.battle_id} - {self.event_type} #{self.id}"
+
+
+class BattleSolveState(models.Model):
+    """
+    Trạng thái giải câu hỏi của battle, cập nhật trong submit_answer.
+    current_question_status chỉ cần đọc một dòng này.
+    """
+    battle = models.OneToOneField(QuizBattle, on_delete=models.CASCADE, primary_key=True, related_name='solve_state')
+    current_question_index = models.IntegerField(default=0)
+    solved_by = models.CharField(max_length=200, null=True, blank=True, help_text="Người trả lời đúng câu hiện tại đầu tiên")
+    correct_answer = models.CharField(max_length=1, null=True, blank=True, help_text="Đáp án câu hiện tại (khi đã có người giải)")
+    first_solvers = models.JSONField(default=dict, help_text="Quiz ID -> user_name trả lời đúng đầu tiên")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def record_solve(self, questions, quiz_id, user_name, correct_answer):
+        """Ghi nhận một câu trả lời đúng. Trả về True nếu là người giải đầu tiên của câu đó"""
+        if str(quiz_id) in self.first_solvers:
+            return False
+        self.first_solvers[str(quiz_id)] = user_name
+        if quiz_id in questions and questions.index(quiz_id) == self.current_question_index:
+            self.solved_by = user_name
+            self.correct_answer = correct_answer
+        return True
+
+    def __str__(self):
+        return f"Battle {self.battle_id} - câu {self.current_question_index + 1}"
+
+
+class TournamentEntry(models.Model):
+    """Người chơi trong giải: điểm tích lũy (Swiss) và vòng bị loại (loại trực tiếp)"""
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='entries')
+    user_name = models.CharField(max_length=200)
+    seed = models.IntegerField(help_text="Hạt giống (1 = mạnh nhất theo XP)")
+    points = models.IntegerField(default=0, help_text="Điểm Swiss: số người xếp sau trong mỗi battle")
+    total_score = models.IntegerField(default=0, help_text="Tổng điểm battle qua các vòng")
+    eliminated_round = models.IntegerField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = [['tournament', 'user_name']]
+        ordering = ['-points', '-total_score', 'seed']
+    
+    def __str__(self):
+        return f"{self.tournament.name} - {self.user_name}"
+
+
 class UserProfile(models.Model):
     user_name = models.CharField(max_length=200, unique=True, help_text="Tên người dùng")
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, help_text="Ảnh đại diện")
@@ -172,17 +320,18 @@ class UserProfile(models.Model):
     @staticmethod
     def xp_required_for_level(level):
         """Tính tổng XP cần thiết để đạt level này"""
-        # Level 1: 0 XP, Level 2: 100 XP, Level 3: 300 XP (100+200), ...
-        # Công thức: sum(i * 100 for i in range(1, level))
-        total = 0
-        for i in range(1, level):
-            total += i * 100
-        return total
+        # Level 1: 0 XP, Level 2: 100 XP, Level 3: 300 XP (100+200), ... (heritage/levels.py)
+        return get_level_curve().xp_for_level(level)
+    
+    @staticmethod
+    def level_for_xp(total_xp):
+        """Level tương ứng với tổng XP"""
+        return get_level_curve().level_for_xp(total_xp)
     
     @property
     def xp_for_next_level(self):
         """XP cần thiết cho level tiếp theo"""
-        return self.level * 100  # Level hiện tại * 100
+        return get_level_curve().xp_to_next_level(self.level)
     
     @property
     def xp_for_current_level(self):
@@ -201,15 +350,23 @@ class UserProfile(models.Model):
             return 100
         return min(100, (self.current_level_xp / self.xp_for_next_level) * 100)
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Nhớ total_xp đã lưu để save() biết khi nào cần báo bảng xếp hạng
+        instance._saved_total_xp = instance.__dict__.get('total_xp')
+        return instance
+    
     def save(self, *args, **kwargs):
         """Override save to auto-calculate level based on total_xp"""
         # Tính level mới dựa trên total_xp
-        new_level = 1
-        while self.total_xp >= UserProfile.xp_required_for_level(new_level + 1):
-            new_level += 1
-        
-        self.level = new_level
+        self.level = UserProfile.level_for_xp(self.total_xp)
         super().save(*args, **kwargs)
+        
+        if self.total_xp != getattr(self, '_saved_total_xp', None):
+            from .leaderboard import record_change
+            record_change('xp', self.user_name, {'total_xp': self.total_xp})
+            self._saved_total_xp = self.total_xp
     
     def add_xp(self, xp_amount):
         """Thêm XP và tự động cập nhật level"""
@@ -217,6 +374,82 @@ class UserProfile(models.Model):
         self.save()  # This will trigger level calculation in save()
 
 
+class UserSiteStats(models.Model):
+    """Tổng kết quả quiz của một người tại một địa điểm, cập nhật mỗi lần nộp bài (bảng xếp hạng theo phạm vi)"""
+    user_name = models.CharField(max_length=200)
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name='user_stats')
+    total_questions = models.IntegerField(default=0)
+    correct_answers = models.IntegerField(default=0)
+    total_time = models.IntegerField(default=0, help_text="Tổng thời gian (giây)")
+    total_xp = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = [['user_name', 'site']]
+        indexes = [
+            # Thứ tự bảng xếp hạng của một địa điểm
+            models.Index(fields=['site', '-total_questions', '-correct_answers', 'total_time'], name='user_site_stats_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_name} - {self.site_id}"
+
+
+class UserStats(models.Model):
+    """
+    Tổng hợp theo người chơi, cập nhật trong cùng transaction mỗi khi thêm / xóa
+    QuizAttempt và khi battle kết thúc (heritage.user_stats). Thành tựu, hồ sơ và
+    bảng xếp hạng đọc từ đây thay vì tổng hợp lại QuizAttempt / QuizBattleParticipant.
+    """
+    user_name = models.CharField(max_length=200, unique=True)
+    total_quizzes = models.IntegerField(default=0, help_text="Số câu đã làm")
+    correct_answers = models.IntegerField(default=0)
+    total_time = models.IntegerField(default=0, help_text="Tổng thời gian (giây)")
+    total_xp = models.IntegerField(default=0, help_text="Tổng XP từ quiz")
+    unique_sites = models.IntegerField(default=0, help_text="Số địa điểm đã làm quiz")
+    fast_correct = models.IntegerField(default=0, help_text="Số câu đúng trong <= 5 giây")
+    early_attempts = models.IntegerField(default=0, help_text="Số câu làm trước 8 giờ sáng")
+    battles_played = models.IntegerField(default=0, help_text="Số battle đã kết thúc")
+    battle_wins = models.IntegerField(default=0)
+    perfect_battles = models.IntegerField(default=0, help_text="Số battle đúng >= 5 câu")
+    # Chuỗi ngày liên tiếp có làm bài (ngày theo giờ Asia/Ho_Chi_Minh) và chuỗi câu đúng liên tiếp
+    current_streak = models.IntegerField(default=0, help_text="Số ngày liên tiếp tính đến last_active_date")
+    longest_streak = models.IntegerField(default=0)
+    last_active_date = models.DateField(null=True, blank=True)
+    correct_run = models.IntegerField(default=0, help_text="Số câu đúng liên tiếp hiện tại")
+    longest_correct_run = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_name} - {self.total_quizzes} câu"
+
+
+class LeaderboardChange(models.Model):
+    """
+    Điểm mới của một người trên bảng xếp hạng (giá trị tuyệt đối nên áp dụng
+    lại nhiều lần vẫn đúng). Các process đọc change log theo id để cập nhật
+    bảng xếp hạng trong bộ nhớ thay vì tổng hợp lại toàn bộ bảng.
+    """
+    BOARD_CHOICES = [
+        ('xp', 'Tổng XP (UserProfile)'),
+        ('quiz', 'Số câu đã làm (QuizAttempt)'),
+    ]
+    
+    board = models.CharField(max_length=20, choices=BOARD_CHOICES)
+    user_name = models.CharField(max_length=200)
+    values = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['board', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.board} - {self.user_name} #{self.id}"
+
+
 class Achievement(models.Model):
     ACHIEVEMENT_TYPES = [
         ('quiz_master', 'Quiz Master'),
@@ -234,7 +467,7 @@ class Achievement(models.Model):
     icon = models.CharField(max_length=50, help_text="Icon name (lucide-react)")
     achievement_type = models.CharField(max_length=20, choices=ACHIEVEMENT_TYPES)
     xp_reward = models.IntegerField(default=50, help_text="XP thưởng khi đạt được")
-    requirement = models.JSONField(help_text="Điều kiện đạt được (JSON)")
+    requirement = models.JSONField(help_text="Điều kiện đạt được (JSON, cú pháp trong heritage/achievement_rules.py)")
     rarity = models.CharField(max_length=20, choices=[
         ('common', 'Common'),
         ('rare', 'Rare'),
@@ -244,6 +477,14 @@ class Achievement(models.Model):
     
     def __str__(self):
         return self.name
+    
+    def clean(self):
+        from .achievement_rules import RuleError, compile_rule
+        from .achievements import STAT_NAMES
+        try:
+            compile_rule(self.requirement, STAT_NAMES)
+        except RuleError as e:
+            raise ValidationError({'requirement': str(e)})
 
 
 class UserAchievement(models.Model):
@@ -284,6 +525,34 @@ class Comment(models.Model):
         return f"{self.user_name} - {self.site.name} ({self.created_at.strftime('%Y-%m-%d')})"
 
 
+class SearchDocument(models.Model):
+    """
+    Chỉ mục tìm kiếm toàn văn cho Site / Quiz / Comment.
+    search_title / search_content đã bỏ dấu tiếng Việt; chỉ mục thật sự là
+    cột tsvector + GIN (PostgreSQL) hoặc bảng ảo FTS5 (SQLite), tạo trong migration.
+    """
+    KIND_CHOICES = [
+        ('site', 'Địa điểm'),
+        ('quiz', 'Câu hỏi'),
+        ('comment', 'Bình luận'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    site_id = models.CharField(max_length=100, blank=True, help_text="site_id liên quan")
+    title = models.CharField(max_length=255, blank=True, help_text="Tiêu đề hiển thị")
+    content = models.TextField(blank=True, help_text="Nội dung gốc (để trích đoạn)")
+    search_title = models.TextField(blank=True)
+    search_content = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('kind', 'object_id')
+    
+    def __str__(self):
+        return f"{self.kind}:{self.object_id} - {self.title[:50]}"
+
+
 class SystemSettings(models.Model):
     """Cấu hình hệ thống - chỉ có 1 record duy nhất"""
     feedback_email = models.EmailField(
@@ -0,0 +1,201 @@
+"""
+Encoder Mapbox Vector Tile (MVT v2) viết bằng Python thuần cho các điểm di tích.
+
+Chỉ hỗ trợ những gì bản đồ cần: một layer, geometry Point và thuộc tính
+kiểu chuỗi / số. Đặc tả: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+import os
+import shutil
+import struct
+
+from django.conf import settings
+
+from .site_cache import get_sites_version
+from .spatial import get_site_index, lng_to_x, lat_to_y, x_to_lng, y_to_lat
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64          # Lấy thêm điểm sát mép tile để icon không bị cắt
+TILE_MAX_ZOOM = 22
+# Chỉ lưu tile xuống đĩa tới zoom này: số tile có điểm bị chặn theo số di tích.
+# Zoom sâu hơn encode lại mỗi lần (truy vấn chỉ mục trong bộ nhớ), nginx proxy_cache giữ bản sao
+TILE_CACHE_MAX_ZOOM = 14
+TILE_LAYER_NAME = 'sites'
+TILE_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+# Wire type của protobuf
+_VARINT = 0
+_LENGTH_DELIMITED = 2
+
+# Lệnh geometry
+_MOVE_TO = 1
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def _zigzag64(value):
+    return ((value << 1) ^ (value >> 63)) & 0xFFFFFFFFFFFFFFFF
+
+
+def _key(field_number, wire_type):
+    return _varint((field_number << 3) | wire_type)
+
+
+def _bytes_field(field_number, data):
+    return _key(field_number, _LENGTH_DELIMITED) + _varint(len(data)) + data
+
+
+def _varint_field(field_number, value):
+    return _key(field_number, _VARINT) + _varint(value)
+
+
+def _packed_field(field_number, values):
+    return _bytes_field(field_number, b''.join(_varint(v) for v in values))
+
+
+def _encode_value(value):
+    """Message Value: string (1), double (3), sint (6), bool (7)"""
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        return _varint_field(6, _zigzag64(value))
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack('<d', value)
+    return _bytes_field(1, str(value).encode('utf-8'))
+
+
+class LayerBuilder:
+    """Gom feature của một layer, tự quản lý bảng keys / values dùng chung"""
+
+    def __init__(self, name, extent=TILE_EXTENT):
+        self.name = name
+        self.extent = extent
+        self.keys = []
+        self.values = []
+        self._key_index = {}
+        self._value_index = {}
+        self.features = []
+
+    def _tag(self, key, value):
+        if key not in self._key_index:
+            self._key_index[key] = len(self.keys)
+            self.keys.append(key)
+        value_id = (type(value).__name__, value)
+        if value_id not in self._value_index:
+            self._value_index[value_id] = len(self.values)
+            self.values.append(value)
+        return self._key_index[key], self._value_index[value_id]
+
+    def add_point(self, x, y, properties):
+        """Thêm một điểm với toạ độ tile (0..extent)"""
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.extend(self._tag(key, value))
+        geometry = [(_MOVE_TO & 0x7) | (1 << 3), _zigzag(x), _zigzag(y)]
+
+        feature = _packed_field(2, tags) + _varint_field(3, 1) + _packed_field(4, geometry)
+        self.features.append(feature)
+
+    def encode(self):
+        data = _varint_field(15, 2) + _bytes_field(1, self.name.encode('utf-8'))
+        for feature in self.features:
+            data += _bytes_field(2, feature)
+        for key in self.keys:
+            data += _bytes_field(3, key.encode('utf-8'))
+        for value in self.values:
+            data += _bytes_field(4, _encode_value(value))
+        data += _varint_field(5, self.extent)
+        return data
+
+
+def tile_bounds(z, x, y, buffer=0):
+    """bbox (minLng, minLat, maxLng, maxLat) của tile, có thể nới thêm buffer (đơn vị extent)"""
+    n = 2 ** z
+    pad = buffer / TILE_EXTENT
+    min_lng = x_to_lng(max((x - pad) / n, 0))
+    max_lng = x_to_lng(min((x + 1 + pad) / n, 1))
+    max_lat = y_to_lat(max((y - pad) / n, 0))
+    min_lat = y_to_lat(min((y + 1 + pad) / n, 1))
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def encode_site_tile(z, x, y):
+    """Encode tile z/x/y chứa các di tích (bytes rỗng nếu tile không có điểm nào)"""
+    entries = get_site_index().query(tile_bounds(z, x, y, TILE_BUFFER))
+    if not entries:
+        return b''
+
+    n = 2 ** z
+    layer = LayerBuilder(TILE_LAYER_NAME)
+    for entry in entries:
+        lng, lat = entry.point
+        px = round((lng_to_x(lng) * n - x) * TILE_EXTENT)
+        py = round((lat_to_y(lat) * n - y) * TILE_EXTENT)
+        layer.add_point(px, py, {
+            'id': entry.site_id,
+            'name': entry.name,
+            'conservation_status': entry.conservation_status,
+        })
+    return _bytes_field(3, layer.encode())
+
+
+def _tile_cache_dir():
+    return getattr(settings, 'TILE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'db', 'tiles'))
+
+
+def _prune_old_versions(root, version):
+    """Dọn tile của các version cũ (gọi khi version hiện tại chưa có thư mục)"""
+    if os.path.isdir(root):
+        for name in os.listdir(root):
+            if name != str(version):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def get_site_tile(z, x, y):
+    """
+    Trả về (version, bytes) của tile, đọc từ cache trên đĩa nếu có.
+    Cache nằm trong thư mục theo version nên tự vô hiệu khi Site thay đổi; chỉ lưu
+    tile có điểm và zoom <= TILE_CACHE_MAX_ZOOM nên dung lượng bị chặn theo số di tích.
+    """
+    version = get_sites_version()
+    if z > TILE_CACHE_MAX_ZOOM:
+        return version, encode_site_tile(z, x, y)
+
+    root = _tile_cache_dir()
+    version_dir = os.path.join(root, str(version))
+    path = os.path.join(version_dir, str(z), str(x), f'{y}.mvt')
+
+    try:
+        with open(path, 'rb') as f:
+            return version, f.read()
+    except FileNotFoundError:
+        pass
+
+    data = encode_site_tile(z, x, y)
+    if not data:
+        # Tile rỗng: không lưu, nếu không ai cũng có thể lấp đầy đĩa bằng cách duyệt toạ độ
+        return version, data
+
+    if not os.path.isdir(version_dir):
+        _prune_old_versions(root, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return version, data
@@ -0,0 +1,210 @@
+"""
+Tìm kiếm toàn văn trên địa điểm, câu hỏi quiz và bình luận.
+
+Mỗi đối tượng có một dòng SearchDocument với văn bản đã bỏ dấu tiếng Việt
+("Thành cổ" -> "thanh co"), được cập nhật qua signal khi lưu / xóa.
+- PostgreSQL: cột tsvector sinh tự động + GIN index, xếp hạng bằng ts_rank
+- SQLite: bảng ảo FTS5 đồng bộ bằng trigger, xếp hạng bằng bm25
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Site, Quiz, Comment, SearchDocument
+
+FTS_TABLE = 'heritage_searchdocument_fts'
+SNIPPET_LENGTH = 200
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    """Bỏ dấu tiếng Việt, chữ thường: 'Thành cổ Đông Hà' -> 'thanh co dong ha'"""
+    if not text:
+        return ''
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+def query_tokens(query):
+    """Tách từ khoá tìm kiếm thành các token đã bỏ dấu"""
+    return _TOKEN_RE.findall(normalize_text(query))
+
+
+# --- Dựng document cho từng loại đối tượng ---
+
+def site_document_fields(name, geojson):
+    properties = (geojson.get('properties') if isinstance(geojson, dict) else None) or {}
+    content = '\n'.join(filter(None, [properties.get('summary'), properties.get('history')]))
+    return {
+        'title': name,
+        'content': content,
+        'search_title': normalize_text(name),
+        'search_content': normalize_text(content),
+    }
+
+
+def quiz_document_fields(question, options):
+    content = '\n'.join(filter(None, options))
+    return {
+        'title': question[:255],
+        'content': content,
+        'search_title': normalize_text(question),
+        'search_content': normalize_text(content),
+    }
+
+
+def comment_document_fields(user_name, content):
+    return {
+        'title': user_name[:255],
+        'content': content,
+        'search_title': '',
+        'search_content': normalize_text(content),
+    }
+
+
+def index_site(site):
+    SearchDocument.objects.update_or_create(
+        kind='site', object_id=site.pk,
+        defaults={'site_id': site.site_id, **site_document_fields(site.name, site.geojson)},
+    )
+
+
+def index_quiz(quiz):
+    options = [quiz.option_a, quiz.option_b, quiz.option_c, quiz.option_d]
+    SearchDocument.objects.update_or_create(
+        kind='quiz', object_id=quiz.pk,
+        defaults={'site_id': quiz.site.site_id, **quiz_document_fields(quiz.question, options)},
+    )
+
+
+def index_comment(comment):
+    SearchDocument.objects.update_or_create(
+        kind='comment', object_id=comment.pk,
+        defaults={'site_id': comment.site.site_id, **comment_document_fields(comment.user_name, comment.content)},
+    )
+
+
+def rebuild_search_index():
+    """Dựng lại toàn bộ chỉ mục (dùng sau import dữ liệu hàng loạt)"""
+    documents = []
+    for site in Site.objects.all():
+        documents.append(SearchDocument(
+            kind='site', object_id=site.pk, site_id=site.site_id,
+            **site_document_fields(site.name, site.geojson)
+        ))
+    for quiz in Quiz.objects.select_related('site'):
+        options = [quiz.option_a, quiz.option_b, quiz.option_c, quiz.option_d]
+        documents.append(SearchDocument(
+            kind='quiz', object_id=quiz.pk, site_id=quiz.site.site_id,
+            **quiz_document_fields(quiz.question, options)
+        ))
+    for comment in Comment.objects.select_related('site'):
+        documents.append(SearchDocument(
+            kind='comment', object_id=comment.pk, site_id=comment.site.site_id,
+            **comment_document_fields(comment.user_name, comment.content)
+        ))
+
+    SearchDocument.objects.all().delete()
+    SearchDocument.objects.bulk_create(documents, batch_size=500)
+    return len(documents)
+
+
+@receiver(post_save, sender=Site)
+def _site_saved(sender, instance, **kwargs):
+    index_site(instance)
+
+
+@receiver(post_save, sender=Quiz)
+def _quiz_saved(sender, instance, **kwargs):
+    index_quiz(instance)
+
+
+@receiver(post_save, sender=Comment)
+def _comment_saved(sender, instance, **kwargs):
+    index_comment(instance)
+
+
+@receiver(post_delete, sender=Site)
+@receiver(post_delete, sender=Quiz)
+@receiver(post_delete, sender=Comment)
+def _object_deleted(sender, instance, **kwargs):
+    kind = {Site: 'site', Quiz: 'quiz', Comment: 'comment'}[sender]
+    SearchDocument.objects.filter(kind=kind, object_id=instance.pk).delete()
+
+
+# --- Truy vấn ---
+
+def _search_postgres(tokens, kinds, limit, offset):
+    ts_query = ' & '.join(f'{token}:*' for token in tokens)
+    kind_filter = 'AND kind = ANY(%s)' if kinds else ''
+    where_params = [ts_query] + ([list(kinds)] if kinds else [])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM heritage_searchdocument "
+            f"WHERE search_vector @@ to_tsquery('simple', %s) {kind_filter}",
+            where_params,
+        )
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT id, ts_rank(search_vector, to_tsquery('simple', %s)) AS rank "
+            f"FROM heritage_searchdocument "
+            f"WHERE search_vector @@ to_tsquery('simple', %s) {kind_filter} "
+            f"ORDER BY rank DESC, id LIMIT %s OFFSET %s",
+            [ts_query] + where_params + [limit, offset],
+        )
+        rows = cursor.fetchall()
+    return total, rows
+
+
+def _search_sqlite(tokens, kinds, limit, offset):
+    match = ' '.join(f'"{token}"*' for token in tokens)
+    kind_filter = f"AND d.kind IN ({', '.join(['%s'] * len(kinds))})" if kinds else ''
+    where_params = [match] + list(kinds)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {FTS_TABLE} f JOIN heritage_searchdocument d ON d.id = f.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s {kind_filter}",
+            where_params,
+        )
+        total = cursor.fetchone()[0]
+        # bm25: điểm càng nhỏ càng liên quan; tiêu đề nặng gấp 5 lần nội dung
+        cursor.execute(
+            f"SELECT d.id, -bm25({FTS_TABLE}, 5.0, 1.0) AS rank "
+            f"FROM {FTS_TABLE} f JOIN heritage_searchdocument d ON d.id = f.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s {kind_filter} "
+            f"ORDER BY rank DESC, d.id LIMIT %s OFFSET %s",
+            where_params + [limit, offset],
+        )
+        rows = cursor.fetchall()
+    return total, rows
+
+
+def search(query, kinds=None, limit=20, offset=0):
+    """
+    Tìm kiếm, trả về (tổng số kết quả, [(SearchDocument, rank), ...]) đã xếp hạng.
+    kinds: lọc theo loại ('site', 'quiz', 'comment')
+    """
+    tokens = query_tokens(query)
+    if not tokens:
+        return 0, []
+
+    if connection.vendor == 'postgresql':
+        total, rows = _search_postgres(tokens, kinds, limit, offset)
+    else:
+        total, rows = _search_sqlite(tokens, kinds, limit, offset)
+
+    documents = SearchDocument.objects.in_bulk([row[0] for row in rows])
+    return total, [(documents[doc_id], rank) for doc_id, rank in rows if doc_id in documents]
+
+
+def snippet(document):
+    content = ' '.join(document.content.split())
+    if len(content) <= SNIPPET_LENGTH:
+        return content
+    return content[:SNIPPET_LENGTH].rsplit(' ', 1)[0] + '…'
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Site, Feedback, Quiz, QuizAttempt, QuizBattle, QuizBattleParticipant, UserProfile, Achievement, UserAchievement
+from .models import Site, Feedback, Quiz, QuizAttempt, QuizBattle, QuizBattleParticipant, Tournament, UserProfile, Achievement, UserAchievement
 
 
 class SiteSerializer(serializers.ModelSerializer):
@@ -78,23 +78,44 @@ class QuizAttemptSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'is_correct', 'xp_earned', 'completed_at', 'created')
 
 
+def build_quiz_lookup(battles):
+    """Lấy toàn bộ quiz (kèm site) của các battle bằng một query: quiz_id -> Quiz"""
+    quiz_ids = {quiz_id for battle in battles for quiz_id in (battle.questions or [])}
+    if not quiz_ids:
+        return {}
+    return Quiz.objects.select_related('site').in_bulk(quiz_ids)
+
+
+class QuizBattleListSerializer(serializers.ListSerializer):
+    """Serialize nhiều battle: nạp trước quiz của tất cả battle vào context"""
+    
+    def to_representation(self, data):
+        battles = list(data.all() if hasattr(data, 'all') else data)
+        self.context['quiz_lookup'] = build_quiz_lookup(battles)
+        return super().to_representation(battles)
+
+
 class QuizBattleSerializer(serializers.ModelSerializer):
     participant_count = serializers.SerializerMethodField()
     question_details = serializers.SerializerMethodField()
     
     class Meta:
         model = QuizBattle
-        fields = ('id', 'created_at', 'scheduled_start_time', 'duration_minutes', 'status', 'questions', 'participants', 'participant_count', 'question_details')
-        read_only_fields = ('id', 'created_at')
+        fields = ('id', 'created_at', 'scheduled_start_time', 'duration_minutes', 'status', 'questions', 'participants', 'participant_count', 'question_details', 'tournament', 'tournament_round')
+        read_only_fields = ('id', 'created_at', 'tournament', 'tournament_round')
+        list_serializer_class = QuizBattleListSerializer
     
     def get_participant_count(self, obj):
         return len(obj.participants) if obj.participants else 0
     
     def get_question_details(self, obj):
-        """Return question details without correct_answer"""
+        """Return question details without correct_answer, theo thứ tự battle.questions"""
         if not obj.questions:
             return []
-        quizzes = Quiz.objects.filter(id__in=obj.questions)
+        quiz_lookup = self.context.get('quiz_lookup')
+        if quiz_lookup is None:
+            quiz_lookup = build_quiz_lookup([obj])
+        quizzes = [quiz_lookup[quiz_id] for quiz_id in obj.questions if quiz_id in quiz_lookup]
         return [
             {
                 'id': q.id,
@@ -113,11 +134,22 @@ class QuizBattleSerializer(serializers.ModelSerializer):
 class QuizBattleParticipantSerializer(serializers.ModelSerializer):
     battle_id = serializers.IntegerField(source='battle.id', read_only=True)
     battle_status = serializers.CharField(source='battle.status', read_only=True)
+    answers = serializers.SerializerMethodField()
     
     class Meta:
         model = QuizBattleParticipant
         fields = ('id', 'battle', 'battle_id', 'battle_status', 'user_name', 'score', 'correct_answers', 'time_completed', 'answers', 'rank', 'joined_at', 'finished_at')
         read_only_fields = ('id', 'joined_at', 'rank')
+    
+    def get_answers(self, obj):
+        return obj.answers_dict()
+
+
+class TournamentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tournament
+        fields = ('id', 'name', 'format', 'status', 'group_size', 'advance_count', 'total_rounds', 'current_round', 'question_count', 'duration_minutes', 'round_gap_minutes', 'winner', 'created_at', 'completed_at')
+        read_only_fields = fields
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -0,0 +1,160 @@
+"""
+Cache dữ liệu bản đồ di tích theo phiên bản (version) của bảng Site.
+
+Mỗi lần thêm / sửa / xóa Site, signal (post_save / post_delete) tăng version
+sau khi transaction commit; xóa Site còn ghi SiteTombstone cho sites/changes.
+Mọi snapshot (FeatureCollection đã serialize, chỉ mục không gian, ...) đều gắn
+với version nên tự động hết hạn mà không cần xóa từng key.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+
+from .models import Site, SiteTombstone
+
+SITES_VERSION_KEY = 'heritage:sites:version'
+SITES_PAYLOAD_KEY = 'heritage:sites:{name}:{version}'
+SITES_PAYLOAD_TIMEOUT = 60 * 60 * 24  # 24h - snapshot cũ tự hết hạn
+
+# Snapshot trong process (chỉ mục không gian, ...): name -> (version, value)
+_snapshots = {}
+_snapshots_lock = threading.RLock()  # RLock: builder có thể dùng snapshot khác
+
+
+def get_sites_version():
+    """Version hiện tại của bảng Site (khởi tạo nếu cache trống)"""
+    version = cache.get(SITES_VERSION_KEY)
+    if version is None:
+        # Dùng timestamp làm giá trị khởi tạo để version không bao giờ bị
+        # dùng lại sau khi cache bị xóa (tránh trả snapshot cũ trong process)
+        cache.add(SITES_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(SITES_VERSION_KEY)
+    return version
+
+
+def bump_sites_version():
+    """Tăng version sau khi bảng Site thay đổi"""
+    try:
+        return cache.incr(SITES_VERSION_KEY)
+    except ValueError:
+        # Key chưa tồn tại (cache vừa bị xóa) -> khởi tạo mới
+        get_sites_version()
+        return cache.incr(SITES_VERSION_KEY)
+
+
+@receiver(post_save, sender=Site)
+def _site_saved(sender, instance, **kwargs):
+    # Tăng version sau commit: process khác không dựng snapshot mới từ dữ liệu chưa commit
+    transaction.on_commit(bump_sites_version)
+
+
+@receiver(post_delete, sender=Site)
+def _site_deleted(sender, instance, **kwargs):
+    # Tombstone cùng transaction với lệnh xóa để sites/changes không bỏ sót
+    SiteTombstone.objects.create(site_id=instance.site_id)
+    transaction.on_commit(bump_sites_version)
+
+
+def versioned_snapshot(name, builder):
+    """
+    Memoize kết quả builder() trong process theo version của bảng Site.
+    builder chỉ được gọi lại khi version thay đổi.
+    """
+    version = get_sites_version()
+    entry = _snapshots.get(name)
+    if entry is None or entry[0] != version:
+        with _snapshots_lock:
+            entry = _snapshots.get(name)
+            if entry is None or entry[0] != version:
+                entry = (version, builder())
+                _snapshots[name] = entry
+    return entry[1]
+
+
+def site_feature(site):
+    """Dựng GeoJSON Feature của một Site kèm các trường bảo tồn / quy tắc ứng xử"""
+    feature = dict(site.geojson) if isinstance(site.geojson, dict) else {}
+    properties = dict(feature.get('properties') or {})
+
+    properties['conservation_status'] = site.conservation_status
+    properties['status_description'] = site.status_description
+    properties['conduct'] = site.conduct
+
+    feature['properties'] = properties
+    return feature
+
+
+def build_feature_collection():
+    """Dựng FeatureCollection đầy đủ từ database"""
+    return {
+        'type': 'FeatureCollection',
+        'features': [site_feature(s) for s in Site.objects.all()],
+    }
+
+
+def encode_json(data):
+    """Serialize JSON giống JSONRenderer của DRF (UTF-8, không khoảng trắng)"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def make_etag(body):
+    """Strong ETag từ nội dung response"""
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def get_versioned_payload(name, builder):
+    """
+    Trả về (etag, body) của dữ liệu builder() đã serialize cho version hiện tại.
+    Snapshot nằm trong cache dùng chung; chỉ gọi builder khi cache chưa có.
+    """
+    version = get_sites_version()
+    key = SITES_PAYLOAD_KEY.format(name=name, version=version)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    body = encode_json(builder())
+    payload = (make_etag(body), body)
+    cache.set(key, payload, SITES_PAYLOAD_TIMEOUT)
+    return payload
+
+
+def get_sites_payload():
+    """(etag, body) của FeatureCollection đầy đủ"""
+    return get_versioned_payload('geojson', build_feature_collection)
+
+
+def etag_matches(request, etag):
+    """Kiểm tra header If-None-Match của request có khớp ETag không"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    # So khớp yếu theo RFC 7232 cho If-None-Match: bỏ tiền tố W/
+    return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in candidates)
+
+
+def cached_json_response(request, etag, body):
+    """
+    Trả body JSON đã serialize kèm ETag, hoặc 304 nếu client đã có bản này.
+    body có thể là bytes hoặc hàm trả về bytes (chỉ được gọi khi cần gửi body).
+    """
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        if callable(body):
+            body = body()
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    # Client luôn phải xác thực lại với server, nhưng được dùng lại bản đã tải
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,379 @@
+"""
+Chỉ mục không gian (grid index) cho các điểm di tích trong Site.geojson.
+
+Chỉ mục được dựng một lần cho mỗi version của bảng Site (xem site_cache)
+và dùng chung cho các truy vấn theo bbox / zoom của bản đồ.
+"""
+import math
+
+import numpy as np
+
+from .models import Site
+from .site_cache import site_feature, versioned_snapshot
+
+# Kích thước ô lưới (độ). Các di tích tập trung trong một tỉnh nên 0.1° (~11km) là đủ mịn
+GRID_CELL_SIZE = 0.1
+
+# Zoom nhỏ hơn ngưỡng này chỉ trả các thuộc tính tối thiểu để vẽ marker
+SLIM_ZOOM_THRESHOLD = 12
+
+
+def site_point(geojson):
+    """Lấy toạ độ (lng, lat) từ geometry Point của GeoJSON Feature, None nếu không có"""
+    if not isinstance(geojson, dict):
+        return None
+    geometry = geojson.get('geometry') or {}
+    if geometry.get('type') != 'Point':
+        return None
+    try:
+        lng, lat = geometry['coordinates'][:2]
+        return float(lng), float(lat)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_bbox(value):
+    """
+    Parse tham số bbox=minLng,minLat,maxLng,maxLat.
+    Raise ValueError nếu sai định dạng.
+    """
+    parts = [float(v) for v in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox phải có 4 giá trị')
+    if not all(math.isfinite(v) for v in parts):
+        raise ValueError('bbox chứa giá trị không hợp lệ')
+    min_lng, min_lat, max_lng, max_lat = parts
+    if min_lng > max_lng or min_lat > max_lat:
+        raise ValueError('bbox không hợp lệ (min > max)')
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def site_thumbnail(site):
+    """Ảnh đại diện: ảnh đầu tiên trong image_urls hoặc properties.images"""
+    if site.image_urls:
+        return site.image_urls[0]
+    properties = site.geojson.get('properties') if isinstance(site.geojson, dict) else None
+    images = (properties or {}).get('images') or []
+    return images[0] if images else None
+
+
+class SiteEntry:
+    """Một di tích trong chỉ mục: toạ độ + dữ liệu cần để trả response"""
+    __slots__ = ('site_id', 'name', 'conservation_status', 'point', 'feature', 'thumbnail', 'updated')
+
+    def __init__(self, site):
+        self.site_id = site.site_id
+        self.name = site.name
+        self.conservation_status = site.conservation_status
+        self.point = site_point(site.geojson)
+        self.feature = site_feature(site)
+        self.thumbnail = site_thumbnail(site)
+        self.updated = site.updated
+
+    def slim_feature(self):
+        """Feature rút gọn: id, tên, trạng thái và toạ độ"""
+        return {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': list(self.point)} if self.point else self.feature.get('geometry'),
+            'properties': {
+                'id': self.site_id,
+                'name': self.name,
+                'conservation_status': self.conservation_status,
+            },
+        }
+
+    def summary_feature(self):
+        """Feature cho danh sách tóm tắt: thuộc tính rút gọn + ảnh đại diện"""
+        feature = self.slim_feature()
+        feature['properties']['thumbnail'] = self.thumbnail
+        return feature
+
+
+class GridIndex:
+    """Chỉ mục lưới đều: ô (col, row) -> danh sách (vị trí, SiteEntry)"""
+
+    def __init__(self, entries, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.entries = list(entries)
+        self.cells = {}
+        self.by_site_id = {entry.site_id: entry for entry in self.entries}
+        for position, entry in enumerate(self.entries):
+            if entry.point is not None:
+                self.cells.setdefault(self._cell(*entry.point), []).append((position, entry))
+
+    def _cell(self, lng, lat):
+        return math.floor(lng / self.cell_size), math.floor(lat / self.cell_size)
+
+    def query(self, bbox):
+        """Các entry có toạ độ nằm trong bbox, giữ nguyên thứ tự trong bảng Site"""
+        min_lng, min_lat, max_lng, max_lat = bbox
+        min_col, min_row = self._cell(min_lng, min_lat)
+        max_col, max_row = self._cell(max_lng, max_lat)
+
+        # bbox lớn (zoom xa) -> duyệt các ô có dữ liệu thay vì mọi ô trong bbox
+        bbox_cells = (max_col - min_col + 1) * (max_row - min_row + 1)
+        if bbox_cells > len(self.cells):
+            candidate_cells = [
+                entries for (col, row), entries in self.cells.items()
+                if min_col <= col <= max_col and min_row <= row <= max_row
+            ]
+        else:
+            candidate_cells = [
+                self.cells[(col, row)]
+                for col in range(min_col, max_col + 1)
+                for row in range(min_row, max_row + 1)
+                if (col, row) in self.cells
+            ]
+
+        matched = []
+        for entries in candidate_cells:
+            for position, entry in entries:
+                lng, lat = entry.point
+                if min_lng <= lng <= max_lng and min_lat <= lat <= max_lat:
+                    matched.append((position, entry))
+        matched.sort(key=lambda item: item[0])
+        return [entry for position, entry in matched]
+
+
+def _build_site_index():
+    return GridIndex(SiteEntry(site) for site in Site.objects.all())
+
+
+def get_site_index():
+    """Chỉ mục lưới của toàn bộ Site, dựng lại khi bảng Site thay đổi"""
+    return versioned_snapshot('site_grid_index', _build_site_index)
+
+
+def sites_summary_collection():
+    """FeatureCollection tóm tắt toàn bộ di tích (không có history / conduct / ...)"""
+    return {
+        'type': 'FeatureCollection',
+        'features': [entry.summary_feature() for entry in get_site_index().entries],
+    }
+
+
+def sites_feature_collection(bbox=None, zoom=None):
+    """
+    FeatureCollection các di tích trong bbox (nếu có).
+    Ở zoom < SLIM_ZOOM_THRESHOLD chỉ trả thuộc tính rút gọn.
+    """
+    index = get_site_index()
+    entries = index.query(bbox) if bbox else index.entries
+    slim = zoom is not None and zoom < SLIM_ZOOM_THRESHOLD
+    return {
+        'type': 'FeatureCollection',
+        'features': [entry.slim_feature() if slim else entry.feature for entry in entries],
+    }
+
+
+# --- Gom cụm marker phía server (thuật toán kiểu supercluster) ---
+
+CLUSTER_RADIUS = 60      # Bán kính gom cụm (pixel)
+CLUSTER_EXTENT = 512     # Kích thước tile (pixel)
+CLUSTER_MIN_ZOOM = 0
+CLUSTER_MAX_ZOOM = 16    # Từ zoom lớn hơn mức này không gom cụm nữa
+MAX_LATITUDE = 85.05112878  # Giới hạn Web Mercator (y = 0 / 1), ở ±90 log(1 - sin) không xác định
+
+
+def lng_to_x(lng):
+    """Kinh độ -> toạ độ x Web Mercator chuẩn hoá [0, 1]"""
+    return lng / 360 + 0.5
+
+
+def lat_to_y(lat):
+    """Vĩ độ -> toạ độ y Web Mercator chuẩn hoá [0, 1] (vĩ độ kẹp trong ±MAX_LATITUDE)"""
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    sin = math.sin(lat * math.pi / 180)
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return min(max(y, 0), 1)
+
+
+def x_to_lng(x):
+    return (x - 0.5) * 360
+
+
+def y_to_lat(y):
+    y2 = (180 - y * 360) * math.pi / 180
+    return 360 * math.atan(math.exp(y2)) / math.pi - 90
+
+
+class Cluster:
+    """Một cụm (hoặc một điểm đơn) ở một mức zoom"""
+    __slots__ = ('x', 'y', 'count', 'breakdown', 'entry')
+
+    def __init__(self, x, y, count, breakdown, entry=None):
+        self.x = x
+        self.y = y
+        self.count = count
+        self.breakdown = breakdown
+        self.entry = entry  # SiteEntry nếu là điểm đơn
+
+    @property
+    def lng(self):
+        return x_to_lng(self.x)
+
+    @property
+    def lat(self):
+        return y_to_lat(self.y)
+
+    def to_feature(self):
+        coordinates = [round(self.lng, 6), round(self.lat, 6)]
+        if self.entry is not None:
+            properties = {
+                'cluster': False,
+                'point_count': 1,
+                'id': self.entry.site_id,
+                'name': self.entry.name,
+                'conservation_status': self.entry.conservation_status,
+                'status_breakdown': dict(self.breakdown),
+            }
+        else:
+            properties = {
+                'cluster': True,
+                'point_count': self.count,
+                'status_breakdown': dict(self.breakdown),
+            }
+        return {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': coordinates},
+            'properties': properties,
+        }
+
+
+def _cluster_level(points, zoom):
+    """Gom các cụm của mức zoom + 1 thành các cụm ở mức zoom"""
+    radius = CLUSTER_RADIUS / (CLUSTER_EXTENT * 2 ** zoom)
+
+    # Băm các điểm vào lưới có ô bằng bán kính -> chỉ cần xét 3x3 ô lân cận
+    grid = {}
+    for i, p in enumerate(points):
+        grid.setdefault((math.floor(p.x / radius), math.floor(p.y / radius)), []).append(i)
+
+    visited = [False] * len(points)
+    clusters = []
+    for i, p in enumerate(points):
+        if visited[i]:
+            continue
+        visited[i] = True
+
+        col, row = math.floor(p.x / radius), math.floor(p.y / radius)
+        members = [p]
+        for dc in (-1, 0, 1):
+            for dr in (-1, 0, 1):
+                for j in grid.get((col + dc, row + dr), ()):
+                    if visited[j]:
+                        continue
+                    q = points[j]
+                    if (q.x - p.x) ** 2 + (q.y - p.y) ** 2 <= radius ** 2:
+                        visited[j] = True
+                        members.append(q)
+
+        if len(members) == 1:
+            clusters.append(p)
+            continue
+
+        count = sum(m.count for m in members)
+        breakdown = {}
+        for m in members:
+            for status_key, n in m.breakdown.items():
+                breakdown[status_key] = breakdown.get(status_key, 0) + n
+        clusters.append(Cluster(
+            sum(m.x * m.count for m in members) / count,
+            sum(m.y * m.count for m in members) / count,
+            count,
+            breakdown,
+        ))
+    return clusters
+
+
+def _build_cluster_levels():
+    """Dựng toàn bộ cây cụm: zoom -> danh sách Cluster"""
+    points = [
+        Cluster(lng_to_x(e.point[0]), lat_to_y(e.point[1]), 1, {e.conservation_status: 1}, entry=e)
+        for e in get_site_index().entries
+        if e.point is not None
+    ]
+    levels = {CLUSTER_MAX_ZOOM + 1: points}
+    for zoom in range(CLUSTER_MAX_ZOOM, CLUSTER_MIN_ZOOM - 1, -1):
+        points = _cluster_level(points, zoom)
+        levels[zoom] = points
+    return levels
+
+
+def get_cluster_levels():
+    """Cây cụm theo zoom, dựng lại khi bảng Site thay đổi"""
+    return versioned_snapshot('site_cluster_levels', _build_cluster_levels)
+
+
+def cluster_feature_collection(zoom, bbox=None):
+    """FeatureCollection các cụm ở mức zoom (lọc theo bbox nếu có)"""
+    zoom = min(max(zoom, CLUSTER_MIN_ZOOM), CLUSTER_MAX_ZOOM + 1)
+    clusters = get_cluster_levels()[zoom]
+    if bbox:
+        min_lng, min_lat, max_lng, max_lat = bbox
+        clusters = [
+            c for c in clusters
+            if min_lng <= c.lng <= max_lng and min_lat <= c.lat <= max_lat
+        ]
+    return {
+        'type': 'FeatureCollection',
+        'zoom': zoom,
+        'features': [c.to_feature() for c in clusters],
+    }
+
+
+# --- Tìm di tích lân cận (vector hoá bằng NumPy) ---
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Khoảng cách haversine (km) giữa các toạ độ radian, hỗ trợ broadcast NumPy"""
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class NearbyIndex:
+    """
+    Chỉ mục điểm sắp xếp theo vĩ độ: dải vĩ độ trong bán kính được cắt bằng
+    searchsorted, sau đó tính haversine cho cả dải bằng NumPy (không lặp từng site).
+    """
+
+    def __init__(self, entries):
+        located = [e for e in entries if e.point is not None]
+        lats = np.array([e.point[1] for e in located], dtype=np.float64)
+        lngs = np.array([e.point[0] for e in located], dtype=np.float64)
+        order = np.argsort(lats, kind='stable')
+
+        self.entries = [located[i] for i in order]
+        self.lats = lats[order]
+        self.lat_rad = np.radians(self.lats)
+        self.lng_rad = np.radians(lngs[order])
+
+    def query(self, lat, lng, radius_km, limit):
+        """[(SiteEntry, khoảng cách km), ...] trong bán kính, gần nhất trước"""
+        if not self.entries:
+            return []
+
+        # 1 độ vĩ ~ 111.2 km -> chỉ xét các điểm trong dải vĩ độ này
+        lat_delta = np.degrees(radius_km / EARTH_RADIUS_KM)
+        start = np.searchsorted(self.lats, lat - lat_delta, side='left')
+        stop = np.searchsorted(self.lats, lat + lat_delta, side='right')
+        if start >= stop:
+            return []
+
+        distances = haversine_km(
+            np.radians(lat), np.radians(lng), self.lat_rad[start:stop], self.lng_rad[start:stop]
+        )
+
+        within = np.nonzero(distances <= radius_km)[0]
+        if len(within) > limit:
+            within = within[np.argpartition(distances[within], limit - 1)[:limit]]
+        within = within[np.argsort(distances[within], kind='stable')]
+        return [(self.entries[start + i], float(distances[i])) for i in within]
+
+
+def get_nearby_index():
+    """Chỉ mục lân cận, dựng lại khi bảng Site thay đổi"""
+    return versioned_snapshot('site_nearby_index', lambda: NearbyIndex(get_site_index().entries))
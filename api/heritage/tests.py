@@ -0,0 +1,391 @@
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import leaderboard, mvt, site_cache
+from .log_cursor import IdCursor
+from .spatial import lat_to_y, lng_to_x
+from .models import (
+    BattleAnswer, BattleEvent, BattleSolveState, LeaderboardChange, Quiz, QuizBattle, QuizBattleParticipant, Site, SiteTombstone,
+    UserProfile, UserRole, UserSiteStats,
+)
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_site(site_id='test-site'):
+    return Site.objects.create(
+        site_id=site_id,
+        name=f'Địa điểm {site_id}',
+        geojson={'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [105.85, 21.03]}, 'properties': {}},
+    )
+
+
+def create_quizzes(site, count):
+    return [
+        Quiz.objects.create(
+            site=site, question=f'Câu hỏi {index}', option_a='A', option_b='B', option_c='C', option_d='D',
+            correct_answer='A', xp_reward=10,
+        )
+        for index in range(count)
+    ]
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SiteCacheSignalTests(TestCase):
+    """Thêm / sửa / xóa Site ở bất kỳ đâu đều làm mới cache bản đồ (sau commit)"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_version_bumped_after_commit(self):
+        version = site_cache.get_sites_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            site = create_site()
+            self.assertEqual(site_cache.get_sites_version(), version)
+        self.assertGreater(site_cache.get_sites_version(), version)
+
+        version = site_cache.get_sites_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Site.objects.filter(pk=site.pk).first().save()
+        self.assertGreater(site_cache.get_sites_version(), version)
+
+        version = site_cache.get_sites_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Site.objects.filter(pk=site.pk).delete()
+        self.assertGreater(site_cache.get_sites_version(), version)
+        self.assertEqual(list(SiteTombstone.objects.values_list('site_id', flat=True)), ['test-site'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BattleListQueryTests(TestCase):
+    """GET /api/heritage/battles/: số truy vấn không tăng theo số battle (không N+1 câu hỏi), câu hỏi theo thứ tự battle.questions"""
+
+    @classmethod
+    def setUpTestData(cls):
+        site = create_site()
+        cls.quiz_ids = [quiz.id for quiz in create_quizzes(site, 6)]
+
+    def setUp(self):
+        cache.clear()
+
+    def create_battles(self, count):
+        start = timezone.now() + timedelta(hours=1)
+        for index in range(count):
+            questions = self.quiz_ids[index % 3:index % 3 + 4]
+            QuizBattle.objects.create(
+                scheduled_start_time=start,
+                questions=questions[::-1] if index % 2 else questions,
+                participants=[f'player{index}a', f'player{index}b'],
+            )
+
+    def get_battles(self, expected_count):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/heritage/battles/')
+        self.assertEqual(response.status_code, 200)
+        battles = response.json()
+        self.assertEqual(len(battles), expected_count)
+        return battles
+
+    def test_query_count_is_constant(self):
+        self.create_battles(1)
+        self.get_battles(1)
+
+        self.create_battles(24)
+        battles = self.get_battles(25)
+        for battle in battles:
+            self.assertEqual([q['id'] for q in battle['question_details']], battle['questions'])
+            self.assertNotIn('correct_answer', battle['question_details'][0])
+            self.assertEqual(battle['question_details'][0]['site_name'], 'Địa điểm test-site')
+        self.assertTrue(any(battle['questions'] != sorted(battle['questions']) for battle in battles))
+
+    def test_retrieve_query_count(self):
+        self.create_battles(2)
+        battle = QuizBattle.objects.order_by('id').last()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/heritage/battles/{battle.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q['id'] for q in response.json()['question_details']], battle.questions)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ConcurrentBattleAnswerTests(TransactionTestCase):
+    """submit_answer song song (locked_participants): không mất / trùng câu trả lời, hạng 1..N không trùng"""
+
+    players = ['an', 'binh', 'chi', 'dung']
+
+    def setUp(self):
+        cache.clear()
+        quizzes = create_quizzes(create_site(), 6)
+        self.quiz_ids = [quiz.id for quiz in quizzes]
+        self.battle = QuizBattle.objects.create(
+            scheduled_start_time=timezone.now() - timedelta(minutes=1),
+            status='in_progress',
+            questions=self.quiz_ids,
+            participants=self.players,
+        )
+        QuizBattleParticipant.objects.bulk_create([
+            QuizBattleParticipant(battle=self.battle, user_name=user_name) for user_name in self.players
+        ])
+
+    def submit(self, user_name, quiz_id, answer):
+        try:
+            response = Client().post(
+                f'/api/heritage/battles/{self.battle.id}/submit_answer/',
+                {'user_name': user_name, 'quiz_id': quiz_id, 'answer': answer, 'time_taken': 2},
+                content_type='application/json',
+            )
+            return response.status_code
+        finally:
+            connection.close()
+
+    def test_concurrent_answers(self):
+        # Người chơi thứ i trả lời đúng i + 1 câu đầu: điểm khác nhau nên thứ hạng xác định
+        submissions = [
+            (user_name, quiz_id, 'A' if index <= position else 'B')
+            for position, user_name in enumerate(self.players)
+            for index, quiz_id in enumerate(self.quiz_ids)
+        ]
+        # Mỗi người nộp lại câu đầu một lần: đúng một lượt được nhận
+        duplicates = [(user_name, self.quiz_ids[0], 'A') for user_name in self.players]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(lambda args: self.submit(*args), submissions + duplicates))
+        self.assertEqual(statuses.count(200), len(submissions))
+        self.assertEqual(statuses.count(400), len(duplicates))
+
+        participants = {p.user_name: p for p in QuizBattleParticipant.objects.filter(battle=self.battle)}
+        for position, user_name in enumerate(self.players):
+            participant = participants[user_name]
+            self.assertEqual(participant.total_answered, len(self.quiz_ids))
+            self.assertEqual(participant.correct_answers, position + 1)
+            self.assertEqual(participant.score, (position + 1) * 10)
+            self.assertEqual(participant.time_completed, 2 * len(self.quiz_ids))
+            self.assertEqual(participant.rank, len(self.players) - position)
+        self.assertEqual(sorted(p.rank for p in participants.values()), list(range(1, len(self.players) + 1)))
+        self.assertEqual(BattleAnswer.objects.filter(battle=self.battle).count(), len(submissions))
+
+        # Câu có người đúng ghi nhận đúng một người giải đầu tiên trong số đó
+        first_solvers = BattleSolveState.objects.get(battle=self.battle).first_solvers
+        for index, quiz_id in enumerate(self.quiz_ids):
+            solvers = set(self.players[index:]) if index < len(self.players) else set()
+            if solvers:
+                self.assertIn(first_solvers[str(quiz_id)], solvers)
+            else:
+                self.assertNotIn(str(quiz_id), first_solvers)
+
+
+class IdCursorTests(TestCase):
+    """Dòng có id nhỏ hơn commit sau con trỏ vẫn được đọc, dòng đã đọc không lặp lại"""
+
+    def test_late_commit_is_read(self):
+        battle = QuizBattle.objects.create(scheduled_start_time=timezone.now(), questions=[], participants=[])
+        first = BattleEvent.objects.create(battle=battle, event_type='answer-submitted')
+        BattleEvent.objects.create(id=first.id + 2, battle=battle, event_type='answer-submitted')
+        events = BattleEvent.objects.filter(battle=battle)
+
+        cursor = IdCursor()
+        self.assertEqual([e.id for e in cursor.filter(events) if cursor.advance(e.id)], [first.id, first.id + 2])
+        BattleEvent.objects.create(id=first.id + 1, battle=battle, event_type='answer-submitted')
+        self.assertTrue(cursor.pending(first.id + 1))
+        self.assertEqual([e.id for e in cursor.filter(events) if cursor.advance(e.id)], [first.id + 1])
+        self.assertEqual(cursor.last_id, first.id + 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BattleEventStreamTests(TestCase):
+    """Battle đã kết thúc và không còn sự kiện sau Last-Event-ID: 204, EventSource ngừng kết nối lại"""
+
+    def setUp(self):
+        cache.clear()
+
+    def get_events(self, battle, last_event_id=None):
+        headers = {'HTTP_LAST_EVENT_ID': str(last_event_id)} if last_event_id is not None else {}
+        return self.client.get(f'/api/heritage/battles/{battle.id}/events/', **headers).status_code
+
+    def test_finished_battle(self):
+        battle = QuizBattle.objects.create(
+            scheduled_start_time=timezone.now(), status='in_progress', questions=[], participants=[],
+        )
+        first = BattleEvent.objects.create(battle=battle, event_type='rank-changed')
+        self.assertEqual(self.get_events(battle), 200)
+
+        battle.status = 'completed'
+        battle.save()
+        final = BattleEvent.objects.create(battle=battle, event_type='status-changed', data={'status': 'completed'})
+        self.assertEqual(self.get_events(battle, first.id), 200)
+        self.assertEqual(self.get_events(battle, final.id), 204)
+        self.assertEqual(self.get_events(battle), 204)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LeaderboardCompactionTests(TestCase):
+    """compact_changes giữ dòng mới nhất của mỗi người; process có con trỏ cũ dựng lại từ nguồn"""
+
+    def setUp(self):
+        cache.clear()
+        leaderboard._states.clear()
+
+    def test_compaction(self):
+        an = UserProfile.objects.create(user_name='an', total_xp=10)
+        UserProfile.objects.create(user_name='binh', total_xp=20)
+        for total_xp in (30, 40, 50):
+            an.total_xp = total_xp
+            an.save()
+        changes = LeaderboardChange.objects.filter(board='xp')
+        self.assertEqual(changes.count(), 5)
+
+        # Dòng bị thay thế: xóa, process đang chạy vẫn áp dụng tiếp được
+        self.assertEqual(leaderboard.compact_changes('xp'), 3)
+        self.assertEqual(sorted(changes.values_list('user_name', flat=True)), ['an', 'binh'])
+        board = leaderboard.get_board('xp')
+        self.assertEqual((board.rank('an'), board.rank('binh')), (1, 2))
+        state = leaderboard._states['xp']
+
+        # Dòng quá hạn: xóa hết, process có con trỏ cũ hơn mốc dựng lại từ nguồn
+        state.cursor.last_id = 0
+        changes.update(created_at=timezone.now() - leaderboard.CHANGE_RETENTION - timedelta(minutes=1))
+        self.assertEqual(leaderboard.compact_changes('xp'), 2)
+        self.assertFalse(changes.exists())
+        board = leaderboard.get_board('xp')
+        self.assertIsNot(leaderboard._states['xp'], state)
+        self.assertEqual(board.values['an'], {'total_xp': 50})
+
+        # Con trỏ sau khi dựng lại đã qua mốc: không dựng lại ở lần đọc sau
+        state = leaderboard._states['xp']
+        leaderboard.get_board('xp')
+        self.assertIs(leaderboard._states['xp'], state)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecomputeLevelsTests(TestCase):
+    """recompute_levels: chỉ ghi profile lệch level, số truy vấn theo số khối chứ không theo số level"""
+
+    def test_fixes_only_wrong_levels(self):
+        for index, total_xp in enumerate((0, 99, 100, 300, 5000, 10 ** 6)):
+            UserProfile.objects.create(user_name=f'user{index}', total_xp=total_xp)
+        UserProfile.objects.filter(total_xp__in=(100, 10 ** 6)).update(level=1)
+        UserProfile.objects.filter(total_xp=0).update(level=7)
+
+        out = io.StringIO()
+        call_command('recompute_levels', batch_size=2, stdout=out)
+        self.assertIn('đã sửa 3', out.getvalue())
+        for total_xp, level in UserProfile.objects.values_list('total_xp', 'level'):
+            self.assertEqual(level, UserProfile.level_for_xp(total_xp))
+
+        # Chạy lại không còn gì để sửa: 3 khối + 1 khối rỗng, mỗi khối SAVEPOINT, SELECT, RELEASE
+        with self.assertNumQueries(4 * 3):
+            call_command('recompute_levels', batch_size=2, stdout=io.StringIO())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ClassScopeKeyTests(TestCase):
+    """Tên trường / lớp chứa '/' không làm hai lớp khác nhau trùng bảng xếp hạng"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_names_with_slash(self):
+        site = create_site()
+        for user_name, school_name, class_name in [('an', 'A/B', 'C'), ('binh', 'A', 'B/C')]:
+            user = User.objects.create(username=user_name)
+            UserRole.objects.create(user=user, school_name=school_name, class_name=class_name)
+            UserSiteStats.objects.create(user_name=user_name, site=site, total_questions=1)
+
+        for user_name, school_name, class_name in [('an', 'A/B', 'C'), ('binh', 'A', 'B/C')]:
+            with self.subTest(school_name=school_name, class_name=class_name):
+                response = self.client.get('/api/heritage/leaderboard/scoped/', {
+                    'scope': 'class', 'school_name': school_name, 'class_name': class_name,
+                })
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([row['user_name'] for row in response.json()['results']], [user_name])
+        self.assertNotEqual(
+            leaderboard._scope_id('class', leaderboard.class_key('A/B', 'C')),
+            leaderboard._scope_id('class', leaderboard.class_key('A', 'B/C')),
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ItineraryValidationTests(TestCase):
+    """sites/itinerary/: toạ độ / time_budget_ms không hữu hạn hoặc ngoài phạm vi trả về 400"""
+
+    def setUp(self):
+        cache.clear()
+        create_site()
+
+    def post(self, start, **extra):
+        return self.client.post(
+            '/api/heritage/sites/itinerary/', {'start': start, 'site_ids': ['test-site'], **extra},
+            content_type='application/json',
+        )
+
+    def test_rejects_invalid_numbers(self):
+        self.assertEqual(self.post({'lat': 16.75, 'lng': 107.19}).status_code, 200)
+        for start, extra in [
+            ({'lat': 'nan', 'lng': 107}, {}),
+            ({'lat': 16, 'lng': 'inf'}, {}),
+            ({'lat': 91, 'lng': 107}, {}),
+            ({'lat': 16, 'lng': -181}, {}),
+            ({'lat': 16, 'lng': 107}, {'time_budget_ms': 'nan'}),
+        ]:
+            with self.subTest(start=start, **extra):
+                self.assertEqual(self.post(start, **extra).status_code, 400)
+
+
+class MercatorProjectionTests(SimpleTestCase):
+    """lat_to_y kẹp vĩ độ trong giới hạn Web Mercator, không lỗi ở ±90"""
+
+    def test_poles(self):
+        self.assertEqual(lat_to_y(90), lat_to_y(85.06))
+        self.assertEqual(lat_to_y(-90), 1)
+        self.assertAlmostEqual(lat_to_y(85.05112878), 0)
+        self.assertAlmostEqual(lat_to_y(0), 0.5)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TileCacheTests(TestCase):
+    """Chỉ lưu tile có điểm, zoom <= TILE_CACHE_MAX_ZOOM, của version hiện tại"""
+
+    def setUp(self):
+        cache.clear()
+        self.tile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tile_dir.cleanup)
+        self.enterContext(override_settings(TILE_CACHE_DIR=self.tile_dir.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.site = create_site()
+
+    def site_tile(self, z):
+        n = 2 ** z
+        return z, int(lng_to_x(105.85) * n), int(lat_to_y(21.03) * n)
+
+    def cached_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(path, name), self.tile_dir.name)
+            for path, _, names in os.walk(self.tile_dir.name) for name in names
+        )
+
+    def test_cache_is_bounded(self):
+        version, data = mvt.get_site_tile(5, 0, 0)
+        self.assertEqual(data, b'')
+        _, data = mvt.get_site_tile(*self.site_tile(mvt.TILE_CACHE_MAX_ZOOM + 1))
+        self.assertTrue(data)
+        self.assertEqual(self.cached_files(), [])
+
+        z, x, y = self.site_tile(5)
+        _, data = mvt.get_site_tile(z, x, y)
+        self.assertTrue(data)
+        self.assertEqual(self.cached_files(), [f'{version}/{z}/{x}/{y}.mvt'])
+
+        # Site đổi -> version mới, thư mục version cũ bị dọn khi ghi tile đầu tiên
+        with self.captureOnCommitCallbacks(execute=True):
+            self.site.save()
+        new_version, _ = mvt.get_site_tile(z, x, y)
+        self.assertEqual(self.cached_files(), [f'{new_version}/{z}/{x}/{y}.mvt'])
@@ -0,0 +1,322 @@
+"""
+Giải đấu nhiều vòng trên QuizBattle: loại trực tiếp hoặc hệ Thụy Sĩ (Swiss).
+
+Không poll từng battle: khi battle_lifecycle.complete_battle kết thúc battle
+cuối cùng của một vòng, on_battle_completed chốt kết quả theo
+QuizBattleParticipant.rank và tạo toàn bộ battle vòng sau bằng bulk_create.
+run_battle_scheduler gọi thêm advance_ready_tournaments() (một truy vấn) để
+tự phục hồi nếu process dừng giữa lúc chuyển vòng.
+
+Bracket được serialize sẵn trong cache theo version của từng giải; version
+tăng mỗi khi có battle của giải đổi trạng thái hoặc giải chuyển vòng.
+"""
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import battle_factory
+from .models import Quiz, QuizBattle, QuizBattleParticipant, Tournament, TournamentEntry
+from .site_cache import encode_json, make_etag
+
+FINISHED_STATUSES = ['completed', 'cancelled']
+DEFAULT_SWISS_ROUNDS = 3
+MAX_SWISS_ROUNDS = 20
+
+BRACKET_VERSION_KEY = 'heritage:tournaments:{id}:version'
+BRACKET_KEY = 'heritage:tournaments:{id}:bracket:{version}'
+BRACKET_TIMEOUT = 60 * 60 * 24
+
+
+def _seed_order(groups):
+    """Thứ tự hạt giống ban đầu (ngược với battle_factory.seed_groups)"""
+    order = []
+    for row in range(max(len(group) for group in groups)):
+        cols = range(len(groups)) if row % 2 == 0 else reversed(range(len(groups)))
+        order.extend(groups[col][row] for col in cols if row < len(groups[col]))
+    return order
+
+
+def _group_count(player_count, group_size):
+    """Số battle cho vòng sau: mỗi battle tối đa group_size người và không ai đấu một mình"""
+    return max(1, min(-(-player_count // group_size), player_count // battle_factory.MIN_GROUP_SIZE))
+
+
+def split_groups(players, group_size):
+    """Chia danh sách đã xếp hạng thành các bảng liên tiếp (người cùng mức điểm gặp nhau)"""
+    group_count = _group_count(len(players), group_size)
+    base, extra = divmod(len(players), group_count)
+    groups, start = [], 0
+    for index in range(group_count):
+        size = base + (index < extra)
+        groups.append(players[start:start + size])
+        start += size
+    return groups
+
+
+def planned_rounds(tournament, groups):
+    """Số vòng tối đa của giải: total_rounds (Swiss) hoặc số vòng loại tới khi còn một battle"""
+    if tournament.format == 'swiss':
+        return tournament.total_rounds
+    rounds, sizes = 1, [len(group) for group in groups]
+    while len(sizes) > 1:
+        players = sum(min(tournament.advance_count, size - 1) for size in sizes)
+        if players < battle_factory.MIN_GROUP_SIZE:
+            break
+        group_count = _group_count(players, tournament.group_size)
+        base, extra = divmod(players, group_count)
+        sizes = [base + (index < extra) for index in range(group_count)]
+        rounds += 1
+    return rounds
+
+
+def _create_round(tournament, round_number, groups, scheduled_start_time, question_ids=None):
+    """Tạo mọi battle của một vòng; các bảng trong vòng dùng chung bộ câu hỏi"""
+    if question_ids is None:
+        question_ids = battle_factory.sample_question_sets(tournament.question_count)[0]
+    return battle_factory.create_battles(
+        groups, [question_ids] * len(groups), scheduled_start_time, tournament.duration_minutes,
+        tournament=tournament, tournament_round=round_number,
+    )
+
+
+def create_tournament(name, groups, scheduled_start_time, format='elimination', **settings):
+    """
+    Tạo giải, danh sách người chơi và toàn bộ battle vòng 1.
+    groups: các bảng vòng 1 (battle_factory.plan_groups).
+    settings: group_size, advance_count, total_rounds, question_count,
+    duration_minutes, round_gap_minutes. Raise ValueError nếu không hợp lệ.
+    """
+    if format not in dict(Tournament.FORMAT_CHOICES):
+        raise ValueError('format phải là elimination hoặc swiss')
+
+    tournament = Tournament(name=name, format=format, **settings)
+    if not battle_factory.MIN_GROUP_SIZE <= tournament.group_size <= battle_factory.MAX_GROUP_SIZE:
+        raise ValueError('group_size phải từ 2 đến 8')
+    if format == 'swiss':
+        tournament.total_rounds = tournament.total_rounds or DEFAULT_SWISS_ROUNDS
+        if not 1 <= tournament.total_rounds <= MAX_SWISS_ROUNDS:
+            raise ValueError(f'total_rounds phải từ 1 đến {MAX_SWISS_ROUNDS}')
+    else:
+        tournament.total_rounds = None
+        if not 1 <= tournament.advance_count < tournament.group_size:
+            raise ValueError('advance_count phải từ 1 đến group_size - 1')
+
+    # Mỗi vòng rút bộ câu hỏi riêng: kiểm tra ngay để vòng sau không lỗi khi giải đã chạy
+    needed = tournament.question_count * planned_rounds(tournament, groups)
+    available = Quiz.objects.count()
+    if available < needed:
+        raise ValueError(f'Không đủ câu hỏi cho mọi vòng. Cần {needed} câu, hiện có {available} câu.')
+
+    question_ids = battle_factory.sample_question_sets(tournament.question_count)[0]
+
+    with transaction.atomic():
+        tournament.save()
+        TournamentEntry.objects.bulk_create([
+            TournamentEntry(tournament=tournament, user_name=user_name, seed=seed)
+            for seed, user_name in enumerate(_seed_order(groups), start=1)
+        ])
+        _create_round(tournament, 1, groups, scheduled_start_time, question_ids)
+    return tournament
+
+
+def _round_open(tournament_id, round_number):
+    return QuizBattle.objects.filter(
+        tournament_id=tournament_id, tournament_round=round_number
+    ).exclude(status__in=FINISHED_STATUSES).exists()
+
+
+def _round_results(tournament, round_number):
+    """{battle_id: [participant theo rank]} của các battle đã hoàn thành trong vòng"""
+    participants = QuizBattleParticipant.objects.filter(
+        battle__tournament=tournament, battle__tournament_round=round_number, battle__status='completed'
+    ).order_by('battle_id', F('rank').asc(nulls_last=True), 'id')
+    results = {}
+    for participant in participants:
+        results.setdefault(participant.battle_id, []).append(participant)
+    return results
+
+
+def _advance_elimination(tournament, round_number, results, entries):
+    """Top advance_count mỗi battle đi tiếp; trả về (bảng vòng sau, None) hoặc (None, người vô địch)"""
+    advancing = []
+    for ranked in results.values():
+        # Mỗi battle luôn loại ít nhất một người để giải chắc chắn kết thúc
+        keep = min(tournament.advance_count, len(ranked) - 1)
+        for position, participant in enumerate(ranked):
+            entry = entries.get(participant.user_name)
+            if entry is None:
+                continue
+            entry.total_score += participant.score
+            if position < keep:
+                advancing.append((position, -participant.score, entry.seed, participant.user_name))
+
+    advancing.sort()
+    if len(results) <= 1 or len(advancing) < 2:
+        # Chung kết (hoặc chỉ còn một người): hạng 1 của battle cuối vô địch
+        if len(results) == 1:
+            winner = next(iter(results.values()))[0].user_name
+        else:
+            winner = advancing[0][3] if advancing else ''
+        survivors = {winner}
+    else:
+        winner = None
+        survivors = {name for *_, name in advancing}
+
+    for entry in entries.values():
+        if entry.user_name not in survivors:
+            entry.eliminated_round = round_number
+
+    if winner is not None:
+        return None, winner
+    players = [name for *_, name in advancing]
+    return battle_factory.seed_groups(players, _group_count(len(players), tournament.group_size)), None
+
+
+def _advance_swiss(tournament, round_number, results, entries):
+    """Cộng điểm theo số người xếp sau; vòng sau ghép người cùng mức điểm"""
+    for ranked in results.values():
+        for position, participant in enumerate(ranked):
+            entry = entries.get(participant.user_name)
+            if entry is None:
+                continue
+            entry.points += len(ranked) - 1 - position
+            entry.total_score += participant.score
+
+    standings = sorted(entries.values(), key=lambda e: (-e.points, -e.total_score, e.seed))
+    if round_number >= tournament.total_rounds or len(standings) < battle_factory.MIN_GROUP_SIZE:
+        return None, standings[0].user_name if standings else ''
+    return split_groups([entry.user_name for entry in standings], tournament.group_size), None
+
+
+def advance_round(tournament_id, round_number):
+    """
+    Chốt vòng round_number và tạo vòng sau (hoặc kết thúc giải).
+    Khóa dòng Tournament nên dù nhiều process cùng gọi, mỗi vòng chỉ chuyển một lần.
+    """
+    with transaction.atomic():
+        tournament = Tournament.objects.select_for_update().filter(
+            pk=tournament_id, status='in_progress', current_round=round_number
+        ).first()
+        if tournament is None or _round_open(tournament_id, round_number):
+            return False
+
+        results = _round_results(tournament, round_number)
+        entries = {entry.user_name: entry for entry in tournament.entries.filter(eliminated_round__isnull=True)}
+        if tournament.format == 'swiss':
+            groups, winner = _advance_swiss(tournament, round_number, results, entries)
+        else:
+            groups, winner = _advance_elimination(tournament, round_number, results, entries)
+        TournamentEntry.objects.bulk_update(entries.values(), ['points', 'total_score', 'eliminated_round'])
+
+        if winner is None:
+            tournament.current_round = round_number + 1
+            start = timezone.now() + timedelta(minutes=tournament.round_gap_minutes)
+            _create_round(tournament, tournament.current_round, groups, start)
+            tournament.save(update_fields=['current_round'])
+        else:
+            tournament.status = 'completed'
+            tournament.winner = winner
+            tournament.completed_at = timezone.now()
+            tournament.save(update_fields=['status', 'winner', 'completed_at'])
+
+    invalidate_bracket(tournament_id)
+    return True
+
+
+def on_battle_completed(battle):
+    """Gọi từ battle_lifecycle.complete_battle; chuyển vòng nếu đây là battle cuối của vòng"""
+    if not battle.tournament_id:
+        return False
+    invalidate_bracket(battle.tournament_id)
+    if _round_open(battle.tournament_id, battle.tournament_round):
+        return False
+    return advance_round(battle.tournament_id, battle.tournament_round)
+
+
+def advance_ready_tournaments():
+    """Chuyển vòng cho các giải có vòng hiện tại đã xong nhưng chưa được chốt (tự phục hồi)"""
+    ready = Tournament.objects.filter(status='in_progress').annotate(
+        open_battles=Count(
+            'battles',
+            filter=Q(battles__tournament_round=F('current_round')) & ~Q(battles__status__in=FINISHED_STATUSES),
+        )
+    ).filter(open_battles=0).values_list('pk', 'current_round')
+    return sum(advance_round(pk, round_number) for pk, round_number in ready)
+
+
+def get_bracket_version(tournament_id):
+    key = BRACKET_VERSION_KEY.format(id=tournament_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_bracket(tournament_id):
+    """Tăng version bracket sau khi battle của giải đổi trạng thái / giải chuyển vòng"""
+    key = BRACKET_VERSION_KEY.format(id=tournament_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_bracket_version(tournament_id)
+        cache.incr(key)
+
+
+def bracket_payload(tournament):
+    """Các vòng, battle, thứ hạng trong từng battle và bảng điểm người chơi"""
+    battles = tournament.battles.prefetch_related('battle_participants').order_by('tournament_round', 'id')
+    rounds = {}
+    for battle in battles:
+        participants = sorted(battle.battle_participants.all(), key=lambda p: (p.rank is None, p.rank or 0, p.user_name))
+        rounds.setdefault(battle.tournament_round, []).append({
+            'battle_id': battle.id,
+            'status': battle.status,
+            'scheduled_start_time': battle.scheduled_start_time.isoformat(),
+            'participants': [
+                {
+                    'user_name': p.user_name,
+                    'rank': p.rank,
+                    'score': p.score,
+                    'correct_answers': p.correct_answers,
+                }
+                for p in participants
+            ],
+        })
+
+    return {
+        'id': tournament.id,
+        'name': tournament.name,
+        'format': tournament.format,
+        'status': tournament.status,
+        'current_round': tournament.current_round,
+        'total_rounds': tournament.total_rounds,
+        'winner': tournament.winner or None,
+        'rounds': [{'round': number, 'battles': items} for number, items in sorted(rounds.items())],
+        'standings': [
+            {
+                'user_name': entry.user_name,
+                'seed': entry.seed,
+                'points': entry.points,
+                'total_score': entry.total_score,
+                'eliminated_round': entry.eliminated_round,
+            }
+            for entry in tournament.entries.all()
+        ],
+    }
+
+
+def get_bracket(tournament):
+    """(etag, body) của bracket đã serialize; chỉ dựng lại khi version thay đổi"""
+    version = get_bracket_version(tournament.pk)
+    key = BRACKET_KEY.format(id=tournament.pk, version=version)
+    cached = cache.get(key)
+    if cached is None:
+        body = encode_json(bracket_payload(tournament))
+        cached = (make_etag(body), body)
+        cache.set(key, cached, BRACKET_TIMEOUT)
+    return cached
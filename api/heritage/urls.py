@@ -9,18 +9,30 @@ router.register(r'quiz-attempts', views.QuizAttemptViewSet, basename='quiz-attem
 router.register(r'feedbacks', views.FeedbackViewSet, basename='feedback')
 router.register(r'battles', views.QuizBattleViewSet, basename='quiz-battle')
 router.register(r'battle-participants', views.QuizBattleParticipantViewSet, basename='battle-participant')
+router.register(r'tournaments', views.TournamentViewSet, basename='tournament')
 
 urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('sites/', views.sites_geojson, name='sites_geojson'),
+    path('sites/summary/', views.sites_summary, name='sites_summary'),
+    path('sites/clusters/', views.site_clusters, name='site_clusters'),
+    path('sites/changes/', views.site_changes, name='site_changes'),
+    path('sites/nearby/', views.sites_nearby, name='sites_nearby'),
+    path('sites/itinerary/', views.site_itinerary, name='site_itinerary'),
     path('sites/<str:site_id>/', views.site_delete, name='site_delete'),
     path('sites/<str:site_id>/update/', views.site_update, name='site_update'),
+    path('sites/<str:site_id>/detail/', views.site_detail, name='site_detail'),
+    path('tiles.json', views.site_tilejson, name='site_tilejson'),
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', views.site_tile, name='site_tile'),
+    path('search/', views.search_view, name='search'),
     path('feedback/', views.feedback_create, name='feedback_create'),
     
     # User Profile endpoints
     path('user/profile/', views.user_profile, name='user_profile'),
     path('user/add-xp/', views.add_user_xp, name='add_user_xp'),
     path('leaderboard/', views.leaderboard, name='leaderboard'),
+    path('leaderboard/rank/', views.leaderboard_rank, name='leaderboard_rank'),
+    path('leaderboard/scoped/', views.scoped_leaderboard, name='scoped_leaderboard'),
     path('achievements/', views.achievements_list, name='achievements_list'),
     
     # Auth endpoints
@@ -52,6 +64,9 @@ urlpatterns = [
     path('settings/', views.get_system_settings, name='get_system_settings'),
     path('settings/feedback-email/', views.update_feedback_email, name='update_feedback_email'),
     
+    # Battle realtime (SSE)
+    path('battles/<int:pk>/events/', views.battle_events_stream, name='battle_events'),
+    
     # Quiz endpoints
     path('', include(router.urls)),
 ]
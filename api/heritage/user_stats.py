@@ -0,0 +1,222 @@
+"""
+Bảng tổng hợp UserStats: một dòng mỗi người chơi.
+
+- Thêm / xóa QuizAttempt: cộng / trừ bằng UPDATE ... SET x = x + delta (signal
+  trong leaderboard.py, cùng transaction với UserSiteStats nên unique_sites
+  tăng đúng khi người chơi có dòng UserSiteStats đầu tiên tại một địa điểm).
+- Chuỗi ngày / chuỗi câu đúng cập nhật O(1) trong cùng UPDATE đó bằng CASE trên
+  giá trị cũ (last_active_date, correct_run). Xóa QuizAttempt không tua lại chuỗi;
+  rebuild_user_stats tính lại chuỗi từ đầu.
+- Battle kết thúc: battle_lifecycle.complete_battle gọi apply_battle sau khi chốt hạng.
+Dựng lại từ dữ liệu gốc: python manage.py rebuild_user_stats
+"""
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+from zoneinfo import ZoneInfo
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DateField, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import QuizAttempt, QuizBattleParticipant, UserStats
+
+FAST_ANSWER_SECONDS = 5
+EARLY_HOUR = 8  # làm bài trước 8 giờ sáng (giờ địa phương)
+PERFECT_BATTLE_CORRECT = 5  # coi battle >= 5 câu đúng là hoàn hảo
+
+STREAK_TIMEZONE = ZoneInfo('Asia/Ho_Chi_Minh')  # ranh giới ngày của chuỗi ngày liên tiếp
+
+STREAK_FIELDS = ['current_streak', 'longest_streak', 'correct_run', 'longest_correct_run']
+STAT_FIELDS = [
+    'total_quizzes', 'correct_answers', 'total_time', 'total_xp', 'unique_sites',
+    'fast_correct', 'early_attempts', 'battles_played', 'battle_wins', 'perfect_battles',
+] + STREAK_FIELDS
+
+
+def _add(user_name, updates=None, initial=None, **deltas):
+    """
+    Cộng deltas vào dòng của user_name, tạo dòng nếu chưa có.
+    updates: biểu thức gán thêm khi dòng đã có; initial: giá trị tương ứng khi tạo dòng mới.
+    """
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas and not updates:
+        return
+    expressions = {field: F(field) + value for field, value in deltas.items()}
+    expressions.update(updates or {})
+    stats = UserStats.objects.filter(user_name=user_name)
+    if stats.update(**expressions):
+        return
+    try:
+        with transaction.atomic():
+            UserStats.objects.create(user_name=user_name, **deltas, **(initial or {}))
+    except IntegrityError:
+        # Request khác vừa tạo dòng này
+        stats.update(**expressions)
+
+
+def activity_date(moment):
+    """Ngày (theo STREAK_TIMEZONE) của một thời điểm làm bài"""
+    return timezone.localtime(moment, STREAK_TIMEZONE).date()
+
+
+def _streak_updates(attempt):
+    """(biểu thức UPDATE, giá trị khi tạo dòng mới) cho chuỗi ngày và chuỗi câu đúng"""
+    today = activity_date(attempt.created)
+    yesterday = today - timedelta(days=1)
+    # Cùng ngày (hoặc câu đến trễ của ngày cũ): giữ nguyên; ngày kế tiếp: +1; cách quãng: bắt đầu lại
+    current = Case(
+        When(last_active_date__gte=today, then=F('current_streak')),
+        When(last_active_date=yesterday, then=F('current_streak') + 1),
+        default=Value(1),
+    )
+    run = F('correct_run') + 1 if attempt.is_correct else Value(0)
+    updates = {
+        'current_streak': current,
+        'longest_streak': Greatest(F('longest_streak'), current),
+        'last_active_date': Case(
+            When(last_active_date__gt=today, then=F('last_active_date')),
+            default=Value(today),
+            output_field=DateField(),
+        ),
+        'correct_run': run,
+        'longest_correct_run': Greatest(F('longest_correct_run'), run),
+    }
+    initial = {
+        'current_streak': 1,
+        'longest_streak': 1,
+        'last_active_date': today,
+        'correct_run': int(attempt.is_correct),
+        'longest_correct_run': int(attempt.is_correct),
+    }
+    return updates, initial
+
+
+def _is_fast_correct(attempt):
+    return attempt.is_correct and attempt.time_taken <= FAST_ANSWER_SECONDS
+
+
+def _is_early(attempt):
+    return timezone.localtime(attempt.created).hour < EARLY_HOUR
+
+
+def apply_attempt(attempt, sign, site_delta=0):
+    """
+    Cộng (sign=1) / trừ (sign=-1) một QuizAttempt.
+    site_delta: +1 / -1 nếu người chơi vừa có / vừa mất địa điểm này trong UserSiteStats.
+    """
+    if not attempt.user_name:
+        return
+    updates, initial = _streak_updates(attempt) if sign > 0 else (None, None)
+    _add(
+        attempt.user_name,
+        updates=updates,
+        initial=initial,
+        total_quizzes=sign,
+        correct_answers=sign * int(attempt.is_correct),
+        total_time=sign * attempt.time_taken,
+        total_xp=sign * attempt.xp_earned,
+        unique_sites=site_delta,
+        fast_correct=sign * int(_is_fast_correct(attempt)),
+        early_attempts=sign * int(_is_early(attempt)),
+    )
+
+
+def apply_battle(battle):
+    """Cộng kết quả của battle vừa kết thúc (hạng đã chốt) cho mọi người chơi"""
+    participants = list(
+        QuizBattleParticipant.objects.filter(battle=battle).values_list('user_name', 'rank', 'correct_answers')
+    )
+    if not participants:
+        return
+    # Mỗi tổ hợp (thắng, hoàn hảo) một UPDATE thay vì một UPDATE mỗi người
+    outcomes = {}
+    for user_name, rank, correct_answers in participants:
+        outcome = (int(rank == 1), int(correct_answers >= PERFECT_BATTLE_CORRECT))
+        outcomes.setdefault(outcome, []).append(user_name)
+
+    with transaction.atomic():
+        UserStats.objects.bulk_create(
+            [UserStats(user_name=user_name) for user_name, _, _ in participants], ignore_conflicts=True
+        )
+        for (win, perfect), user_names in outcomes.items():
+            UserStats.objects.filter(user_name__in=user_names).update(
+                battles_played=F('battles_played') + 1,
+                battle_wins=F('battle_wins') + win,
+                perfect_battles=F('perfect_battles') + perfect,
+            )
+
+
+def get_stats(user_name):
+    """
+    {tên chỉ số: giá trị} của một người (toàn 0 nếu chưa có dòng).
+    current_streak = 0 nếu đã qua hơn một ngày không làm bài.
+    """
+    row = UserStats.objects.filter(user_name=user_name).values(*STAT_FIELDS, 'last_active_date').first()
+    if row is None:
+        return dict.fromkeys(STAT_FIELDS, 0)
+    last_active_date = row.pop('last_active_date')
+    if last_active_date is None or last_active_date < activity_date(timezone.now()) - timedelta(days=1):
+        row['current_streak'] = 0
+    return row
+
+
+def walk_streaks(attempts):
+    """
+    Chuỗi của một người từ các lần làm bài theo thứ tự thời gian [(created, is_correct), ...].
+    Trả về dict các trường chuỗi của UserStats.
+    """
+    streaks = dict.fromkeys(STREAK_FIELDS, 0)
+    streaks['last_active_date'] = None
+    for created, is_correct in attempts:
+        day = activity_date(created)
+        last = streaks['last_active_date']
+        if last is None or day > last:
+            streaks['current_streak'] = streaks['current_streak'] + 1 if last == day - timedelta(days=1) else 1
+            streaks['last_active_date'] = day
+        streaks['correct_run'] = streaks['correct_run'] + 1 if is_correct else 0
+        streaks['longest_streak'] = max(streaks['longest_streak'], streaks['current_streak'])
+        streaks['longest_correct_run'] = max(streaks['longest_correct_run'], streaks['correct_run'])
+    return streaks
+
+
+def aggregate_user_stats():
+    """{user_name: {chỉ số: giá trị}} tính lại từ QuizAttempt và các battle đã kết thúc"""
+    stats = {}
+    attempts = QuizAttempt.objects.exclude(user_name='').values('user_name').annotate(
+        total_quizzes=Count('id'),
+        correct_answers=Count('id', filter=Q(is_correct=True)),
+        total_time=Sum('time_taken'),
+        total_xp=Sum('xp_earned'),
+        unique_sites=Count('quiz__site', distinct=True),
+        fast_correct=Count('id', filter=Q(is_correct=True, time_taken__lte=FAST_ANSWER_SECONDS)),
+        early_attempts=Count('id', filter=Q(created__hour__lt=EARLY_HOUR)),
+    ).order_by()
+    for row in attempts:
+        stats[row.pop('user_name')] = {field: value or 0 for field, value in row.items()}
+
+    battles = QuizBattleParticipant.objects.filter(battle__status='completed').values('user_name').annotate(
+        battles_played=Count('id'),
+        battle_wins=Count('id', filter=Q(rank=1)),
+        perfect_battles=Count('id', filter=Q(correct_answers__gte=PERFECT_BATTLE_CORRECT)),
+    ).order_by()
+    for row in battles:
+        stats.setdefault(row.pop('user_name'), {}).update(row)
+
+    # Chuỗi: duyệt QuizAttempt theo người chơi và thời gian (một lượt đọc tuần tự)
+    attempts = QuizAttempt.objects.exclude(user_name='').order_by('user_name', 'created', 'id').values_list(
+        'user_name', 'created', 'is_correct'
+    ).iterator(chunk_size=5000)
+    for user_name, rows in groupby(attempts, key=itemgetter(0)):
+        stats.setdefault(user_name, {}).update(walk_streaks((created, is_correct) for _, created, is_correct in rows))
+    return stats
+
+
+def rebuild_user_stats():
+    """Dựng lại toàn bộ UserStats; trả về số dòng"""
+    rows = [UserStats(user_name=user_name, **values) for user_name, values in aggregate_user_stats().items()]
+    with transaction.atomic():
+        UserStats.objects.all().delete()
+        UserStats.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -7,13 +7,26 @@ from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.core.mail import EmailMessage
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.conf import settings
-from .models import Site, Feedback, Quiz, QuizAttempt, QuizBattle, QuizBattleParticipant, UserProfile, Achievement, UserAchievement, UserRole
-from .serializers import SiteSerializer, FeedbackSerializer, QuizSerializer, QuizAttemptSerializer, QuizBattleSerializer, QuizBattleParticipantSerializer
+from django.db import transaction
+from .models import Site, Feedback, Quiz, QuizAttempt, QuizBattle, QuizBattleParticipant, Tournament, UserProfile, Achievement, UserAchievement, UserRole, SiteTombstone, SearchDocument, BattleEvent, BattleAnswer
+from .serializers import SiteSerializer, FeedbackSerializer, QuizSerializer, QuizAttemptSerializer, QuizBattleSerializer, QuizBattleParticipantSerializer, TournamentSerializer
 from .authentication import CsrfExemptSessionAuthentication
+from .site_cache import site_feature, get_sites_payload, get_versioned_payload, get_sites_version, cached_json_response, encode_json, make_etag, etag_matches
+from .spatial import get_site_index, get_nearby_index, parse_bbox, sites_feature_collection, sites_summary_collection, cluster_feature_collection
+from . import search, achievements, user_stats, battle_events, battle_factory, battle_gateway, battle_lifecycle, tournaments, leaderboard as leaderboard_store
+from .battle_events import leaderboard_payload, question_status_payload
+from .battle_ranks import RankedList, rank_key, locked_participants
+from .itinerary import plan_itinerary, DEFAULT_TIME_BUDGET_MS, MAX_TIME_BUDGET_MS, MAX_ITINERARY_SITES
+from .log_cursor import GAP_SECONDS
+from .mvt import get_site_tile, TILE_CONTENT_TYPE, TILE_LAYER_NAME, TILE_MAX_ZOOM
 import jwt
 import base64
 import logging
+import math
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
@@ -49,23 +62,28 @@ def login_view(request):
 @permission_classes([AllowAny])
 def sites_geojson(request):
     if request.method == 'GET':
-        qs = Site.objects.all()
-        features = []
-        for s in qs:
-            # Get the base geojson feature
-            feature = s.geojson.copy() if isinstance(s.geojson, dict) else s.geojson
-            
-            # Ensure properties exist
-            if 'properties' not in feature:
-                feature['properties'] = {}
-            
-            # Add additional fields to properties
-            feature['properties']['conservation_status'] = s.conservation_status
-            feature['properties']['status_description'] = s.status_description
-            feature['properties']['conduct'] = s.conduct
-            
-            features.append(feature)
-        return Response({'type': 'FeatureCollection', 'features': features})
+        bbox_param = request.query_params.get('bbox')
+        zoom_param = request.query_params.get('zoom')
+        
+        if not bbox_param and not zoom_param:
+            # FeatureCollection đã serialize sẵn theo version của bảng Site
+            etag, body = get_sites_payload()
+            return cached_json_response(request, etag, body)
+        
+        # Lọc theo khung nhìn bản đồ (bbox) và rút gọn thuộc tính ở zoom xa
+        try:
+            bbox = parse_bbox(bbox_param) if bbox_param else None
+            zoom = int(zoom_param) if zoom_param else None
+        except ValueError:
+            return Response(
+                {'error': 'bbox phải có dạng minLng,minLat,maxLng,maxLat và zoom phải là số nguyên'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        etag = make_etag(f'{get_sites_version()}|{bbox}|{zoom}'.encode())
+        return cached_json_response(
+            request, etag, lambda: encode_json(sites_feature_collection(bbox, zoom))
+        )
     
     elif request.method == 'POST':
         # Check if user has permission to create sites (only authenticated users with proper role)
@@ -86,6 +104,228 @@ def sites_geojson(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def sites_summary(request):
+    """Danh sách tóm tắt cho bản đồ: id, tên, toạ độ, trạng thái, ảnh đại diện"""
+    etag, body = get_versioned_payload('summary', sites_summary_collection)
+    return cached_json_response(request, etag, body)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def site_detail(request, site_id):
+    """Toàn bộ thuộc tính của một địa điểm (history, conduct, ...), tải khi mở chi tiết"""
+    entry = get_site_index().by_site_id.get(site_id)
+    if entry is None:
+        return Response({'error': 'Không tìm thấy địa điểm'}, status=status.HTTP_404_NOT_FOUND)
+    
+    # ETag theo thời điểm cập nhật của riêng địa điểm này
+    updated = entry.updated.isoformat() if entry.updated else ''
+    etag = make_etag(f'detail|{site_id}|{updated}'.encode())
+    return cached_json_response(request, etag, lambda: encode_json(entry.feature))
+
+
+SITE_CHANGES_WINDOW = timedelta(seconds=GAP_SECONDS)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def site_changes(request):
+    """
+    Đồng bộ tăng dần cho client offline / kiosk: ?since=<cursor>
+    Trả về các địa điểm thêm / sửa sau cursor và site_id đã bị xóa.
+    Không có since -> trả toàn bộ danh sách (lần đồng bộ đầu tiên).
+    updated / tombstone được ghi lúc lưu, trước khi commit: đọc lùi SITE_CHANGES_WINDOW trước
+    cursor để thay đổi commit muộn không bị bỏ sót (client áp dụng lặp lại vẫn đúng).
+    """
+    from datetime import timezone as dt_timezone
+    from django.utils import timezone
+    from dateutil import parser
+    
+    since_param = request.query_params.get('since')
+    since = None
+    if since_param:
+        try:
+            since = parser.isoparse(since_param)
+        except ValueError:
+            return Response({'error': 'since không hợp lệ (ISO 8601)'}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since, dt_timezone.utc)
+    
+    sites = Site.objects.order_by('updated')
+    tombstones = SiteTombstone.objects.none()
+    if since is not None:
+        window_start = since - SITE_CHANGES_WINDOW
+        sites = sites.filter(updated__gt=window_start)
+        tombstones = SiteTombstone.objects.filter(deleted_at__gt=window_start)
+    
+    sites = list(sites)
+    tombstones = list(tombstones)
+    
+    # Cursor = mốc thay đổi mới nhất đã trả về (giữ nguyên nếu không có gì mới)
+    latest = max([s.updated for s in sites] + [t.deleted_at for t in tombstones], default=since)
+    cursor = latest.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ') if latest else None
+    
+    # Địa điểm bị xóa rồi tạo lại với cùng site_id chỉ xuất hiện trong updated
+    updated_ids = {s.site_id for s in sites}
+    deleted = sorted({t.site_id for t in tombstones} - updated_ids)
+    
+    return Response({
+        'cursor': cursor,
+        'full': since is None,
+        'updated': [site_feature(s) for s in sites],
+        'deleted': deleted,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def sites_nearby(request):
+    """Các di tích gần vị trí người dùng: ?lat=&lng=&radius_km=10&limit=10"""
+    try:
+        lat = float(request.query_params['lat'])
+        lng = float(request.query_params['lng'])
+        radius_km = float(request.query_params.get('radius_km', 10))
+        limit = int(request.query_params.get('limit', 10))
+    except (KeyError, ValueError):
+        return Response(
+            {'error': 'lat, lng là bắt buộc; radius_km, limit phải là số'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return Response({'error': 'Toạ độ không hợp lệ'}, status=status.HTTP_400_BAD_REQUEST)
+    radius_km = min(max(radius_km, 0), 500)
+    limit = min(max(limit, 1), 100)
+    
+    results = get_nearby_index().query(lat, lng, radius_km, limit)
+    return Response({
+        'count': len(results),
+        'results': [{
+            'id': entry.site_id,
+            'name': entry.name,
+            'conservation_status': entry.conservation_status,
+            'thumbnail': entry.thumbnail,
+            'coordinates': list(entry.point),
+            'distance_km': round(distance, 3),
+        } for entry, distance in results],
+    })
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def site_itinerary(request):
+    """
+    Lập lộ trình tham quan ngắn nhất qua các địa điểm
+    Body: {
+        "start": {"lat": 16.75, "lng": 107.19},
+        "site_ids": ["thanh_co_quang_tri", "diadaovinhmoc", ...],
+        "return_to_start": false,
+        "time_budget_ms": 50
+    }
+    """
+    start = request.data.get('start') or {}
+    site_ids = request.data.get('site_ids') or []
+    return_to_start = bool(request.data.get('return_to_start', False))
+    
+    try:
+        lat, lng = float(start['lat']), float(start['lng'])
+        time_budget_ms = float(request.data.get('time_budget_ms', DEFAULT_TIME_BUDGET_MS))
+    except (KeyError, TypeError, ValueError):
+        return Response(
+            {'error': 'start phải có dạng {"lat": ..., "lng": ...}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # float() nhận cả "nan" / "inf": NaN lọt qua min/max và không serialize được ra JSON
+    if not all(math.isfinite(value) for value in (lat, lng, time_budget_ms)):
+        return Response(
+            {'error': 'start.lat, start.lng, time_budget_ms phải là số hữu hạn'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return Response({'error': 'Toạ độ không hợp lệ'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not isinstance(site_ids, list) or not site_ids:
+        return Response({'error': 'site_ids là bắt buộc'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(site_ids) > MAX_ITINERARY_SITES:
+        return Response(
+            {'error': f'Tối đa {MAX_ITINERARY_SITES} địa điểm'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    time_budget_ms = min(max(time_budget_ms, 1), MAX_TIME_BUDGET_MS)
+    try:
+        itinerary = plan_itinerary((lat, lng), [str(sid) for sid in site_ids], return_to_start, time_budget_ms)
+    except KeyError as e:
+        return Response(
+            {'error': f'Không tìm thấy địa điểm hoặc địa điểm chưa có toạ độ: {", ".join(e.args[0])}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return Response(itinerary)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def site_clusters(request):
+    """Các cụm marker đã tính sẵn theo zoom: ?zoom=&bbox=minLng,minLat,maxLng,maxLat"""
+    bbox_param = request.query_params.get('bbox')
+    try:
+        zoom = int(request.query_params.get('zoom', 0))
+        bbox = parse_bbox(bbox_param) if bbox_param else None
+    except ValueError:
+        return Response(
+            {'error': 'bbox phải có dạng minLng,minLat,maxLng,maxLat và zoom phải là số nguyên'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    etag = make_etag(f'clusters|{get_sites_version()}|{bbox}|{zoom}'.encode())
+    return cached_json_response(request, etag, lambda: encode_json(cluster_feature_collection(zoom, bbox)))
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def site_tile(request, z, x, y):
+    """Vector tile (MVT) các di tích tại z/x/y"""
+    if z > TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return Response({'error': 'Tile không hợp lệ'}, status=status.HTTP_404_NOT_FOUND)
+    
+    version, data = get_site_tile(z, x, y)
+    etag = make_etag(f'tile|{version}|{z}/{x}/{y}'.encode())
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(data, content_type=TILE_CONTENT_TYPE)
+    response['ETag'] = etag
+    if request.query_params.get('v') == str(version):
+        # URL có version (lấy từ tiles.json) -> nội dung không bao giờ đổi
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def site_tilejson(request):
+    """TileJSON mô tả layer di tích, URL tile gắn version hiện tại để cache lâu dài"""
+    tile_url = request.build_absolute_uri('/api/heritage/tiles/')
+    return Response({
+        'tilejson': '2.2.0',
+        'name': 'heritage-sites',
+        'scheme': 'xyz',
+        'minzoom': 0,
+        'maxzoom': TILE_MAX_ZOOM,
+        'tiles': [f'{tile_url}{{z}}/{{x}}/{{y}}.mvt?v={get_sites_version()}'],
+        'vector_layers': [{
+            'id': TILE_LAYER_NAME,
+            'fields': {'id': 'String', 'name': 'String', 'conservation_status': 'String'},
+        }],
+    }, headers={'Cache-Control': 'no-cache'})
+
+
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def site_delete(request, site_id):
@@ -127,6 +367,50 @@ def site_update(request, site_id):
         return Response({'error': 'Không tìm thấy địa điểm'}, status=status.HTTP_404_NOT_FOUND)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search_view(request):
+    """
+    Tìm kiếm toàn văn (không phân biệt dấu): ?q=thanh co&type=site,quiz&page=1&page_size=20
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q là bắt buộc'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    kinds = [k for k in request.query_params.get('type', '').split(',') if k]
+    valid_kinds = {choice[0] for choice in SearchDocument.KIND_CHOICES}
+    if any(k not in valid_kinds for k in kinds):
+        return Response(
+            {'error': f'type phải thuộc: {", ".join(sorted(valid_kinds))}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        page = max(int(request.query_params.get('page', 1)), 1)
+        page_size = min(max(int(request.query_params.get('page_size', 20)), 1), 100)
+    except ValueError:
+        page, page_size = 1, 20
+    
+    total, hits = search.search(query, kinds=kinds, limit=page_size, offset=(page - 1) * page_size)
+    total_pages = (total + page_size - 1) // page_size
+    
+    return Response({
+        'results': [{
+            'type': doc.kind,
+            'id': doc.object_id,
+            'site_id': doc.site_id,
+            'title': doc.title,
+            'snippet': search.snippet(doc),
+            'rank': round(rank, 4),
+        } for doc, rank in hits],
+        'count': total,
+        'total_pages': total_pages,
+        'current_page': page,
+        'has_next': page < total_pages,
+        'has_previous': page > 1,
+    })
+
+
 @api_view(['POST'])
 def feedback_create(request):
     from django.utils import timezone
@@ -327,7 +611,7 @@ class QuizViewSet(viewsets.ModelViewSet):
                 }
                 
                 # Check and unlock achievements
-                unlocked_achievements = check_and_unlock_achievements(profile, user_name)
+                unlocked_achievements = achievements.unlock_achievements(profile, achievements.QUIZ_ANSWERED)
             except Exception as e:
                 print(f"Error updating XP/achievements: {e}")
                 pass  # Continue even if XP update fails
@@ -370,41 +654,29 @@ class QuizAttemptViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['get'])
     def leaderboard(self, request):
-        """Bảng xếp hạng học sinh theo điểm và thời gian"""
-        from django.db.models import Count, Sum, Q
-        
+        """
+        Bảng xếp hạng học sinh theo điểm và thời gian.
+        Toàn cục: đọc bảng xếp hạng trong bộ nhớ; theo site_id: đọc UserSiteStats.
+        Phân trang bằng offset / limit (tổng số người trong header X-Total-Count).
+        """
         site_id = request.query_params.get('site_id')
         
-        # Lấy tất cả attempts
-        attempts = QuizAttempt.objects.all()
-        if site_id:
-            attempts = attempts.filter(quiz__site__site_id=site_id)
-        
-        # Nhóm theo user_name và tính điểm
-        leaderboard = attempts.values('user_name').annotate(
-            total_questions=Count('id'),
-            correct_answers=Count('id', filter=Q(is_correct=True)),
-            total_time=Sum('time_taken'),
-            total_xp=Sum('xp_earned')
-        ).order_by('-total_questions', '-correct_answers', 'total_time')
-        
-        # Thêm thứ hạng
-        ranked_leaderboard = []
-        for rank, entry in enumerate(leaderboard, start=1):
-            score_percentage = (entry['correct_answers'] / entry['total_questions'] * 100) if entry['total_questions'] > 0 else 0
-            ranked_leaderboard.append({
-                'rank': rank,
-                'user_name': entry['user_name'],
-                'total_questions': entry['total_questions'],
-                'correct_answers': entry['correct_answers'],
-                'wrong_answers': entry['total_questions'] - entry['correct_answers'],
-                'score_percentage': round(score_percentage, 1),
-                'total_xp': entry['total_xp'] or 0,
-                'total_time': entry['total_time'] or 0,
-                'average_time': round((entry['total_time'] or 0) / entry['total_questions'], 1) if entry['total_questions'] > 0 else 0
-            })
+        try:
+            offset, limit = leaderboard_store.parse_page(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        return Response(ranked_leaderboard)
+        if site_id:
+            # Theo địa điểm: đọc bảng tổng hợp UserSiteStats
+            page = leaderboard_store.scope_page('site', site_id, offset, limit)
+            response = Response(page['results'])
+            response['X-Total-Count'] = page['count']
+            return response
+        
+        board = leaderboard_store.get_board('quiz')
+        response = Response(leaderboard_store.quiz_entries(board.page(offset, limit)))
+        response['X-Total-Count'] = len(board)
+        return response
 
 
 class IsTeacherOrSuperAdmin(BasePermission):
@@ -435,33 +707,19 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
     serializer_class = QuizBattleSerializer
     
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy', 'create_random_battle', 'create_battle', 'start_battle', 'end_battle']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'create_random_battle', 'create_battle', 'create_tournament', 'start_battle', 'end_battle']:
             return [IsAuthenticated(), IsTeacherOrSuperAdmin()]
         return [AllowAny()]
     
     def list(self, request, *args, **kwargs):
-        """Override list to auto-update battle status based on time"""
-        from django.utils import timezone
-        now = timezone.now()
-        
-        # Auto-start pending battles that have reached scheduled time
-        pending_battles = QuizBattle.objects.filter(
-            status='pending',
-            scheduled_start_time__lte=now
-        )
-        for battle in pending_battles:
-            battle.status = 'in_progress'
-            battle.save()
-        
-        # Auto-complete in_progress battles that have exceeded duration
-        in_progress_battles = QuizBattle.objects.filter(status='in_progress')
-        for battle in in_progress_battles:
-            end_time = battle.scheduled_start_time + timezone.timedelta(minutes=battle.duration_minutes)
-            if now >= end_time:
-                battle.status = 'completed'
-                battle.save()
-        
-        return super().list(request, *args, **kwargs)
+        """
+        Danh sách battle (chỉ đọc). Trạng thái theo thời gian do
+        run_battle_scheduler cập nhật; client gửi If-None-Match để nhận 304.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer(queryset, many=True)
+        body = encode_json(serializer.data)
+        return cached_json_response(request, make_etag(body), body)
     
     @action(detail=False, methods=['post'])
     def create_random_battle(self, request):
@@ -473,8 +731,6 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
             "question_count": 6
         }
         """
-        from django.utils import timezone
-        from django.db.models import Sum, Q
         import random
         
         scheduled_start_time = request.data.get('scheduled_start_time')
@@ -487,48 +743,30 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Lấy top users từ leaderboard (có XP > 0)
-        leaderboard = QuizAttempt.objects.values('user_name').annotate(
-            total_xp=Sum('xp_earned')
-        ).filter(total_xp__gt=0).order_by('-total_xp')
+        # Lấy top users từ snapshot leaderboard (có XP > 0)
+        leaderboard = battle_factory.xp_leaderboard_snapshot()
         
-        if leaderboard.count() < 4:
+        if len(leaderboard) < 4:
             return Response(
-                {'error': f'Cần ít nhất 4 người chơi có điểm. Hiện có {leaderboard.count()} người.'}, 
+                {'error': f'Cần ít nhất 4 người chơi có điểm. Hiện có {len(leaderboard)} người.'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         # Random 4 người từ top 20 (hoặc ít hơn nếu không đủ)
-        top_users = list(leaderboard[:20])
+        top_users = leaderboard[:20]
         selected_users = random.sample(top_users, min(4, len(top_users)))
-        participant_names = [u['user_name'] for u in selected_users]
+        participant_names = [user_name for user_name, _ in selected_users]
         
-        # Random 6 câu hỏi từ tất cả các quiz
-        all_quizzes = list(Quiz.objects.values_list('id', flat=True))
-        if len(all_quizzes) < question_count:
-            return Response(
-                {'error': f'Không đủ câu hỏi. Cần {question_count} câu, hiện có {len(all_quizzes)} câu.'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        selected_questions = random.sample(all_quizzes, question_count)
+        # Random câu hỏi từ tất cả các quiz
+        try:
+            question_sets = battle_factory.sample_question_sets(question_count)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Tạo battle
-        battle = QuizBattle.objects.create(
-            scheduled_start_time=scheduled_start_time,
-            duration_minutes=duration_minutes,
-            status='pending',
-            questions=selected_questions,
-            participants=participant_names
+        battle, = battle_factory.create_battles(
+            [participant_names], question_sets, scheduled_start_time, duration_minutes
         )
         
-        # Tạo battle participants
-        for username in participant_names:
-            QuizBattleParticipant.objects.create(
-                battle=battle,
-                user_name=username
-            )
-        
         serializer = self.get_serializer(battle)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -543,10 +781,6 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
             "participants": ["user1", "user2", "user3", "user4"]
         }
         """
-        from django.utils import timezone
-        from django.db.models import Sum
-        import random
-        
         scheduled_start_time = request.data.get('scheduled_start_time')
         duration_minutes = request.data.get('duration_minutes', 10)
         question_count = request.data.get('question_count', 6)
@@ -571,8 +805,7 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
             )
         
         # Kiểm tra các user có tồn tại trong hệ thống không (đã đăng ký)
-        from django.contrib.auth.models import User
-        existing_users = User.objects.filter(username__in=participants).values_list('username', flat=True)
+        existing_users = set(User.objects.filter(username__in=participants).values_list('username', flat=True))
         
         invalid_users = [user for user in participants if user not in existing_users]
         if invalid_users:
@@ -582,32 +815,70 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
             )
         
         # Random câu hỏi từ tất cả các quiz
-        all_quizzes = list(Quiz.objects.values_list('id', flat=True))
-        if len(all_quizzes) < question_count:
+        try:
+            question_sets = battle_factory.sample_question_sets(question_count)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        battle, = battle_factory.create_battles(
+            [participants], question_sets, scheduled_start_time, duration_minutes
+        )
+        
+        serializer = self.get_serializer(battle)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['post'])
+    def create_tournament(self, request):
+        """
+        Tạo cùng lúc nhiều battle (mỗi bảng một battle) cho giải đấu cả lớp / cả trường
+        Body: {
+            "scheduled_start_time": "2024-01-01T10:00:00Z",
+            "duration_minutes": 10,
+            "question_count": 6,
+            "group_count": 16,
+            "group_size": 4,                  // 2-8, dùng khi lấy người chơi từ leaderboard
+            "participants": ["user1", ...],   // tùy chọn, mặc định lấy top XP
+            "shared_questions": true          // mọi bảng cùng bộ câu hỏi
+        }
+        Người chơi được chia bảng theo kiểu rắn theo XP để các bảng cân sức.
+        """
+        scheduled_start_time = request.data.get('scheduled_start_time')
+        duration_minutes = request.data.get('duration_minutes', 10)
+        question_count = request.data.get('question_count', 6)
+        participants = request.data.get('participants')
+        shared_questions = request.data.get('shared_questions', True)
+        
+        if not scheduled_start_time:
             return Response(
-                {'error': f'Không đủ câu hỏi. Cần {question_count} câu, hiện có {len(all_quizzes)} câu.'}, 
+                {'error': 'scheduled_start_time là bắt buộc'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        selected_questions = random.sample(all_quizzes, question_count)
+        try:
+            group_count = int(request.data.get('group_count', 0))
+            group_size = int(request.data.get('group_size', 4))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'group_count, group_size phải là số nguyên'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Tạo battle
-        battle = QuizBattle.objects.create(
-            scheduled_start_time=scheduled_start_time,
-            duration_minutes=duration_minutes,
-            status='pending',
-            questions=selected_questions,
-            participants=participants
-        )
+        try:
+            groups = battle_factory.plan_groups(participants, group_count, group_size)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Tạo battle participants
-        for username in participants:
-            QuizBattleParticipant.objects.create(
-                battle=battle,
-                user_name=username
-            )
+        try:
+            if shared_questions:
+                question_sets = battle_factory.sample_question_sets(question_count) * group_count
+            else:
+                question_sets = battle_factory.sample_question_sets(question_count, group_count)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = self.get_serializer(battle)
+        battles = battle_factory.create_battles(groups, question_sets, scheduled_start_time, duration_minutes)
+        
+        serializer = self.get_serializer(battles, many=True)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
     @action(detail=True, methods=['post'])
@@ -617,16 +888,14 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
         
         battle = self.get_object()
         
-        if battle.status != 'pending':
+        # Cập nhật thời gian bắt đầu thực tế; chỉ thành công nếu scheduler chưa bắt đầu trước
+        if not battle_lifecycle.start_battle(battle, started_at=timezone.now()):
+            battle.refresh_from_db(fields=['status'])
             return Response(
                 {'error': f'Battle đang ở trạng thái {battle.status}, không thể bắt đầu'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        battle.status = 'in_progress'
-        battle.scheduled_start_time = timezone.now()  # Cập nhật thời gian bắt đầu thực tế
-        battle.save()
-        
         serializer = self.get_serializer(battle)
         return Response(serializer.data)
     
@@ -654,18 +923,21 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
         
         battle = self.get_object()
         
-        if battle.status == 'completed':
+        # Phòng WebSocket đang giữ các câu trả lời chưa ghi: phòng ghi xong rồi tự chốt battle
+        if battle.status == 'in_progress' and battle_gateway.room_is_open(battle.id):
+            battle_gateway.request_end(battle.id)
+            return Response(
+                {'message': 'Battle đang được kết thúc, kết quả sẽ được chốt sau khi ghi xong các câu trả lời'},
+                status=status.HTTP_202_ACCEPTED
+            )
+        
+        # Chuyển trạng thái + chốt ranks cuối cùng (một lần duy nhất, kể cả khi scheduler chạy cùng lúc)
+        if not battle_lifecycle.complete_battle(battle):
             return Response(
                 {'error': 'Battle đã kết thúc rồi'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        battle.status = 'completed'
-        battle.save()
-        
-        # Cập nhật ranks cuối cùng
-        self._update_battle_ranks(battle)
-        
         serializer = self.get_serializer(battle)
         return Response({
             'message': 'Đã kết thúc battle thành công',
@@ -676,24 +948,7 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
     def live_leaderboard(self, request, pk=None):
         """Lấy bảng xếp hạng realtime của battle"""
         battle = self.get_object()
-        participants = battle.battle_participants.all().order_by('-score', 'time_completed')
-        
-        leaderboard = []
-        for idx, p in enumerate(participants, 1):
-            leaderboard.append({
-                'rank': idx,
-                'user_name': p.user_name,
-                'score': p.score,
-                'correct_answers': p.correct_answers,
-                'time_completed': p.time_completed,
-                'finished': p.finished_at is not None,
-            })
-        
-        return Response({
-            'battle_id': battle.id,
-            'status': battle.status,
-            'leaderboard': leaderboard
-        })
+        return Response(leaderboard_payload(battle))
     
     @action(detail=True, methods=['get'])
     def my_progress(self, request, pk=None):
@@ -719,10 +974,9 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
         answers = {}
         results = {}
         
-        for quiz_id_str, answer_data in participant.answers.items():
-            quiz_id = int(quiz_id_str)
-            answers[quiz_id] = answer_data['answer']
-            results[quiz_id] = answer_data['is_correct']
+        for quiz_id, answer, is_correct in participant.battle_answers.values_list('quiz_id', 'answer', 'is_correct'):
+            answers[quiz_id] = answer
+            results[quiz_id] = is_correct
         
         return Response({
             'answers': answers,
@@ -735,56 +989,7 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
     def current_question_status(self, request, pk=None):
         """Lấy trạng thái câu hỏi hiện tại của battle"""
         battle = self.get_object()
-        
-        if battle.status != 'in_progress':
-            return Response({
-                'battle_id': battle.id,
-                'status': battle.status,
-                'current_question_index': 0,
-                'question_solved': False,
-                'solved_by': None,
-                'correct_answer': None
-            })
-        
-        # Tìm câu hỏi hiện tại (câu hỏi đầu tiên chưa được ai trả lời đúng)
-        current_question_index = 0
-        question_solved = False
-        solved_by = None
-        correct_answer = None
-        
-        for idx, quiz_id in enumerate(battle.questions):
-            # Kiểm tra xem có ai trả lời đúng câu này chưa
-            participants_answered_correct = battle.battle_participants.filter(
-                answers__has_key=str(quiz_id)
-            ).filter(
-                answers__contains={str(quiz_id): {'is_correct': True}}
-            )
-            
-            if participants_answered_correct.exists():
-                # Có người trả lời đúng câu này
-                solved_by = participants_answered_correct.first().user_name
-                try:
-                    quiz = Quiz.objects.get(id=quiz_id)
-                    correct_answer = quiz.correct_answer
-                except Quiz.DoesNotExist:
-                    correct_answer = None
-                question_solved = True
-                current_question_index = idx
-                break
-            else:
-                # Chưa có ai trả lời đúng, đây là câu hỏi hiện tại
-                current_question_index = idx
-                break
-        
-        return Response({
-            'battle_id': battle.id,
-            'status': battle.status,
-            'current_question_index': current_question_index,
-            'question_solved': question_solved,
-            'solved_by': solved_by,
-            'correct_answer': correct_answer,
-            'total_questions': len(battle.questions)
-        })
+        return Response(question_status_payload(battle))
     
     @action(detail=True, methods=['post'])
     def submit_answer(self, request, pk=None):
@@ -805,6 +1010,13 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Battle đang chạy qua WebSocket: trạng thái nằm trong phòng, không ghi song song
+        if battle_gateway.room_is_open(battle.id):
+            return Response(
+                {'error': 'Battle đang diễn ra qua WebSocket, hãy gửi câu trả lời qua kết nối /ws/battles/'}, 
+                status=status.HTTP_409_CONFLICT
+            )
+        
         user_name = request.data.get('user_name')
         quiz_id = request.data.get('quiz_id')
         answer = request.data.get('answer')
@@ -816,6 +1028,13 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        answer = str(answer).upper()
+        if answer not in ['A', 'B', 'C', 'D']:
+            return Response(
+                {'error': 'Vui lòng chọn câu trả lời (A, B, C hoặc D)'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # Kiểm tra user có trong battle không
         if user_name not in battle.participants:
             return Response(
@@ -830,22 +1049,6 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Lấy participant
-        try:
-            participant = battle.battle_participants.get(user_name=user_name)
-        except QuizBattleParticipant.DoesNotExist:
-            return Response(
-                {'error': 'Không tìm thấy participant'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        # Kiểm tra đã trả lời câu này chưa
-        if str(quiz_id) in participant.answers:
-            return Response(
-                {'error': 'Bạn đã trả lời câu này rồi'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         # Lấy quiz và check đáp án
         try:
             quiz = Quiz.objects.get(id=quiz_id)
@@ -855,53 +1058,139 @@ class QuizBattleViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        is_correct = (answer.upper() == quiz.correct_answer.upper())
-        
-        # Cập nhật participant
-        participant.answers[str(quiz_id)] = {
-            'answer': answer,
+        is_correct = (answer == quiz.correct_answer.upper())
+        
+        # Khoá các participant của battle: hai người nộp cùng lúc được xử lý tuần tự,
+        # không ai đọc phải hạng / câu trả lời cũ
+        with transaction.atomic():
+            participants = locked_participants(battle)
+            participant = next((p for p in participants if p.user_name == user_name), None)
+            if participant is None:
+                return Response(
+                    {'error': 'Không tìm thấy participant'}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            # Kiểm tra đã trả lời câu này chưa
+            if BattleAnswer.objects.filter(participant=participant, quiz=quiz).exists():
+                return Response(
+                    {'error': 'Bạn đã trả lời câu này rồi'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            ranking = RankedList(participants)
+            changed = set(ranking.assign_ranks())  # thường rỗng, chỉ sửa hạng cũ bị lệch
+            old_key = rank_key(participant)
+            
+            # Lấy trạng thái giải trước khi ghi câu trả lời (nếu phải dựng lại từ BattleAnswer)
+            solve_state = battle_events.solve_state_for_update(battle) if is_correct else None
+            
+            # Ghi câu trả lời, cập nhật bộ đếm của participant
+            BattleAnswer.objects.create(
+                battle=battle,
+                participant=participant,
+                quiz=quiz,
+                answer=answer,
+                is_correct=is_correct,
+                time_taken=time_taken
+            )
+            participant.total_answered += 1
+            
+            if is_correct:
+                participant.score += quiz.xp_reward
+                participant.correct_answers += 1
+            
+            # Cập nhật tổng thời gian
+            if participant.time_completed is None:
+                participant.time_completed = 0
+            participant.time_completed += time_taken
+            
+            # Kiểm tra đã hoàn thành hết câu hỏi chưa
+            if participant.total_answered == len(battle.questions):
+                from django.utils import timezone
+                participant.finished_at = timezone.now()
+            
+            # Chỉ dời người vừa trả lời, ghi hạng mới bằng một câu UPDATE
+            changed.update(ranking.reposition(participant, old_key))
+            changed.discard(participant)
+            participant.save(update_fields=['score', 'correct_answers', 'total_answered', 'time_completed', 'finished_at', 'rank'])
+            if changed:
+                QuizBattleParticipant.objects.bulk_update(list(changed), ['rank'])
+            
+            # Trạng thái giải câu hỏi (current_question_status đọc trực tiếp)
+            first_solve = False
+            if solve_state is not None:
+                first_solve = solve_state.record_solve(battle.questions, quiz_id, user_name, quiz.correct_answer)
+                if first_solve:
+                    solve_state.save()
+        
+        # Đẩy sự kiện cho các client đang theo dõi battle
+        battle_events.publish(battle, 'answer-submitted', {
+            'user_name': user_name,
+            'quiz_id': quiz_id,
             'is_correct': is_correct,
-            'time_taken': time_taken
-        }
-        
-        if is_correct:
-            participant.score += quiz.xp_reward
-            participant.correct_answers += 1
-        
-        # Cập nhật tổng thời gian
-        if participant.time_completed is None:
-            participant.time_completed = 0
-        participant.time_completed += time_taken
-        
-        # Kiểm tra đã hoàn thành hết câu hỏi chưa
-        if len(participant.answers) == len(battle.questions):
-            from django.utils import timezone
-            participant.finished_at = timezone.now()
-        
-        participant.save()
-        
-        # Update ranks
-        self._update_battle_ranks(battle)
+            'answers_completed': participant.total_answered,
+        })
+        if first_solve:
+            battle_events.publish(battle, 'question-solved', {
+                'battle_id': battle.id,
+                'status': battle.status,
+                'current_question_index': battle.questions.index(quiz_id),
+                'question_solved': True,
+                'solved_by': user_name,
+                'correct_answer': quiz.correct_answer,
+                'total_questions': len(battle.questions),
+            })
+        battle_events.publish_ranks_changed(battle)
         
         return Response({
             'is_correct': is_correct,
             'correct_answer': quiz.correct_answer,
             'score': participant.score,
-            'answers_completed': len(participant.answers),
+            'answers_completed': participant.total_answered,
             'total_questions': len(battle.questions)
         })
+
+
+def battle_events_stream(request, pk):
+    """
+    Server-Sent Events của battle: question-solved, answer-submitted,
+    rank-changed, status-changed. Thay cho polling current_question_status
+    và live_leaderboard. Client kết nối lại bằng header Last-Event-ID.
+    Battle đã kết thúc và không còn sự kiện sau Last-Event-ID: 204 (EventSource ngừng kết nối lại).
+    """
+    if request.method != 'GET':
+        return HttpResponse(status=405)
+    battle_status = QuizBattle.objects.filter(pk=pk).values_list('status', flat=True).first()
+    if battle_status is None:
+        return HttpResponse(status=404)
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        # Kết nối mới: chỉ nhận sự kiện từ thời điểm này
+        latest = BattleEvent.objects.filter(battle_id=pk).order_by('-id').values_list('id', flat=True).first()
+        last_id = latest or 0
     
-    def _update_battle_ranks(self, battle):
-        """Cập nhật rank cho tất cả participants"""
-        participants = battle.battle_participants.all().order_by('-score', 'time_completed')
-        for idx, p in enumerate(participants, 1):
-            p.rank = idx
-            p.save(update_fields=['rank'])
+    finished = battle_status in battle_events.FINISHED_STATUSES
+    if finished and not BattleEvent.objects.filter(battle_id=pk, id__gt=last_id).exists():
+        return HttpResponse(status=204)
+    
+    if isinstance(request, ASGIRequest):
+        stream = battle_events.astream_events(pk, last_id)
+    else:
+        stream = battle_events.stream_events(pk, last_id)
+    
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Tắt buffer của nginx
+    return response
 
 
 class QuizBattleParticipantViewSet(viewsets.ReadOnlyModelViewSet):
     """API ViewSet để xem participants của battles"""
-    queryset = QuizBattleParticipant.objects.all().order_by('-score')
+    queryset = QuizBattleParticipant.objects.prefetch_related('battle_answers').order_by('-score')
     serializer_class = QuizBattleParticipantSerializer
     
     def get_permissions(self):
@@ -923,6 +1212,80 @@ class QuizBattleParticipantViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
+class TournamentViewSet(viewsets.ReadOnlyModelViewSet):
+    """API ViewSet cho giải đấu nhiều vòng (loại trực tiếp / Swiss)"""
+    queryset = Tournament.objects.all().order_by('-created_at')
+    serializer_class = TournamentSerializer
+    
+    def get_permissions(self):
+        if self.action == 'create':
+            return [IsAuthenticated(), IsTeacherOrSuperAdmin()]
+        return [AllowAny()]
+    
+    def create(self, request):
+        """
+        Tạo giải đấu và toàn bộ battle vòng 1
+        Body: {
+            "name": "Giải Di sản khối 10",
+            "format": "elimination",          // hoặc "swiss"
+            "scheduled_start_time": "2024-01-01T10:00:00Z",
+            "group_count": 16,
+            "group_size": 4,
+            "participants": ["user1", ...],   // tùy chọn, mặc định lấy top XP
+            "advance_count": 1,               // loại trực tiếp: số người mỗi battle đi tiếp
+            "total_rounds": 3,                // Swiss
+            "question_count": 6,
+            "duration_minutes": 10,
+            "round_gap_minutes": 5
+        }
+        Vòng sau được tạo tự động khi mọi battle của vòng trước kết thúc.
+        """
+        name = request.data.get('name')
+        scheduled_start_time = request.data.get('scheduled_start_time')
+        
+        if not name or not scheduled_start_time:
+            return Response(
+                {'error': 'name, scheduled_start_time là bắt buộc'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            group_count = int(request.data.get('group_count', 0))
+            group_size = int(request.data.get('group_size', 4))
+            settings_fields = {
+                'group_size': group_size,
+                'advance_count': int(request.data.get('advance_count', 1)),
+                'total_rounds': int(request.data['total_rounds']) if request.data.get('total_rounds') else None,
+                'question_count': int(request.data.get('question_count', 6)),
+                'duration_minutes': int(request.data.get('duration_minutes', 10)),
+                'round_gap_minutes': int(request.data.get('round_gap_minutes', 5)),
+            }
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'Các trường số phải là số nguyên'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            groups = battle_factory.plan_groups(request.data.get('participants'), group_count, group_size)
+            tournament = tournaments.create_tournament(
+                name, groups, scheduled_start_time,
+                format=request.data.get('format', 'elimination'), **settings_fields
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = self.get_serializer(tournament)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['get'])
+    def bracket(self, request, pk=None):
+        """Bracket của giải (các vòng, battle, thứ hạng, bảng điểm); hỗ trợ If-None-Match"""
+        tournament = self.get_object()
+        etag, body = tournaments.get_bracket(tournament)
+        return cached_json_response(request, etag, body)
+
+
 # User Profile Views
 @api_view(['GET', 'POST'])
 def user_profile(request):
@@ -976,6 +1339,8 @@ def user_profile(request):
         current_level_xp = profile.current_level_xp
         xp_progress_percentage = profile.xp_progress_percentage
         
+        stats = user_stats.get_stats(profile.user_name)
+        
         # Lấy achievements
         user_achievements = UserAchievement.objects.filter(user=profile).select_related('achievement')
         achievements_data = [{
@@ -1002,6 +1367,8 @@ def user_profile(request):
             'last_active': profile.last_active,
             'achievements': achievements_data,
             'achievement_count': len(achievements_data),
+            'stats': stats,
+            'streak': {field: stats[field] for field in user_stats.STREAK_FIELDS},
             'class_name': class_name,
             'school_name': school_name,
             'role': user_role
@@ -1066,7 +1433,7 @@ def add_user_xp(request):
     new_level = profile.level
     
     # Check achievements
-    unlocked_achievements = check_and_unlock_achievements(profile, user_name)
+    unlocked_achievements = achievements.unlock_achievements(profile, achievements.XP_CHANGED)
     
     return Response({
         'old_xp': profile.total_xp - xp_amount,
@@ -1081,32 +1448,104 @@ def add_user_xp(request):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def leaderboard(request):
-    """Bảng xếp hạng users theo level, sau đó theo XP"""
-    profiles = UserProfile.objects.all().order_by('-level', '-total_xp')
+    """
+    Bảng xếp hạng users theo level, sau đó theo XP.
+    Query params: offset (mặc định 0), limit (mặc định 100, tối đa 500).
+    Tổng số người trong header X-Total-Count.
+    """
+    try:
+        offset, limit = leaderboard_store.parse_page(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    leaderboard_data = []
-    for rank, profile in enumerate(profiles, 1):
-        leaderboard_data.append({
-            'rank': rank,
-            'user_name': profile.user_name,
-            'display_name': profile.display_name,
-            'avatar': profile.avatar.url if profile.avatar else None,
-            'total_xp': profile.total_xp,
-            'level': profile.level,
-            'joined_at': profile.joined_at
-        })
+    board = leaderboard_store.get_board('xp')
+    response = Response(leaderboard_store.xp_entries(board.page(offset, limit)))
+    response['X-Total-Count'] = len(board)
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def leaderboard_rank(request):
+    """
+    Hạng của một người và k người xếp trên / dưới
+    Query params: user_name (mặc định user đang đăng nhập), k (mặc định 5, tối đa 50),
+    board: xp (mặc định) hoặc quiz
+    """
+    user_name = request.query_params.get('user_name') or (request.user.username if request.user.is_authenticated else None)
+    board_name = request.query_params.get('board', 'xp')
+    
+    if not user_name:
+        return Response({'error': 'user_name là bắt buộc hoặc phải đăng nhập'}, status=status.HTTP_400_BAD_REQUEST)
+    if board_name not in leaderboard_store.BOARDS:
+        return Response({'error': 'board phải là xp hoặc quiz'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        k = int(request.query_params.get('k', 5))
+    except ValueError:
+        return Response({'error': 'k phải là số'}, status=status.HTTP_400_BAD_REQUEST)
+    k = max(0, min(k, leaderboard_store.MAX_NEIGHBOURS))
+    
+    board = leaderboard_store.get_board(board_name)
+    rank = board.rank(user_name)
+    if rank is None:
+        return Response({'error': 'Người chơi chưa có trên bảng xếp hạng'}, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({
+        'user_name': user_name,
+        'rank': rank,
+        'total': len(board),
+        'neighbours': leaderboard_store.ENTRY_FORMATTERS[board_name](board.around(user_name, k)),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def scoped_leaderboard(request):
+    """
+    Bảng xếp hạng theo phạm vi, đọc từ bảng tổng hợp và hỗ trợ If-None-Match (304)
+    Query params:
+        scope: site | school | class
+        site_id (scope=site), school_name (scope=school / class), class_name (scope=class)
+            - mặc định trường / lớp của user đang đăng nhập
+        offset, limit
+    """
+    scope = request.query_params.get('scope')
+    if scope not in leaderboard_store.SCOPES:
+        return Response({'error': 'scope phải là site, school hoặc class'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        offset, limit = leaderboard_store.parse_page(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if scope == 'site':
+        key = request.query_params.get('site_id')
+        if not key:
+            return Response({'error': 'site_id là bắt buộc'}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        school_name = request.query_params.get('school_name')
+        class_name = request.query_params.get('class_name')
+        role_info = getattr(request.user, 'role_info', None) if request.user.is_authenticated else None
+        if role_info and not school_name:
+            school_name = role_info.school_name
+            class_name = class_name or role_info.class_name
+        if not school_name or (scope == 'class' and not class_name):
+            return Response(
+                {'error': 'school_name là bắt buộc' if scope == 'school' else 'school_name, class_name là bắt buộc'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        key = school_name if scope == 'school' else leaderboard_store.class_key(school_name, class_name)
     
-    return Response(leaderboard_data)
+    etag, body = leaderboard_store.get_scope_page(scope, key, offset, limit)
+    return cached_json_response(request, etag, body)
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def achievements_list(request):
     """Danh sách tất cả achievements"""
-    achievements = Achievement.objects.all().order_by('rarity', 'name')
-    
     achievements_data = []
-    for achievement in achievements:
+    for achievement in Achievement.objects.all().order_by('rarity', 'name'):
         achievements_data.append({
             'id': achievement.id,
             'name': achievement.name,
@@ -1121,78 +1560,6 @@ def achievements_list(request):
     return Response(achievements_data)
 
 
-def check_and_unlock_achievements(profile, user_name):
-    """Kiểm tra và unlock achievements cho user"""
-    from django.db.models import Count, Sum, Q
-    
-    unlocked = []
-    
-    # Get user stats
-    quiz_attempts = QuizAttempt.objects.filter(user_name=user_name)
-    total_quizzes = quiz_attempts.count()
-    correct_answers = quiz_attempts.filter(is_correct=True).count()
-    total_xp = quiz_attempts.aggregate(total=Sum('xp_earned'))['total'] or 0
-    
-    # Battle stats
-    battle_participants = QuizBattleParticipant.objects.filter(user_name=user_name)
-    battle_wins = battle_participants.filter(rank=1).count()
-    
-    # Unique sites explored
-    unique_sites = QuizAttempt.objects.filter(user_name=user_name).values('quiz__site').distinct().count()
-    
-    # Fastest time (under 5 seconds)
-    fastest_time = quiz_attempts.filter(time_taken__lte=5, is_correct=True).exists()
-    
-    # Perfect battle score
-    perfect_battle = battle_participants.filter(correct_answers__gte=5).exists()  # Assuming 5+ questions
-    
-    # Early morning quiz (before 8 AM)
-    from django.utils import timezone
-    early_morning = quiz_attempts.filter(created__hour__lt=8).exists()
-    
-    # Check each achievement
-    achievements = Achievement.objects.all()
-    for achievement in achievements:
-        # Skip if already unlocked
-        if UserAchievement.objects.filter(user=profile, achievement=achievement).exists():
-            continue
-        
-        unlock = False
-        requirement = achievement.requirement
-        
-        if achievement.achievement_type == 'first_quiz':
-            unlock = total_quizzes >= (requirement.get('total_quizzes', 1))
-        elif achievement.achievement_type == 'quiz_master':
-            if 'total_quizzes' in requirement:
-                unlock = total_quizzes >= requirement['total_quizzes']
-            elif 'level' in requirement:
-                unlock = profile.level >= requirement['level']
-        elif achievement.achievement_type == 'speed_demon':
-            unlock = fastest_time
-        elif achievement.achievement_type == 'perfect_score':
-            unlock = perfect_battle
-        elif achievement.achievement_type == 'battle_winner':
-            unlock = battle_wins >= (requirement.get('battle_wins', 1))
-        elif achievement.achievement_type == 'explorer':
-            unlock = unique_sites >= (requirement.get('unique_sites', 5))
-        elif achievement.achievement_type == 'early_bird':
-            unlock = early_morning
-        
-        if unlock:
-            UserAchievement.objects.create(user=profile, achievement=achievement)
-            profile.add_xp(achievement.xp_reward)
-            unlocked.append({
-                'id': achievement.id,
-                'name': achievement.name,
-                'description': achievement.description,
-                'icon': achievement.icon,
-                'rarity': achievement.rarity,
-                'xp_reward': achievement.xp_reward
-            })
-    
-    return unlocked
-
-
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_system_settings(request):
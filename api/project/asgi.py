@@ -0,0 +1,16 @@
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+
+django_application = get_asgi_application()
+
+from heritage.battle_gateway import battle_websocket  # noqa: E402 (cần Django đã setup)
+
+
+async def application(scope, receive, send):
+    # WebSocket -> cổng battle, còn lại (HTTP, lifespan) -> Django
+    if scope['type'] == 'websocket':
+        await battle_websocket(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -81,9 +81,53 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db' / 'db.sqlite3',  # Local path
+            # Transaction lấy write lock ngay từ đầu: hai request ghi cùng lúc sẽ chờ nhau
+            # thay vì lỗi "database is locked" (SQLite bỏ qua select_for_update)
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            # Test dùng file thay vì SQLite in-memory (shared cache báo "table is locked" ngay,
+            # không chờ timeout) để test ghi song song nhiều thread chạy như thật
+            'TEST': {
+                'NAME': BASE_DIR / 'db' / 'test_db.sqlite3',
+            },
         }
     }
 
+# Cache dùng chung giữa các process (gunicorn worker, ASGI, scheduler). Ngoài snapshot, cache
+# giữ trạng thái điều phối: version bản đồ / bảng xếp hạng / thành tựu, chủ phòng battle,
+# con trỏ sự kiện. Các key này cần incr / add nguyên tử và không bị tự xóa, nên production
+# dùng Redis (REDIS_URL, kiểm tra bằng: python manage.py check --deploy).
+# Không có REDIS_URL: FileBasedCache, chỉ cho máy dev.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+elif os.environ.get('CACHE_BACKEND'):
+    CACHES = {
+        'default': {
+            'BACKEND': os.environ['CACHE_BACKEND'],
+            'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': str(BASE_DIR / 'db' / 'cache'),
+            # Mặc định 300 key rồi xóa ngẫu nhiên 1/3: sẽ xóa cả key version / con trỏ
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
+# Thư mục cache vector tile (MVT) của bản đồ di tích
+TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR', str(BASE_DIR / 'db' / 'tiles'))
+
 AUTH_PASSWORD_VALIDATORS = []
 
 LANGUAGE_CODE = 'vi'
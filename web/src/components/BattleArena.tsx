@@ -7,7 +7,8 @@ import {
   getBattleCurrentQuestionStatus, 
   submitBattleAnswer,
   endBattle,
-  getBattleMyProgress
+  getBattleMyProgress,
+  openBattleEvents
 } from '../services/api';
 import { BattleMusic } from './BattleMusic';
 import { soundEffects } from '../utils/soundEffects';
@@ -36,12 +37,15 @@ interface Battle {
   id: number;
   scheduled_start_time: string;
   duration_minutes: number;
-  status: 'pending' | 'in_progress' | 'completed';
+  status: 'pending' | 'in_progress' | 'completed' | 'cancelled';
   questions: number[];
   participants: string[];
   question_details: BattleQuestion[];
 }
 
+// Trạng thái cuối: server không còn gửi sự kiện (battle_events.FINISHED_STATUSES)
+const isBattleFinished = (status: string) => status === 'completed' || status === 'cancelled';
+
 interface BattleArenaProps {
   battleId: number;
   userName: string;
@@ -73,17 +77,17 @@ export const BattleArena: React.FC<BattleArenaProps> = ({ battleId, userName, on
   const timerRef = useRef<number | null>(null);
   const leaderboardRef = useRef<number | null>(null);
   const questionStatusRef = useRef<number | null>(null);
+  const eventsRef = useRef<EventSource | null>(null);
 
   useEffect(() => {
     loadBattle();
     loadMyProgress(); // Load user's previous answers
-    startLeaderboardPolling();
-    startQuestionStatusPolling();
+    startLiveUpdates();
     checkAdminStatus();
     return () => {
       if (timerRef.current) clearInterval(timerRef.current);
-      if (leaderboardRef.current) clearInterval(leaderboardRef.current);
-      if (questionStatusRef.current) clearInterval(questionStatusRef.current);
+      stopPolling();
+      if (eventsRef.current) eventsRef.current.close();
     };
   }, [battleId]);
 
@@ -175,14 +179,16 @@ export const BattleArena: React.FC<BattleArenaProps> = ({ battleId, userName, on
     return () => clearTimeout(timeout);
   }, [currentQuestionIndex]);
 
-  const loadBattle = async () => {
+  const loadBattle = async (): Promise<Battle | null> => {
     try {
       const data = await getBattle(battleId);
       setBattle(data);
       setLoading(false);
+      return data;
     } catch (err) {
       console.error('Failed to load battle:', err);
       setLoading(false);
+      return null;
     }
   };
 
@@ -198,6 +204,66 @@ export const BattleArena: React.FC<BattleArenaProps> = ({ battleId, userName, on
     }
   };
 
+  // Nhận cập nhật qua SSE; chỉ quay lại polling khi trình duyệt không hỗ trợ
+  // hoặc kết nối lỗi (EventSource tự kết nối lại, khi đó tắt polling).
+  // Battle kết thúc: đóng EventSource sau sự kiện status-changed cuối (server trả 204 nếu kết nối lại)
+  const startLiveUpdates = () => {
+    loadLeaderboard();
+    loadQuestionStatus();
+
+    const source = openBattleEvents(battleId);
+    if (!source) {
+      startLeaderboardPolling();
+      startQuestionStatusPolling();
+      return;
+    }
+    eventsRef.current = source;
+
+    const closeSource = () => {
+      source.close();
+      if (eventsRef.current === source) eventsRef.current = null;
+    };
+
+    source.onopen = () => stopPolling();
+    source.onerror = async () => {
+      if (source.readyState === EventSource.CLOSED) {
+        // Không kết nối lại nữa (204 khi battle đã kết thúc, hoặc lỗi HTTP): polling chỉ khi battle còn diễn ra
+        closeSource();
+        const data = await loadBattle();
+        if (data && isBattleFinished(data.status)) {
+          stopPolling();
+          loadLeaderboard();
+          loadQuestionStatus();
+          return;
+        }
+      }
+      if (!leaderboardRef.current) startLeaderboardPolling();
+      if (!questionStatusRef.current) startQuestionStatusPolling();
+    };
+    source.addEventListener('rank-changed', (e) => {
+      setLeaderboard(JSON.parse((e as MessageEvent).data).leaderboard);
+    });
+    source.addEventListener('question-solved', (e) => {
+      setQuestionStatus(JSON.parse((e as MessageEvent).data));
+    });
+    source.addEventListener('status-changed', (e) => {
+      loadBattle();
+      loadQuestionStatus();
+      if (isBattleFinished(JSON.parse((e as MessageEvent).data).status)) {
+        closeSource();
+        stopPolling();
+        loadLeaderboard();
+      }
+    });
+  };
+
+  const stopPolling = () => {
+    if (leaderboardRef.current) clearInterval(leaderboardRef.current);
+    if (questionStatusRef.current) clearInterval(questionStatusRef.current);
+    leaderboardRef.current = null;
+    questionStatusRef.current = null;
+  };
+
   const startLeaderboardPolling = () => {
     loadLeaderboard();
     leaderboardRef.current = window.setInterval(() => {
@@ -157,6 +157,12 @@ export async function getBattleCurrentQuestionStatus(battleId: number) {
   return res.data;
 }
 
+// Kênh Server-Sent Events của battle (trả về null nếu trình duyệt không hỗ trợ)
+export function openBattleEvents(battleId: number): EventSource | null {
+  if (typeof window === 'undefined' || typeof EventSource === 'undefined') return null;
+  return new EventSource(`${getApiUrl()}/api/heritage/battles/${battleId}/events/`);
+}
+
 export async function submitBattleAnswer(battleId: number, answerData: any) {
   const res = await api.post(`/api/heritage/battles/${battleId}/submit_answer/`, answerData);
   return res.data;